@@ -0,0 +1,154 @@
+import os
+import queue
+import threading
+import time
+from config import ADMIN_EVENTS_INTERVAL
+from logger_manager import get_logger
+from request_events import ALL_REQUESTS
+
+logger = get_logger('admin_events')
+
+class AdminEventHub:
+    """Produce un único flujo de cambios para todas las pestañas del panel
+
+    Un solo hilo por proceso mantiene las solicitudes pendientes y la lista
+    de usuarios, y reparte a cada pestaña conectada solo las diferencias:
+    request_added, request_removed, user_added, user_removed y user_updated
+    (que incluye el avance del tiempo restante). Al conectarse, una pestaña
+    recibe primero un evento snapshot con el estado completo. Abrir más
+    pestañas no genera más consultas a la base de datos ni a MikroTik.
+    """
+
+    def __init__(self, broker, load_request, load_requests, load_users,
+                 interval=ADMIN_EVENTS_INTERVAL):
+        self.broker = broker
+        self.load_request = load_request
+        self.load_requests = load_requests
+        self.load_users = load_users
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._joining = set()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self):
+        """Retorna una cola de eventos (nombre, datos); el primero es el snapshot"""
+        events = queue.Queue()
+        with self._lock:
+            self._ensure_started()
+            self._joining.add(events)
+        self._wakeup.set()
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.discard(events)
+            self._joining.discard(events)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers) + len(self._joining)}
+
+    def _ensure_started(self):
+        # Los hilos no sobreviven a un fork (workers de gunicorn)
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._subscribers = set()
+            self._joining = set()
+            self._thread = threading.Thread(target=self._run, name='admin-events', daemon=True)
+            self._thread.start()
+
+    def _publish(self, name, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            events.put((name, data))
+
+    def _run(self):
+        while True:
+            # Sin pestañas abiertas no se consulta nada
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self._serve()
+            except Exception as e:
+                logger.error(f"Error produciendo eventos del panel: {str(e)}")
+                # Las pestañas siguen conectadas: se reintenta y todas reciben
+                # un snapshot nuevo, porque pudieron perderse diferencias
+                with self._lock:
+                    self._joining.update(self._subscribers)
+                    self._subscribers.clear()
+                    retry = bool(self._joining)
+                if retry:
+                    time.sleep(self.interval)
+                    self._wakeup.set()
+
+    def _serve(self):
+        request_events = self.broker.subscribe(ALL_REQUESTS)
+        try:
+            # Si falla la carga inicial las pestañas quedan en _joining hasta el reintento
+            requests = self.load_requests()
+            users = {user['username']: user for user in self.load_users()}
+            next_tick = time.monotonic() + self.interval
+            while True:
+                with self._lock:
+                    joining = list(self._joining)
+                    self._joining.clear()
+                    self._subscribers.update(joining)
+                    if not self._subscribers:
+                        return
+                if joining:
+                    snapshot = {
+                        'requests': dict(requests),
+                        'users': list(users.values())
+                    }
+                    for events in joining:
+                        events.put(('snapshot', snapshot))
+
+                try:
+                    timeout = min(0.5, max(0, next_tick - time.monotonic()))
+                    event = request_events.get(timeout=timeout)
+                    self._apply_request_event(requests, event)
+                except queue.Empty:
+                    pass
+
+                if time.monotonic() >= next_tick:
+                    users = self._diff_users(users)
+                    next_tick = time.monotonic() + self.interval
+        finally:
+            self.broker.unsubscribe(ALL_REQUESTS, request_events)
+
+    def _apply_request_event(self, requests, event):
+        request_id = event['request_id']
+        if event['status'] == 'pending':
+            if request_id not in requests:
+                request_data = self.load_request(request_id)
+                if request_data:
+                    requests[request_id] = request_data
+                    self._publish('request_added', request_data)
+        elif requests.pop(request_id, None) is not None:
+            self._publish('request_removed', {
+                'id': request_id,
+                'status': event['status']
+            })
+
+    def _diff_users(self, previous):
+        try:
+            current = {user['username']: user for user in self.load_users()}
+        except Exception as e:
+            logger.error(f"Error obteniendo usuarios para el panel: {str(e)}")
+            return previous
+        for username, user in current.items():
+            old = previous.get(username)
+            if old is None:
+                self._publish('user_added', user)
+                continue
+            changes = {key: value for key, value in user.items() if old.get(key) != value}
+            if changes:
+                changes['username'] = username
+                self._publish('user_updated', changes)
+        for username in previous.keys() - current.keys():
+            self._publish('user_removed', {'username': username})
+        return current
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import telebot
+from config import BOT_WORKERS, BOT_HEAVY_WORKERS
+from logger_manager import get_logger
+
+logger = get_logger('bot_dispatcher')
+
+# Sin respuesta de getUpdates en este tiempo (s) el polling se considera colgado
+# (el long polling de telebot espera hasta 20s)
+POLLING_STALE_AFTER = 60
+
+def heavy(handler):
+    """Marca un handler que consulta MikroTik o la base de datos
+
+    Se usa debajo del decorador de registro (message_handler, etc.).
+    """
+    handler.heavy = True
+    return handler
+
+class DispatchingTeleBot(telebot.TeleBot):
+    """TeleBot que ejecuta los handlers en pools de hilos
+
+    Los handlers marcados con @heavy corren en un pool de BOT_HEAVY_WORKERS
+    hilos (el límite de concurrencia hacia MikroTik y la base de datos) y el
+    resto en otro de BOT_WORKERS, así un listado lento de un administrador no
+    retrasa el /start de los demás usuarios. Las actualizaciones de un mismo
+    chat se procesan de a una y en el orden en que llegaron.
+    """
+
+    def __init__(self, token, workers=BOT_WORKERS, heavy_workers=BOT_HEAVY_WORKERS, **kwargs):
+        # El pool propio reemplaza al de telebot
+        kwargs['threaded'] = False
+        super().__init__(token, **kwargs)
+        self.workers = workers
+        self.heavy_workers = heavy_workers
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self._pool = None
+        self._heavy_pool = None
+        self._pid = None
+        self._queued = 0
+        self._running = 0
+        self._running_heavy = 0
+        self._handled = 0
+        self._last_poll = time.monotonic()
+
+    def get_updates(self, *args, **kwargs):
+        updates = super().get_updates(*args, **kwargs)
+        self._last_poll = time.monotonic()
+        return updates
+
+    def polling_age(self):
+        """Segundos desde la última respuesta de getUpdates"""
+        return time.monotonic() - self._last_poll
+
+    def _exec_task(self, task, *args, **kwargs):
+        chat_id = self._chat_id(args[0]) if args else None
+        job = (task, args, kwargs, self._is_heavy(args, kwargs))
+        with self._lock:
+            self._ensure_started()
+            self._queued += 1
+            if chat_id is not None:
+                lane = self._lanes.get(chat_id)
+                if lane is not None:
+                    # El chat ya tiene un handler en curso: esperar su turno
+                    lane.append(job)
+                    return
+                self._lanes[chat_id] = deque()
+            self._submit(chat_id, job)
+
+    @staticmethod
+    def _chat_id(update):
+        chat = getattr(update, 'chat', None)
+        if chat is None:
+            # CallbackQuery: el chat es el del mensaje con los botones
+            message = getattr(update, 'message', None)
+            chat = getattr(message, 'chat', None)
+        if chat is not None:
+            return chat.id
+        user = getattr(update, 'from_user', None)
+        return user.id if user is not None else None
+
+    def _is_heavy(self, args, kwargs):
+        handlers = kwargs.get('handlers')
+        if not handlers or not args:
+            return False
+        for handler in handlers:
+            if self._test_message_handler(handler, args[0]):
+                return getattr(handler['function'], 'heavy', False)
+        return False
+
+    def _ensure_started(self):
+        # Los hilos no sobreviven a un fork (workers de gunicorn)
+        if self._pool is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._lanes = {}
+            self._queued = self._running = self._running_heavy = 0
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bot')
+            self._heavy_pool = ThreadPoolExecutor(max_workers=self.heavy_workers, thread_name_prefix='bot-heavy')
+
+    def _submit(self, chat_id, job):
+        pool = self._heavy_pool if job[3] else self._pool
+        pool.submit(self._run, chat_id, job)
+
+    def _run(self, chat_id, job):
+        task, args, kwargs, is_heavy = job
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._running_heavy += is_heavy
+        try:
+            task(*args, **kwargs)
+        except Exception as e:
+            if not self._handle_exception(e):
+                logger.error(f"Error en handler {getattr(task, '__name__', task)}: {str(e)}")
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._running_heavy -= is_heavy
+                self._handled += 1
+                lane = self._lanes.get(chat_id) if chat_id is not None else None
+                if lane:
+                    self._submit(chat_id, lane.popleft())
+                elif chat_id is not None:
+                    self._lanes.pop(chat_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'heavy_workers': self.heavy_workers,
+                'queued': self._queued,
+                'running': self._running,
+                'running_heavy': self._running_heavy,
+                'busy_chats': len(self._lanes),
+                'handled': self._handled
+            }
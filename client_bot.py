@@ -2,28 +2,39 @@ import telebot
 import logging
 import sys
 import time
-import random
-import string
 import os
+import threading
 from telebot import types
 from datetime import datetime
 from config import (
-    CLIENT_BOT_TOKEN, CLIENT_BOT_USERNAME, ADMIN_IDS, PRICES, time_plans,
-    MIKROTIK_IP, MIKROTIK_USER, MIKROTIK_PASSWORD, PAYMENT_MESSAGE, fixed_price_usd, exchange_rate
+    CLIENT_BOT_TOKEN, CLIENT_BOT_USERNAME, ADMIN_IDS, time_plans,
+    MIKROTIK_IP, MIKROTIK_USER, MIKROTIK_PASSWORD, PAYMENT_MESSAGE,
+    TICKET_GC_ENABLED, BOT_MODE, WEBHOOK_URL, WEBHOOK_SECRET, BOT_HEARTBEAT_INTERVAL
 )
 from mikrotik_manager import MikrotikManager
 from database_manager import DatabaseManager
+from ticket_collector import ExpiredTicketCollector
+from notification_queue import NotificationQueue
+from webhook_dispatcher import UpdateDispatcher
+from telegram_sender import get_telegram_sender
+from bot_dispatcher import DispatchingTeleBot, heavy, POLLING_STALE_AFTER
+from plan_catalog import plan_catalog
+import tickets
 import json
 import base64
+import html
 from logger_manager import get_logger
 
 class SatelWifiBot:
     """Clase principal del bot"""
     
     def __init__(self):
-        self.bot = telebot.TeleBot(CLIENT_BOT_TOKEN)
+        self.bot = DispatchingTeleBot(CLIENT_BOT_TOKEN)
+        # Todas las llamadas a la API pasan por los límites de envío
+        self.sender = get_telegram_sender()
         self.mikrotik = MikrotikManager()
         self.db = DatabaseManager()
+        self.notifications = NotificationQueue(self.db, self.bot)
         self.pending_requests = {}  # Almacenar solicitudes pendientes
         self.user_states = {}  # Almacenar estados de los usuarios
         
@@ -34,7 +45,27 @@ class SatelWifiBot:
         
     def generate_ticket(self, length=8):
         """Genera un ticket aleatorio"""
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+        return tickets.generate_ticket(length)
+    
+    def create_ticket_batch(self, count, hours, userTelegram, createdBy):
+        """Crea varios tickets en MikroTik con una sola conexión (ver tickets.create_ticket_batch)"""
+        return tickets.create_ticket_batch(self.mikrotik, self.db, count, hours, userTelegram, createdBy)
+    
+    def format_ticket_sheet(self, created, failed, duration):
+        """Genera la hoja imprimible de un lote de tickets"""
+        lines = [
+            f"🎫 <b>Lote de Tickets - {duration}</b>",
+            f"📅 Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            ""
+        ]
+        for index, ticket in enumerate(created, 1):
+            lines.append(f"{index:>3}. <code>{ticket}</code>")
+        if failed:
+            lines.append("")
+            lines.append(f"⚠️ <b>{len(failed)} tickets no se pudieron crear:</b>")
+            for ticket, error in failed.items():
+                lines.append(f"❌ {ticket}: {html.escape(error)}")
+        return "\n".join(lines)
     
     def is_admin(self, user_id):
         """Verifica si un usuario es administrador"""
@@ -42,13 +73,7 @@ class SatelWifiBot:
     
     def get_user_markup(self, is_admin):
         """Retorna el markup correspondiente según el tipo de usuario"""
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        if is_admin:
-            markup.row("👥 Usuarios Activos", "👥 Usuarios Inactivos", "👥 Usuarios Sin Tiempo")
-            markup.row("📝 Solicitudes Pendientes", "🎫 Generar Ticket")
-        else:
-            markup.row("🎫 Solicitar Ticket")
-        return markup
+        return plan_catalog.reply_markup(is_admin)
     
     def send_message_safe(self, chat_id, text, reply_to_message_id=None, **kwargs):
         """Envía un mensaje de forma segura, manejando errores comunes"""
@@ -160,17 +185,10 @@ class SatelWifiBot:
         @self.bot.message_handler(func=lambda message: message.text == "🎫 Solicitar Ticket")
         def request_ticket(message):
             try:
-                markup = types.InlineKeyboardMarkup()
-                for hours in time_plans:
-                    prices = PRICES[f"{hours}h"]
-                    btn_text = f"{hours}h - ${prices['usd']} USD (Bs. {prices['bs']})"
-                    callback_data = f"plan_{hours}"
-                    markup.add(types.InlineKeyboardButton(btn_text, callback_data=callback_data))
-                
                 self.reply_safe(
                     message,
                     "🎫 Selecciona el plan que deseas comprar:",
-                    reply_markup=markup
+                    reply_markup=plan_catalog.current().plans_markup
                 )
             except Exception as e:
                 self.logger.error(f"Error en request_ticket: {str(e)}")
@@ -178,6 +196,7 @@ class SatelWifiBot:
         
         # Ver usuarios activos
         @self.bot.message_handler(func=lambda message: message.text == "👥 Usuarios Activos" and self.is_admin(message.from_user.id))
+        @heavy
         def show_active_users(message):
             """Muestra los usuarios activos"""
             if not self.is_admin(message.from_user.id):
@@ -225,6 +244,7 @@ class SatelWifiBot:
 
         # Ver usuarios inactivos
         @self.bot.message_handler(func=lambda message: message.text == "👥 Usuarios Inactivos" and self.is_admin(message.from_user.id))
+        @heavy
         def show_inactive_users(message):
             """Muestra los usuarios inactivos"""
             if not self.is_admin(message.from_user.id):
@@ -271,6 +291,7 @@ class SatelWifiBot:
 
          # Ver usuarios sin tiempo
         @self.bot.message_handler(func=lambda message: message.text == "👥 Usuarios Sin Tiempo" and self.is_admin(message.from_user.id))
+        @heavy
         def show_users_without_time(message):
             """Muestra los usuarios sin tiempo"""
             if not self.is_admin(message.from_user.id):
@@ -317,6 +338,7 @@ class SatelWifiBot:
         
         # Ver solicitudes pendientes
         @self.bot.message_handler(func=lambda message: message.text == "📝 Solicitudes Pendientes" and self.is_admin(message.from_user.id))
+        @heavy
         def show_pending_requests(message):
             """Muestra las solicitudes pendientes"""
             if not self.is_admin(message.from_user.id):
@@ -357,16 +379,21 @@ class SatelWifiBot:
                     )
                     
                     # Si hay comprobante de pago, enviar primero la imagen
-                    if request['payment_proof']:
+                    if request['payment_proof'] or request['payment_proof_file_id']:
                         try:
                             # Verificar que el comprobante no esté vacío
-                            if not request['payment_proof'].strip():
+                            if not request['payment_proof_file_id'] and not request['payment_proof'].strip():
                                 raise ValueError("Comprobante de pago vacío")
-                                
-                            self.logger.info(f"Intentando enviar comprobante de pago: {request['payment_proof']}")
-                            sent = self.bot.send_photo(
+                            
+                            # payment_proof es relativo a web/backend; solo se lee si
+                            # el comprobante todavía no se subió a Telegram
+                            proof_path = None
+                            if request['payment_proof']:
+                                proof_path = os.path.join(os.path.dirname(__file__), 'web/backend', request['payment_proof'])
+                            sent = self.notifications.send_payment_proof(
                                 message.chat.id,
-                                request['payment_proof'],
+                                request['id'],
+                                proof_path,
                                 caption="🧾 Comprobante de pago"
                             )
                             if not sent:
@@ -388,6 +415,7 @@ class SatelWifiBot:
 
         # Manejar acciones de solicitudes web
         @self.bot.callback_query_handler(func=lambda call: call.data.startswith(('web_approve_', 'web_reject_')))
+        @heavy
         def handle_web_request_action(call):
             """Maneja las acciones de aprobar/rechazar solicitudes web"""
             try:
@@ -496,17 +524,10 @@ class SatelWifiBot:
                 return
 
             try:
-                # Crear markup con los planes disponibles
-                markup = types.InlineKeyboardMarkup()
-                for hours in time_plans:
-                    btn_text = f"{hours}h"
-                    callback_data = f"admin_gen_{hours}"
-                    markup.add(types.InlineKeyboardButton(btn_text, callback_data=callback_data))
-                
                 self.reply_safe(
                     message,
                     "🎫 Selecciona la duración del ticket a generar:",
-                    reply_markup=markup
+                    reply_markup=plan_catalog.current().admin_ticket_markup
                 )
             except Exception as e:
                 self.logger.error(f"Error en admin_generate_ticket: {str(e)}")
@@ -514,6 +535,7 @@ class SatelWifiBot:
 
         # Callback para generar ticket (admin)
         @self.bot.callback_query_handler(func=lambda call: call.data.startswith('admin_gen_'))
+        @heavy
         def handle_admin_generate_ticket(call):
             """Maneja la generación de tickets por parte del admin"""
             try:
@@ -558,11 +580,96 @@ class SatelWifiBot:
             except Exception as e:
                 self.logger.error(f"Error en handle_admin_generate_ticket: {str(e)}")
                 self.bot.answer_callback_query(call.id, "❌ Error al generar ticket")
+
+        # Generar lote de tickets (admin)
+        @self.bot.message_handler(func=lambda message: message.text == "🎫 Generar Lote" and self.is_admin(message.from_user.id))
+        def admin_generate_batch(message):
+            """Permite a los administradores generar varios tickets a la vez"""
+            if not self.is_admin(message.from_user.id):
+                self.reply_safe(message, "⛔️ No tienes permiso para usar este comando.")
+                return
+
+            try:
+                self.reply_safe(
+                    message,
+                    "🎫 Selecciona la duración de los tickets del lote:",
+                    reply_markup=plan_catalog.current().admin_batch_markup
+                )
+            except Exception as e:
+                self.logger.error(f"Error en admin_generate_batch: {str(e)}")
+                self.reply_safe(message, "❌ Error al mostrar opciones. Por favor, intenta nuevamente.")
+
+        # Callback para elegir la cantidad del lote (admin)
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('admin_batch_'))
+        def handle_admin_batch_duration(call):
+            """Pide la cantidad de tickets una vez elegida la duración"""
+            try:
+                if not self.is_admin(call.from_user.id):
+                    self.bot.answer_callback_query(call.id, "⛔️ No tienes permiso para realizar esta acción.")
+                    return
+
+                _, _, hours = call.data.split('_')  # admin_batch_24 -> ['admin', 'batch', '24']
+                markup = plan_catalog.current().batch_size_markups.get(hours)
+                if markup is None:
+                    self.bot.answer_callback_query(call.id, "❌ Duración no válida")
+                    return
+                self.bot.edit_message_text(
+                    chat_id=call.message.chat.id,
+                    message_id=call.message.message_id,
+                    text=f"🎫 ¿Cuántos tickets de {hours}h deseas generar?",
+                    reply_markup=markup
+                )
+                self.bot.answer_callback_query(call.id)
+            except Exception as e:
+                self.logger.error(f"Error en handle_admin_batch_duration: {str(e)}")
+                self.bot.answer_callback_query(call.id, "❌ Error al mostrar opciones")
+
+        # Callback para generar el lote de tickets (admin)
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('admin_batchn_'))
+        @heavy
+        def handle_admin_generate_batch(call):
+            """Genera el lote de tickets y muestra la hoja imprimible"""
+            try:
+                if not self.is_admin(call.from_user.id):
+                    self.bot.answer_callback_query(call.id, "⛔️ No tienes permiso para realizar esta acción.")
+                    return
+
+                _, _, hours, count = call.data.split('_')  # admin_batchn_24_10 -> ['admin', 'batchn', '24', '10']
+                self.bot.answer_callback_query(call.id, "⏳ Generando tickets...")
+                
+                userTelegram = call.from_user.username if call.from_user.username else call.from_user.id
+                userMessage = call.message.chat.username if call.message.chat.username else call.message.chat.id
+                created, failed = self.create_ticket_batch(int(count), hours, userMessage, userTelegram)
+                message_text = self.format_ticket_sheet(created, failed, f"{hours}h")
+                
+                try:
+                    self.bot.edit_message_text(
+                        chat_id=call.message.chat.id,
+                        message_id=call.message.message_id,
+                        text=message_text,
+                        parse_mode='HTML'
+                    )
+                except Exception as e:
+                    self.logger.error(f"Error actualizando mensaje: {str(e)}")
+                    self.send_message_safe(call.message.chat.id, message_text, parse_mode='HTML')
+            except Exception as e:
+                self.logger.error(f"Error en handle_admin_generate_batch: {str(e)}")
+                self.send_message_safe(call.message.chat.id, "❌ Error al generar el lote de tickets")
     
     
     def run(self):
         """Inicia el bot"""
         self.logger.info("Bot Inicializado... m3")
+        self.db.start_maintenance()
+        self.notifications.start()
+        if TICKET_GC_ENABLED:
+            ExpiredTicketCollector(self.mikrotik, self.db).start()
+        if BOT_MODE == 'webhook':
+            self.run_webhook()
+            return
+        # getUpdates falla mientras haya un webhook registrado
+        self.bot.remove_webhook()
+        self.start_heartbeat()
         while True:
             try:
                 self.logger.info("Bot Ready Escuchando... m4")
@@ -571,6 +678,58 @@ class SatelWifiBot:
                 self.logger.error(f"Error en polling: {str(e)}")
                 time.sleep(10)  # Esperar antes de reintentar
 
+    def start_heartbeat(self):
+        """Reescribe BOT_HEARTBEAT_FILE mientras el bot recibe actualizaciones
+
+        manager_bots reinicia el bot si el archivo deja de actualizarse. En
+        modo polling solo se escribe si getUpdates respondió hace poco; en
+        modo webhook, si UpdateDispatcher y la cola de notificaciones leyeron
+        sus tablas hace poco. Así un hilo colgado también se detecta.
+        """
+        heartbeat_file = os.getenv('BOT_HEARTBEAT_FILE')
+        if not heartbeat_file:
+            return
+        
+        def alive():
+            if BOT_MODE == 'webhook':
+                return max(self.webhook.polling_age(), self.notifications.polling_age()) < POLLING_STALE_AFTER
+            return self.bot.polling_age() < POLLING_STALE_AFTER
+
+        def run():
+            while True:
+                if alive():
+                    try:
+                        with open(heartbeat_file, 'w') as f:
+                            f.write(str(os.getpid()))
+                    except OSError as e:
+                        self.logger.error(f"Error escribiendo heartbeat: {str(e)}")
+                time.sleep(BOT_HEARTBEAT_INTERVAL)
+        
+        threading.Thread(target=run, name='heartbeat', daemon=True).start()
+
+    def run_webhook(self):
+        """Registra el webhook de la app web y procesa lo que ésta recibe
+
+        La app web (/telegram/webhook) guarda cada actualización en la base
+        de datos; UpdateDispatcher las pasa a los handlers de este proceso.
+        """
+        if not WEBHOOK_URL or not WEBHOOK_SECRET:
+            raise ValueError("BOT_MODE=webhook requiere WEBHOOK_URL y WEBHOOK_SECRET")
+        url = f"{WEBHOOK_URL}/telegram/webhook"
+        self.webhook = UpdateDispatcher(self.bot, self.db)
+        self.webhook.start()
+        while True:
+            try:
+                self.bot.set_webhook(url=url, secret_token=WEBHOOK_SECRET)
+                self.logger.info(f"Bot Ready, webhook registrado en {url}... m4")
+                self.start_heartbeat()
+                break
+            except Exception as e:
+                self.logger.error(f"Error registrando el webhook: {str(e)}")
+                time.sleep(10)  # Esperar antes de reintentar
+        while True:
+            time.sleep(3600)
+
 if __name__ == "__main__":
     try:
         logger = get_logger('client_bot')
@@ -16,28 +16,124 @@ MIKROTIK_IP = os.getenv('MIKROTIK_IP')
 MIKROTIK_USER = os.getenv('MIKROTIK_USER')
 MIKROTIK_PASSWORD = os.getenv('MIKROTIK_PASSWORD')
 
+# Pool de conexiones con MikroTik. El bot y cada worker de gunicorn tienen
+# su propio pool; MIKROTIK_MAX_SESSIONS se reparte entre ellos (ver
+# MIKROTIK_POOL_SIZE más abajo)
+MIKROTIK_MAX_SESSIONS = int(os.getenv('MIKROTIK_MAX_SESSIONS', '8'))  # Sesiones de pool con el router entre todos los procesos
+MIKROTIK_POOL_TIMEOUT = float(os.getenv('MIKROTIK_POOL_TIMEOUT', '10'))  # Espera máxima por una sesión libre (s)
+MIKROTIK_HEALTH_CHECK_INTERVAL = float(os.getenv('MIKROTIK_HEALTH_CHECK_INTERVAL', '30'))  # Inactividad antes de verificar la sesión (s)
+MIKROTIK_MAX_BACKOFF = float(os.getenv('MIKROTIK_MAX_BACKOFF', '60'))  # Espera máxima entre reconexiones (s)
+MIKROTIK_CACHE_TTL = float(os.getenv('MIKROTIK_CACHE_TTL', '15'))  # Vigencia de la copia local del hotspot (s)
+MIKROTIK_LISTENER_ENABLED = os.getenv('MIKROTIK_LISTENER_ENABLED', 'true').lower() == 'true'  # Seguir /ip/hotspot/active con listen
+
+# Base de datos SQLite
+DB_PATH = os.getenv('DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'satelwifi.db'))
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', '5000'))  # Espera máxima por un bloqueo (ms)
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL').upper()  # NORMAL es seguro con WAL
+if DB_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    DB_SYNCHRONOUS = 'NORMAL'
+
+# Servidor web
+WEB_WORKER_CLASS = os.getenv('WEB_WORKER_CLASS', 'gthread').lower()  # gthread (hilos) o gevent (greenlets, requiere gevent)
+if WEB_WORKER_CLASS not in ('gthread', 'gevent'):
+    WEB_WORKER_CLASS = 'gthread'
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '3'))  # Procesos worker de gunicorn
+# Sesiones por proceso: MIKROTIK_MAX_SESSIONS entre el bot y los workers. El
+# total real es MIKROTIK_POOL_SIZE * (WEB_WORKERS + 1), más una sesión de
+# listen por proceso si MIKROTIK_LISTENER_ENABLED
+MIKROTIK_POOL_SIZE = int(os.getenv('MIKROTIK_POOL_SIZE', str(max(1, MIKROTIK_MAX_SESSIONS // (WEB_WORKERS + 1)))))
+WEB_THREADS = int(os.getenv('WEB_THREADS', '32'))  # Hilos por worker gthread (cada stream SSE ocupa uno)
+WEB_WORKER_CONNECTIONS = int(os.getenv('WEB_WORKER_CONNECTIONS', '1000'))  # Conexiones simultáneas por worker gevent
+WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', '120'))  # Segundos sin respuesta antes de reiniciar un worker
+WEB_HEALTH_PORT = int(os.getenv('WEB_HEALTH_PORT', '5001'))  # Puerto local de la sonda del supervisor (proceso principal de gunicorn)
+# Streams SSE abiertos por worker; con el cupo lleno se responde 503 y la página
+# consulta por polling. Por defecto deja la mitad de los hilos para el resto
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', str(
+    WEB_THREADS // 2 if WEB_WORKER_CLASS == 'gthread' else WEB_WORKER_CONNECTIONS // 2
+)))
+PAYMENT_PROOF_MAX_SIZE = int(os.getenv('PAYMENT_PROOF_MAX_SIZE', str(5 * 1024 * 1024)))  # Tamaño máximo de un comprobante (bytes)
+REQUEST_EVENTS_POLL_INTERVAL = float(os.getenv('REQUEST_EVENTS_POLL_INTERVAL', '0.25'))  # Espera entre lecturas de request_events (s)
+REQUEST_EVENTS_STREAM_TIMEOUT = float(os.getenv('REQUEST_EVENTS_STREAM_TIMEOUT', '300'))  # Duración máxima de un stream SSE (s)
+ADMIN_EVENTS_INTERVAL = float(os.getenv('ADMIN_EVENTS_INTERVAL', '5'))  # Segundos entre actualizaciones de usuarios del panel
+
+# Cola de notificaciones de Telegram
+NOTIFICATION_WORKERS = int(os.getenv('NOTIFICATION_WORKERS', '4'))  # Hilos que envían notificaciones
+NOTIFICATION_RATE = float(os.getenv('NOTIFICATION_RATE', '20'))  # Mensajes por segundo como máximo
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', '5'))  # Intentos antes de descartar
+NOTIFICATION_POLL_INTERVAL = float(os.getenv('NOTIFICATION_POLL_INTERVAL', '1'))  # Espera entre lecturas de la cola (s)
+
+# Límites de envío de Telegram (por proceso)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))  # Mensajes por segundo en total
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))  # Mensajes por segundo a un mismo chat
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))  # Ráfaga permitida a un mismo chat
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', str(20 / 60)))  # Mensajes por segundo a un grupo
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))  # Reintentos tras una respuesta 429
+
+# Recepción de actualizaciones del bot
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()  # polling o webhook (las recibe la app web)
+if BOT_MODE not in ('polling', 'webhook'):
+    BOT_MODE = 'polling'
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')  # URL pública de la app web, p. ej. https://wifi.ejemplo.com
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # Token que Telegram envía en cada llamada (obligatorio en modo webhook)
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', '100'))  # Actualizaciones sin procesar antes de responder 503
+WEBHOOK_POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', '0.25'))  # Cada cuánto el bot lee las actualizaciones guardadas por la app web (s)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '').rstrip('/')  # Servidor de la API alternativo (pruebas o Bot API local)
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '4'))  # Hilos para los handlers rápidos del bot
+BOT_HEAVY_WORKERS = int(os.getenv('BOT_HEAVY_WORKERS', '2'))  # Handlers simultáneos que consultan MikroTik o la base de datos
+
+# Supervisor de procesos (manager_bots.py)
+SUPERVISOR_CHECK_INTERVAL = float(os.getenv('SUPERVISOR_CHECK_INTERVAL', '2'))  # Segundos entre verificaciones
+SUPERVISOR_HEALTH_FAILURES = int(os.getenv('SUPERVISOR_HEALTH_FAILURES', '3'))  # Fallos seguidos antes de reiniciar
+SUPERVISOR_STARTUP_TIMEOUT = float(os.getenv('SUPERVISOR_STARTUP_TIMEOUT', '60'))  # Espera máxima hasta que un servicio esté listo (s)
+SUPERVISOR_MAX_BACKOFF = float(os.getenv('SUPERVISOR_MAX_BACKOFF', '60'))  # Espera máxima entre reinicios (s)
+SUPERVISOR_STATUS_FILE = os.getenv('SUPERVISOR_STATUS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manager_status.json'))
+BOT_HEARTBEAT_INTERVAL = float(os.getenv('BOT_HEARTBEAT_INTERVAL', '5'))  # Segundos entre heartbeats del bot
+BOT_HEARTBEAT_TIMEOUT = float(os.getenv('BOT_HEARTBEAT_TIMEOUT', '20'))  # Antigüedad máxima del heartbeat (s)
+
+# Archivo de log compartido (satelwifi.log)
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))  # Tamaño que dispara la rotación
+LOG_BACKUP_COUNT = max(1, int(os.getenv('LOG_BACKUP_COUNT', '5')))  # Archivos comprimidos que se conservan
+LOG_ROTATE_INTERVAL = float(os.getenv('LOG_ROTATE_INTERVAL', '24'))  # Horas entre rotaciones (0 = solo por tamaño)
+LOG_SERVER_PORT = int(os.getenv('LOG_SERVER_PORT', '9020'))  # Puerto local del proceso que escribe el archivo
+
+# Retención de logs en la base de datos
+SYSTEM_LOG_CAPACITY = int(os.getenv('SYSTEM_LOG_CAPACITY', '100'))  # Posiciones del buffer circular system_logs
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '30'))  # Antigüedad máxima de la tabla logs
+LOG_MAX_ROWS = int(os.getenv('LOG_MAX_ROWS', '50000'))  # Registros máximos de la tabla logs
+LOG_COMPACT_INTERVAL = float(os.getenv('LOG_COMPACT_INTERVAL', '3600'))  # Segundos entre compactaciones
+
+# Recolector de tickets agotados
+TICKET_GC_ENABLED = os.getenv('TICKET_GC_ENABLED', 'false').lower() == 'true'
+TICKET_GC_INTERVAL = float(os.getenv('TICKET_GC_INTERVAL', '3600'))  # Segundos entre pasadas
+TICKET_GC_MIN_AGE_DAYS = int(os.getenv('TICKET_GC_MIN_AGE_DAYS', '7'))  # Antigüedad mínima del ticket para eliminarlo
+
 # Configuración de precios y tasas
 exchange_rate = float(os.getenv('EXCHANGE_RATE', '53.85'))  # Tasa de cambio USD a BS
 fixed_price_usd = float(os.getenv('FIXED_PRICE_USD', '0.185701021'))  # Precio fijo por hora en USD
+# Los valores de arriba se usan hasta que se guarden desde la pestaña Precios del panel (tabla pricing)
+PRICING_REFRESH_INTERVAL = float(os.getenv('PRICING_REFRESH_INTERVAL', '0.5'))  # Segundos entre lecturas de la tabla pricing
 
 # Planes disponibles en horas
 time_plans = [1, 2,3, 4, 5,6,7,8,9,10,11,12,24]
 
-def calculate_prices():
-    """Calcula los precios para cada plan"""
+# Cantidades ofrecidas al generar tickets en lote y máximo permitido por lote
+batch_ticket_sizes = [5, 10, 20, 50]
+BATCH_TICKET_MAX = int(os.getenv('BATCH_TICKET_MAX', '100'))
+
+def calculate_prices(rate=None, price_per_hour=None):
+    """Calcula los precios para cada plan (por defecto con los valores del .env)"""
+    rate = exchange_rate if rate is None else rate
+    price_per_hour = fixed_price_usd if price_per_hour is None else price_per_hour
     prices = {}
     for hours in time_plans:
-        price_usd = round(fixed_price_usd * hours, 2)
-        price_bs = round(price_usd * exchange_rate, 2)
+        price_usd = round(price_per_hour * hours, 2)
+        price_bs = round(price_usd * rate, 2)
         prices[f"{hours}h" if hours >= 1 else f"{int(hours*60)}m"] = {
             "usd": price_usd,
             "bs": price_bs
         }
     return prices
 
-# Generar precios
-PRICES = calculate_prices()
-
 # Configuración de credenciales de administrador
 ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', 'admin')
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'admin123')
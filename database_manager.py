@@ -1,26 +1,167 @@
 import sqlite3
+import inspect
 import logging
 import json
-from datetime import datetime
-from pathlib import Path
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from config import (
+    DB_PATH, DB_BUSY_TIMEOUT, DB_SYNCHRONOUS, LOG_RETENTION_DAYS, LOG_MAX_ROWS, LOG_COMPACT_INTERVAL
+)
 from logger_manager import get_logger
+from gevent_support import gevent_patched, thread_local, in_threadpool, in_hub
+
+# Conexiones abiertas por hilo, indexadas por ruta de la base de datos
+_connections = thread_local()
+
+def add_column(table, column, definition):
+    """Paso de migración que añade una columna si todavía no existe"""
+    def step(cursor):
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return step
+
+# Migraciones del esquema: (versión, descripción, pasos). Cada paso es una
+# sentencia SQL o una función que recibe el cursor. Nunca modificar una
+# migración ya publicada: añadir una nueva con la versión siguiente.
+MIGRATIONS = [
+    (1, 'Índices para solicitudes, logs y usuarios de MikroTik', [
+        'CREATE INDEX IF NOT EXISTS idx_requests_status_created ON requests(status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_logs_level_timestamp ON logs(level, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_logs_source_timestamp ON logs(source, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_mikrotik_users_request ON mikrotik_users(request_id)',
+    ]),
+    (2, 'Eventos de cambio de estado de solicitudes', [
+        '''
+        CREATE TABLE IF NOT EXISTS request_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            ticket TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_request_events_created ON request_events(created_at)',
+        # El trigger registra el cambio sin importar qué proceso lo hizo
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_requests_status_event
+        AFTER UPDATE OF status, ticket ON requests
+        WHEN NEW.status IS NOT OLD.status OR NEW.ticket IS NOT OLD.ticket
+        BEGIN
+            INSERT INTO request_events (request_id, status, ticket)
+            VALUES (NEW.id, NEW.status, NEW.ticket);
+        END
+        ''',
+    ]),
+    (3, 'Eventos de solicitudes nuevas', [
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_requests_insert_event
+        AFTER INSERT ON requests
+        BEGIN
+            INSERT INTO request_events (request_id, status, ticket)
+            VALUES (NEW.id, NEW.status, NEW.ticket);
+        END
+        ''',
+    ]),
+    (4, 'Cola persistente de notificaciones de Telegram', [
+        '''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_status_next ON notifications(status, next_attempt_at)',
+    ]),
+    (5, 'file_id de Telegram del comprobante de pago', [
+        add_column('requests', 'payment_proof_file_id', 'TEXT'),
+    ]),
+    (6, 'Tasa de cambio y precio por hora editables sin reiniciar', [
+        '''
+        CREATE TABLE IF NOT EXISTS pricing (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            exchange_rate REAL NOT NULL,
+            fixed_price_usd REAL NOT NULL,
+            updated_by TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (7, 'Hash del comprobante para detectar comprobantes repetidos', [
+        add_column('requests', 'payment_proof_sha256', 'TEXT'),
+        'CREATE INDEX IF NOT EXISTS idx_requests_proof_sha256 ON requests(payment_proof_sha256)',
+    ]),
+    (8, 'Actualizaciones de Telegram recibidas por webhook', [
+        '''
+        CREATE TABLE IF NOT EXISTS telegram_updates (
+            update_id INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL,
+            received_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+]
 
 class DatabaseManager:
     """Clase para gestionar la base de datos SQLite"""
     
     def __init__(self, db_path=None):
         if db_path is None:
-            db_path = Path(__file__).parent / 'satelwifi.db'
+            db_path = DB_PATH
         self.db_path = db_path
         self.logger = get_logger('database')
+        self.status_listeners = []
         self.setup_database()
         
     def get_connection(self):
-        """Obtiene una conexión a la base de datos"""
-        return sqlite3.connect(self.db_path)
+        """Obtiene la conexión del hilo actual, abriéndola si hace falta
+
+        Cada hilo reutiliza su propia conexión (y con ella la caché de
+        sentencias preparadas de sqlite3). Tras un fork se abre una nueva.
+        """
+        cache = getattr(_connections, 'cache', None)
+        if cache is None or _connections.pid != os.getpid():
+            cache = _connections.cache = {}
+            _connections.pid = os.getpid()
+        
+        key = str(self.db_path)
+        conn = cache.get(key)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=DB_BUSY_TIMEOUT / 1000,
+                cached_statements=256
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={DB_SYNCHRONOUS}')
+            conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT}')
+            cache[key] = conn
+        return conn
+    
+    def close_connection(self):
+        """Cierra la conexión del hilo actual"""
+        cache = getattr(_connections, 'cache', None)
+        if cache and _connections.pid == os.getpid():
+            conn = cache.pop(str(self.db_path), None)
+            if conn is not None:
+                conn.close()
     
     def setup_database(self):
         """Crea las tablas necesarias si no existen"""
+        # Con el esquema al día (lo normal al arrancar un worker) no hay DDL que ejecutar
+        if self.get_schema_version() >= MIGRATIONS[-1][0]:
+            return
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
@@ -66,9 +207,41 @@ class DatabaseManager:
             ''')
             
             conn.commit()
+        
+        self.migrate()
+    
+    def get_schema_version(self):
+        """Retorna la versión actual del esquema"""
+        return self.get_connection().execute('PRAGMA user_version').fetchone()[0]
+    
+    def migrate(self):
+        """Aplica en orden las migraciones pendientes del esquema"""
+        conn = self.get_connection()
+        for version, description, steps in MIGRATIONS:
+            if self.get_schema_version() >= version:
+                continue
+            try:
+                # BEGIN IMMEDIATE serializa la migración entre procesos
+                conn.execute('BEGIN IMMEDIATE')
+                if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    conn.rollback()
+                    continue
+                cursor = conn.cursor()
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(f'PRAGMA user_version = {int(version)}')
+                conn.commit()
+                self.logger.info(f"Migración {version} aplicada: {description}")
+            except Exception as e:
+                conn.rollback()
+                self.logger.error(f"Error aplicando migración {version} ({description}): {str(e)}")
+                raise
     
     def add_request(self, request_id, plan_data, payment_ref=None, payment_proof=None, 
-                   source='web', chat_id=None, username=None):
+                   source='web', chat_id=None, username=None, payment_proof_sha256=None):
         """Añade una nueva solicitud"""
         try:
             with self.get_connection() as conn:
@@ -76,8 +249,8 @@ class DatabaseManager:
                 cursor.execute('''
                     INSERT INTO requests (
                         id, status, timestamp, plan_data, payment_ref, 
-                        payment_proof, source, chat_id, username
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        payment_proof, source, chat_id, username, payment_proof_sha256
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
                     request_id,
                     'pending',
@@ -87,7 +260,8 @@ class DatabaseManager:
                     payment_proof,  # Ahora payment_proof será la ruta del archivo
                     source,
                     chat_id,
-                    username
+                    username,
+                    payment_proof_sha256
                 ))
                 conn.commit()
                 
@@ -104,7 +278,7 @@ class DatabaseManager:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT id, status, plan_data, username, created_at, 
-                           payment_ref, payment_proof, source, chat_id
+                           payment_ref, payment_proof, source, chat_id, payment_proof_file_id
                     FROM requests
                     WHERE status = 'pending'
                     ORDER BY created_at DESC
@@ -120,7 +294,8 @@ class DatabaseManager:
                         'payment_ref': row[5],
                         'payment_proof': row[6],
                         'source': row[7],
-                        'chat_id': row[8]
+                        'chat_id': row[8],
+                        'payment_proof_file_id': row[9]
                     }
                     requests.append(request)
                 return requests
@@ -134,7 +309,8 @@ class DatabaseManager:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    SELECT id, status, plan_data, username, created_at, payment_proof, chat_id, ticket
+                    SELECT id, status, plan_data, username, created_at, payment_proof, chat_id, ticket,
+                           payment_proof_file_id
                     FROM requests
                     WHERE id = ?
                 ''', (request_id,))
@@ -148,7 +324,8 @@ class DatabaseManager:
                         'created_at': row[4],
                         'payment_proof': row[5],
                         'chat_id': row[6],
-                        'ticket': row[7]
+                        'ticket': row[7],
+                        'payment_proof_file_id': row[8]
                     }
                 return None
         except Exception as e:
@@ -173,11 +350,157 @@ class DatabaseManager:
                         WHERE id = ?
                     ''', (status, request_id))
                 conn.commit()
-                return True
         except Exception as e:
             self.logger.error(f"Error actualizando estado de solicitud {request_id}: {str(e)}")
             return False
+        
+        for listener in self.status_listeners:
+            try:
+                listener(request_id, status, ticket)
+            except Exception as e:
+                self.logger.error(f"Error notificando cambio de la solicitud {request_id}: {str(e)}")
+        return True
+    
+    def add_status_listener(self, listener):
+        """Registra una función llamada como listener(request_id, status, ticket)
+        cada vez que este proceso cambia el estado de una solicitud"""
+        if gevent_patched():
+            # El cambio se hace en un hilo del pool; el listener corre en el hub
+            listener = in_hub(listener)
+        self.status_listeners.append(listener)
+    
+    def get_last_request_event_id(self):
+        """Obtiene el id del último evento de cambio de estado"""
+        try:
+            with self.get_connection() as conn:
+                row = conn.execute('SELECT MAX(id) FROM request_events').fetchone()
+                return row[0] or 0
+        except Exception as e:
+            self.logger.error(f"Error obteniendo el último evento de solicitudes: {str(e)}")
+            return 0
+    
+    def get_request_events(self, after_id, limit=500):
+        """Obtiene los eventos de cambio de estado posteriores a after_id"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, request_id, status, ticket, created_at
+                    FROM request_events
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (after_id, limit))
+                return [{
+                    'id': row[0],
+                    'request_id': row[1],
+                    'status': row[2],
+                    'ticket': row[3],
+                    'created_at': row[4]
+                } for row in cursor.fetchall()]
+        except Exception as e:
+            self.logger.error(f"Error obteniendo eventos de solicitudes: {str(e)}")
+            return []
+    
+    def prune_request_events(self, max_age_hours=24):
+        """Elimina los eventos de cambio de estado ya entregados"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "DELETE FROM request_events WHERE created_at < datetime('now', ?)",
+                    (f'-{max_age_hours} hours',)
+                )
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            self.logger.error(f"Error eliminando eventos de solicitudes: {str(e)}")
+            return 0
 
+    def find_requests_by_proof(self, sha256, exclude_id=None):
+        """IDs de otras solicitudes que enviaron el mismo comprobante"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id FROM requests
+                    WHERE payment_proof_sha256 = ? AND id != ?
+                    ORDER BY timestamp
+                ''', (sha256, exclude_id or ''))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            self.logger.error(f"Error buscando comprobantes repetidos: {str(e)}")
+            return []
+    
+    def get_payment_proof_file_id(self, request_id):
+        """Obtiene el file_id de Telegram del comprobante de una solicitud"""
+        try:
+            with self.get_connection() as conn:
+                row = conn.execute(
+                    'SELECT payment_proof_file_id FROM requests WHERE id = ?', (request_id,)
+                ).fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            self.logger.error(f"Error obteniendo file_id del comprobante de {request_id}: {str(e)}")
+            return None
+    
+    def set_payment_proof_file_id(self, request_id, file_id):
+        """Guarda el file_id de Telegram del comprobante tras la primera subida"""
+        try:
+            with self.get_connection() as conn:
+                conn.execute('''
+                    UPDATE requests
+                    SET payment_proof_file_id = ?
+                    WHERE id = ? AND payment_proof_file_id IS NULL
+                ''', (file_id, request_id))
+                conn.commit()
+                return True
+        except Exception as e:
+            self.logger.error(f"Error guardando file_id del comprobante de {request_id}: {str(e)}")
+            return False
+    
+    def get_pricing(self):
+        """Obtiene la fila de precios vigente, o None si nunca se editó"""
+        try:
+            with self.get_connection() as conn:
+                row = conn.execute('''
+                    SELECT version, exchange_rate, fixed_price_usd, updated_by, updated_at
+                    FROM pricing WHERE id = 1
+                ''').fetchone()
+                if not row:
+                    return None
+                return {
+                    'version': row[0],
+                    'exchange_rate': row[1],
+                    'fixed_price_usd': row[2],
+                    'updated_by': row[3],
+                    'updated_at': row[4]
+                }
+        except Exception as e:
+            self.logger.error(f"Error obteniendo precios: {str(e)}")
+            return None
+    
+    def set_pricing(self, exchange_rate, fixed_price_usd, updated_by=None):
+        """Guarda la tasa de cambio y el precio por hora; retorna la nueva versión"""
+        try:
+            with self.get_connection() as conn:
+                conn.execute('''
+                    INSERT INTO pricing (id, version, exchange_rate, fixed_price_usd, updated_by)
+                    VALUES (1, 1, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET
+                        version = version + 1,
+                        exchange_rate = excluded.exchange_rate,
+                        fixed_price_usd = excluded.fixed_price_usd,
+                        updated_by = excluded.updated_by,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', (exchange_rate, fixed_price_usd, updated_by))
+                version = conn.execute('SELECT version FROM pricing WHERE id = 1').fetchone()[0]
+                conn.commit()
+                return version
+        except Exception as e:
+            self.logger.error(f"Error guardando precios: {str(e)}")
+            return None
+    
     def add_mikrotik_user(self, username, password, duration, request_id=None):
         """Añade un nuevo usuario de MikroTik"""
         try:
@@ -195,6 +518,26 @@ class DatabaseManager:
             self.log('error', 'database', f'Error al añadir usuario MikroTik: {str(e)}')
             return False
     
+    def add_mikrotik_users(self, users):
+        """Añade varios usuarios de MikroTik en una sola transacción
+
+        users es una lista de tuplas (username, password, duration, request_id).
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO mikrotik_users (username, password, duration, request_id)
+                    VALUES (?, ?, ?, ?)
+                ''', users)
+                conn.commit()
+                
+                self.log('info', 'database', f'{len(users)} usuarios MikroTik añadidos en lote')
+                return True
+        except Exception as e:
+            self.log('error', 'database', f'Error al añadir usuarios MikroTik en lote: {str(e)}')
+            return False
+    
     def get_mikrotik_user(self, username):
         """Obtiene un usuario de MikroTik por su username"""
         try:
@@ -215,37 +558,47 @@ class DatabaseManager:
     
     def remove_user(self, username):
         """Elimina un usuario de la base de datos"""
+        return self.remove_users([username])
+    
+    def remove_users(self, usernames):
+        """Elimina varios usuarios y marca sus solicitudes en una sola transacción"""
+        usernames = list(usernames)
+        if not usernames:
+            return True
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                # Primero buscar el request_id asociado al usuario
-                cursor.execute('''
-                    SELECT request_id 
-                    FROM mikrotik_users 
-                    WHERE username = ?
-                ''', (username,))
-                row = cursor.fetchone()
-                request_id = row[0] if row else None
+                # Primero buscar los request_id asociados a los usuarios
+                # (por bloques para no superar el límite de parámetros de SQLite)
+                request_ids = []
+                for start in range(0, len(usernames), 500):
+                    chunk = usernames[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(f'''
+                        SELECT request_id 
+                        FROM mikrotik_users 
+                        WHERE username IN ({placeholders}) AND request_id IS NOT NULL
+                    ''', chunk)
+                    request_ids.extend((row[0],) for row in cursor.fetchall())
                 
-                # Eliminar el usuario de mikrotik_users
-                cursor.execute('''
+                # Eliminar los usuarios de mikrotik_users
+                cursor.executemany('''
                     DELETE FROM mikrotik_users 
                     WHERE username = ?
-                ''', (username,))
+                ''', [(username,) for username in usernames])
                 
-                # Si había un request asociado, actualizarlo a 'deleted'
-                if request_id:
-                    cursor.execute('''
-                        UPDATE requests 
-                        SET status = 'deleted' 
-                        WHERE id = ?
-                    ''', (request_id,))
+                # Si había requests asociados, actualizarlos a 'deleted'
+                cursor.executemany('''
+                    UPDATE requests 
+                    SET status = 'deleted' 
+                    WHERE id = ?
+                ''', request_ids)
                 
                 conn.commit()
-                self.log('info', 'database', f'Usuario eliminado: {username}')
+                self.log('info', 'database', f'Usuarios eliminados: {", ".join(usernames)}')
                 return True
         except Exception as e:
-            self.log('error', 'database', f'Error al eliminar usuario {username}: {str(e)}')
+            self.log('error', 'database', f'Error al eliminar usuarios {", ".join(usernames)}: {str(e)}')
             return False
     
     def log(self, level, source, message, extra_data=None):
@@ -267,6 +620,226 @@ class DatabaseManager:
         except Exception as e:
             print(f"Error logging to database: {str(e)}")
     
+    def compact_logs(self, retention_days=LOG_RETENTION_DAYS, max_rows=LOG_MAX_ROWS):
+        """Aplica la retención de la tabla logs y retorna cuántos registros eliminó
+
+        Elimina por rango (timestamp e id, ambos indexados) en lugar de
+        recorrer la tabla, y trunca el WAL para que el archivo no crezca.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                deleted = 0
+                if retention_days:
+                    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+                    cursor.execute('DELETE FROM logs WHERE timestamp < ?', (cutoff,))
+                    deleted += cursor.rowcount
+                if max_rows:
+                    cursor.execute('''
+                        DELETE FROM logs
+                        WHERE id <= (SELECT MAX(id) FROM logs) - ?
+                    ''', (max_rows,))
+                    deleted += cursor.rowcount
+                conn.commit()
+            self.get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            if deleted:
+                self.logger.info(f"Compactación de logs: {deleted} registros eliminados")
+            return deleted
+        except Exception as e:
+            self.logger.error(f"Error compactando logs: {str(e)}")
+            return 0
+    
+    def start_maintenance(self, interval=LOG_COMPACT_INTERVAL):
+        """Inicia en segundo plano la limpieza periódica de logs, eventos y notificaciones"""
+        def run():
+            while True:
+                self.compact_logs()
+                self.prune_request_events()
+                self.prune_notifications()
+                time.sleep(interval)
+        
+        thread = threading.Thread(target=run, name='db-maintenance', daemon=True)
+        thread.start()
+        return thread
+    
+    def enqueue_notifications(self, notifications):
+        """Guarda en una sola transacción notificaciones (chat_id, kind, payload)"""
+        try:
+            now = time.time()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO notifications (chat_id, kind, payload, next_attempt_at)
+                    VALUES (?, ?, ?, ?)
+                ''', [(str(chat_id), kind, json.dumps(payload), now)
+                      for chat_id, kind, payload in notifications])
+                conn.commit()
+                return True
+        except Exception as e:
+            self.logger.error(f"Error encolando notificaciones: {str(e)}")
+            return False
+    
+    def claim_notifications(self, limit=50, lease_seconds=60):
+        """Reserva las notificaciones listas para enviar y las retorna
+
+        Las reservadas quedan en estado 'sending' durante lease_seconds; si el
+        proceso que las reservó muere, vuelven a estar disponibles al vencer.
+        """
+        now = time.time()
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('''
+                SELECT id, chat_id, kind, payload, attempts
+                FROM notifications
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+                ORDER BY id
+                LIMIT ?
+            ''', (now, limit)).fetchall()
+            conn.executemany(
+                "UPDATE notifications SET status = 'sending', next_attempt_at = ? WHERE id = ?",
+                [(now + lease_seconds, row[0]) for row in rows]
+            )
+            conn.commit()
+            return [{
+                'id': row[0],
+                'chat_id': row[1],
+                'kind': row[2],
+                'payload': json.loads(row[3]),
+                'attempts': row[4]
+            } for row in rows]
+        except Exception as e:
+            conn.rollback()
+            self.logger.error(f"Error reservando notificaciones: {str(e)}")
+            return []
+    
+    def complete_notification(self, notification_id):
+        """Marca una notificación como enviada"""
+        try:
+            with self.get_connection() as conn:
+                conn.execute('''
+                    UPDATE notifications
+                    SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                    WHERE id = ?
+                ''', (notification_id,))
+                conn.commit()
+        except Exception as e:
+            self.logger.error(f"Error completando notificación {notification_id}: {str(e)}")
+    
+    def fail_notification(self, notification_id, error, retry_in=None):
+        """Registra un intento fallido; con retry_in se reintenta, si no queda 'failed'"""
+        try:
+            with self.get_connection() as conn:
+                if retry_in is None:
+                    conn.execute('''
+                        UPDATE notifications
+                        SET status = 'failed', attempts = attempts + 1, last_error = ?
+                        WHERE id = ?
+                    ''', (error, notification_id))
+                else:
+                    conn.execute('''
+                        UPDATE notifications
+                        SET status = 'pending', attempts = attempts + 1, last_error = ?,
+                            next_attempt_at = ?
+                        WHERE id = ?
+                    ''', (error, time.time() + retry_in, notification_id))
+                conn.commit()
+        except Exception as e:
+            self.logger.error(f"Error registrando fallo de notificación {notification_id}: {str(e)}")
+    
+    def postpone_notifications(self, notification_ids, delay):
+        """Devuelve notificaciones reservadas a la cola sin contar un intento"""
+        try:
+            with self.get_connection() as conn:
+                conn.executemany('''
+                    UPDATE notifications
+                    SET status = 'pending', next_attempt_at = ?
+                    WHERE id = ?
+                ''', [(time.time() + delay, notification_id) for notification_id in notification_ids])
+                conn.commit()
+        except Exception as e:
+            self.logger.error(f"Error posponiendo notificaciones: {str(e)}")
+    
+    def prune_notifications(self, max_age_hours=24):
+        """Elimina las notificaciones enviadas hace más de max_age_hours"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "DELETE FROM notifications WHERE status = 'sent' AND sent_at < datetime('now', ?)",
+                    (f'-{max_age_hours} hours',)
+                )
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            self.logger.error(f"Error eliminando notificaciones enviadas: {str(e)}")
+            return 0
+    
+    def get_notification_stats(self):
+        """Cuenta las notificaciones por estado"""
+        try:
+            with self.get_connection() as conn:
+                rows = conn.execute('SELECT status, COUNT(*) FROM notifications GROUP BY status').fetchall()
+                return dict(rows)
+        except Exception as e:
+            self.logger.error(f"Error obteniendo estadísticas de notificaciones: {str(e)}")
+            return {}
+    
+    def store_telegram_update(self, update_id, payload, max_pending):
+        """Guarda una actualización recibida por webhook para el proceso del bot
+
+        Retorna False si ya hay max_pending sin procesar o si no se pudo
+        guardar. Una actualización que Telegram reenvía se guarda una vez.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute('''
+                    INSERT OR IGNORE INTO telegram_updates (update_id, payload)
+                    SELECT ?, ? WHERE (SELECT COUNT(*) FROM telegram_updates) < ?
+                ''', (update_id, payload, max_pending))
+                conn.commit()
+                if cursor.rowcount:
+                    return True
+                return conn.execute(
+                    'SELECT 1 FROM telegram_updates WHERE update_id = ?', (update_id,)
+                ).fetchone() is not None
+        except Exception as e:
+            self.logger.error(f"Error guardando la actualización {update_id}: {str(e)}")
+            return False
+    
+    def get_telegram_updates(self, limit=100):
+        """Obtiene las actualizaciones guardadas en el orden de Telegram"""
+        try:
+            with self.get_connection() as conn:
+                return conn.execute('''
+                    SELECT update_id, payload FROM telegram_updates
+                    ORDER BY update_id LIMIT ?
+                ''', (limit,)).fetchall()
+        except Exception as e:
+            self.logger.error(f"Error obteniendo actualizaciones de Telegram: {str(e)}")
+            return []
+    
+    def delete_telegram_updates(self, update_ids):
+        """Borra las actualizaciones ya entregadas al bot"""
+        try:
+            with self.get_connection() as conn:
+                conn.executemany('DELETE FROM telegram_updates WHERE update_id = ?',
+                                 [(update_id,) for update_id in update_ids])
+                conn.commit()
+                return True
+        except Exception as e:
+            self.logger.error(f"Error borrando actualizaciones de Telegram: {str(e)}")
+            return False
+    
+    def count_telegram_updates(self):
+        """Cuenta las actualizaciones que el bot todavía no procesó"""
+        try:
+            with self.get_connection() as conn:
+                return conn.execute('SELECT COUNT(*) FROM telegram_updates').fetchone()[0]
+        except Exception as e:
+            self.logger.error(f"Error contando actualizaciones de Telegram: {str(e)}")
+            return 0
+    
     def get_logs(self, limit=100, level=None, source=None):
         """Obtiene los últimos logs"""
         try:
@@ -303,3 +876,11 @@ class DatabaseManager:
         except Exception as e:
             self.logger.error(f'Error al obtener logs: {str(e)}')
             return []
+
+# Métodos que no consultan la base de datos o que inician hilos propios
+_HUB_METHODS = {'get_connection', 'close_connection', 'add_status_listener', 'start_maintenance'}
+
+if gevent_patched():
+    for _name, _method in list(vars(DatabaseManager).items()):
+        if inspect.isfunction(_method) and not _name.startswith('_') and _name not in _HUB_METHODS:
+            setattr(DatabaseManager, _name, in_threadpool(_method))
@@ -0,0 +1,62 @@
+import functools
+import threading
+
+def gevent_patched():
+    """Indica si el proceso corre con los módulos parcheados por gevent"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+def thread_local():
+    """threading.local de los hilos del sistema, también con gevent
+
+    Con workers gevent threading.local queda por greenlet y cada petición
+    abriría (y abandonaría) su propia conexión.
+    """
+    if gevent_patched():
+        from gevent import monkey
+        return monkey.get_original('threading', 'local')()
+    return threading.local()
+
+# Marca los hilos del pool de gevent que ya ejecutan llamadas bloqueantes
+_pool_thread = thread_local()
+
+def in_pool_thread():
+    """Indica si el hilo actual es un hilo del pool de gevent"""
+    return getattr(_pool_thread, 'active', False)
+
+def _run_in_pool(function, args, kwargs):
+    _pool_thread.active = True
+    return function(*args, **kwargs)
+
+def in_threadpool(function):
+    """Ejecuta function en el pool de hilos del sistema de gevent
+
+    sqlite3 bloquea el hilo que lo llama, también mientras espera un
+    bloqueo (busy_timeout); en el hub de gevent eso detendría todos los
+    streams y peticiones del worker. En el pool solo espera ese greenlet.
+    Las llamadas anidadas (una función envuelta que llama a otra) se
+    ejecutan directamente en el hilo del pool.
+    """
+    from gevent import get_hub
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if in_pool_thread():
+            return function(*args, **kwargs)
+        return get_hub().threadpool.apply(_run_in_pool, (function, args, kwargs))
+    return wrapper
+
+def in_hub(function):
+    """Llama a function en el hub de gevent del hilo que la registra
+
+    Los eventos y colas de gevent no se pueden usar desde los hilos del pool.
+    """
+    from gevent import get_hub
+    loop = get_hub().loop
+
+    def wrapper(*args):
+        loop.run_callback_threadsafe(function, *args)
+    return wrapper
@@ -1,9 +1,26 @@
+import atexit
+import gzip
+import json
 import logging
+import logging.handlers
+import queue
+import shutil
+import socketserver
 import sqlite3
+import struct
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 import os
+from config import (
+    DB_PATH, SYSTEM_LOG_CAPACITY, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_INTERVAL, LOG_SERVER_PORT
+)
+from gevent_support import gevent_patched, in_threadpool, in_hub, in_pool_thread
+
+LOG_PATH = Path(__file__).parent / 'satelwifi.log'
+LOG_BLOCK_SIZE = 64 * 1024
 
 class LoggerManager:
     _instance = None
@@ -31,15 +48,8 @@ class LoggerManager:
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
         
-        # Handler para archivo con rotación
-        log_path = Path(__file__).parent / 'satelwifi.log'
-        # Asegurarse de que no haya otros archivos de log
-        for old_log in Path(__file__).parent.glob('satelwifi.log.*'):
-            try:
-                os.remove(old_log)
-            except:
-                pass
-        file_handler = logging.FileHandler(log_path)
+        # Handler para archivo con rotación, compartido entre procesos
+        file_handler = SharedLogHandler(LOG_PATH, LOG_SERVER_PORT)
         file_handler.setFormatter(formatter)
         root_logger.addHandler(file_handler)
         
@@ -53,6 +63,10 @@ class LoggerManager:
         db_handler.setFormatter(formatter)
         root_logger.addHandler(db_handler)
         
+        if gevent_patched():
+            for handler in root_logger.handlers:
+                handler.addFilter(_HubFilter(handler))
+        
         self.logger = root_logger
         self._initialized = True
     
@@ -60,25 +74,239 @@ class LoggerManager:
         """Obtiene un logger con el nombre especificado"""
         return logging.getLogger(name)
 
+class _HubFilter(logging.Filter):
+    """Con gevent, pasa al hub los registros emitidos desde el pool de hilos
+
+    El servidor de logs, la cola del DatabaseLogHandler y los locks de los
+    handlers son de gevent y solo funcionan en el hub; un registro emitido
+    en un hilo del pool (consultas de DatabaseManager) se maneja allá.
+    """
+    
+    def __init__(self, handler):
+        super().__init__()
+        from gevent import spawn
+        # En un greenlet: enviar al escritor puede bloquear, el callback no
+        self.handle_in_hub = in_hub(lambda record: spawn(handler.handle, record))
+    
+    def filter(self, record):
+        if in_pool_thread():
+            self.handle_in_hub(record)
+            return False
+        return True
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rota el archivo por tamaño o por tiempo y comprime los archivos rotados
+
+    Los archivos rotados quedan como satelwifi.log.1.gz ... satelwifi.log.N.gz
+    """
+    
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 interval=LOG_ROTATE_INTERVAL * 3600):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count,
+                         encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._compress
+    
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+    
+    def shouldRollover(self, record):
+        if self.rollover_at and time.time() >= self.rollover_at:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.stream.tell() > 0:
+                return True
+            # No archivar archivos vacíos
+            self.rollover_at = time.time() + self.interval
+        return super().shouldRollover(record)
+    
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+class _LogRecordStreamHandler(socketserver.StreamRequestHandler):
+    """Recibe los registros que envía SharedLogHandler desde otro proceso"""
+    
+    def handle(self):
+        while True:
+            header = self.rfile.read(4)
+            if len(header) < 4:
+                break
+            length = struct.unpack('>L', header)[0]
+            data = self.rfile.read(length)
+            if len(data) < length:
+                break
+            try:
+                record = logging.makeLogRecord(json.loads(data))
+            except ValueError:
+                continue
+            self.server.target.handle(record)
+
+class LogServer(socketserver.ThreadingTCPServer):
+    """Servidor local del proceso que escribe el archivo de log"""
+    
+    daemon_threads = True
+    
+    def __init__(self, port, target):
+        super().__init__(('127.0.0.1', port), _LogRecordStreamHandler)
+        self.target = target
+        self.thread = threading.Thread(target=self.serve_forever, name='log-server', daemon=True)
+        self.thread.start()
+
+class SharedLogHandler(logging.handlers.SocketHandler):
+    """Escribe en el archivo de log compartido a través de un único proceso
+
+    El primer proceso que logra abrir el puerto local se convierte en el
+    escritor: rota y comprime el archivo y recibe los registros de los demás
+    procesos (bot, workers de gunicorn, manager_bots), que se los envían por
+    TCP. Si el escritor termina, el siguiente proceso que necesite escribir
+    ocupa su lugar. Con port=0 cada proceso escribe el archivo directamente.
+    """
+    
+    def __init__(self, path, port):
+        super().__init__('127.0.0.1', port)
+        self.path = path
+        self.server = None
+        self.writer = None
+        self.fallback = None
+        os.register_at_fork(after_in_child=self._after_fork)
+    
+    def _become_writer(self):
+        writer = CompressingRotatingFileHandler(self.path)
+        writer.setFormatter(self.formatter)
+        if self.port:
+            try:
+                self.server = LogServer(self.port, writer)
+            except OSError:
+                return False
+        self.writer = writer
+        return True
+    
+    def _after_fork(self):
+        # El proceso hijo no hereda el hilo del servidor: si el padre era el
+        # escritor, el hijo pasa a enviarle sus registros
+        if self.server:
+            self.server.socket.close()
+            self.server = None
+            self.writer = None
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+    
+    def makePickle(self, record):
+        """Serializa el registro como JSON (no se aceptan pickles por la red)"""
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        data = json.dumps({
+            'name': record.name,
+            'msg': message,
+            'levelname': record.levelname,
+            'levelno': record.levelno,
+            'pathname': record.pathname,
+            'filename': record.filename,
+            'module': record.module,
+            'lineno': record.lineno,
+            'funcName': record.funcName,
+            'created': record.created,
+            'msecs': record.msecs,
+            'process': record.process,
+            'threadName': record.threadName,
+            'exc_text': record.exc_text,
+            'stack_info': record.stack_info
+        }).encode('utf-8')
+        return struct.pack('>L', len(data)) + data
+    
+    def emit(self, record):
+        if self.writer is None:
+            super().emit(record)
+            if self.sock is not None:
+                return
+            # No hay escritor al cual enviar: este proceso toma su lugar
+            if not self._become_writer():
+                # Otro proceso ganó el puerto: conectarse a él con el próximo
+                # registro (sin esperar el retryTime) y no perder este
+                self.retryTime = None
+                self._write_direct(record)
+                return
+        self.writer.handle(record)
+    
+    def _write_direct(self, record):
+        """Agrega el registro al archivo sin pasar por el escritor"""
+        if self.fallback is None:
+            # Sin rotación: de eso se encarga solo el escritor
+            self.fallback = CompressingRotatingFileHandler(self.path, max_bytes=0, interval=0)
+            self.fallback.setFormatter(self.formatter)
+        self.fallback.handle(record)
+        # Cerrar siempre: el escritor puede rotar el archivo en cualquier momento
+        self.fallback.close()
+    
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.writer:
+            self.writer.close()
+        if self.fallback:
+            self.fallback.close()
+        super().close()
+
 class DatabaseLogHandler(logging.Handler):
-    def __init__(self):
+    """Handler que guarda los logs en SQLite desde un hilo en segundo plano
+
+    emit() solo encola el registro ya formateado; el hilo escritor inserta
+    los registros por lotes, de modo que quien registra nunca espera por la
+    base de datos. Con gevent el hilo escritor es un greenlet del hub, así
+    que la conexión y las inserciones se hacen en el pool de hilos. La
+    tabla es un buffer circular de capacity posiciones: cada registro ocupa
+    la posición seq % capacity y reemplaza al más viejo.
+    """
+    
+    def __init__(self, capacity=SYSTEM_LOG_CAPACITY, queue_size=10000, batch_size=500,
+                 flush_interval=1.0):
         super().__init__()
-        self.db_path = Path(__file__).parent / 'satelwifi.db'
+        self.db_path = DB_PATH
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        if gevent_patched():
+            self._connect = in_threadpool(self._connect)
+            self._write = in_threadpool(self._write)
+            self._disconnect = in_threadpool(self._disconnect)
         self._setup_database()
+        self._start_worker()
+        # Los hilos no sobreviven a un fork (workers de gunicorn)
+        os.register_at_fork(after_in_child=self._start_worker)
+        atexit.register(self.close)
+    
+    def _start_worker(self):
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._thread = threading.Thread(target=self._worker, name='db-log-writer', daemon=True)
+        self._thread.start()
     
     def _setup_database(self):
-        """Configura la tabla de logs en la base de datos"""
+        """Configura la tabla de logs en la base de datos sin borrar los existentes"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = sqlite3.connect(self.db_path, timeout=20)
             cursor = conn.cursor()
             
-            # Eliminar tabla si existe
-            cursor.execute('DROP TABLE IF EXISTS system_logs')
+            # La versión anterior de la tabla (sin buffer circular) se reemplaza una vez
+            columns = [row[1] for row in cursor.execute('PRAGMA table_info(system_logs)')]
+            if columns and 'slot' not in columns:
+                cursor.execute('DROP TABLE system_logs')
             
-            # Crear tabla
             cursor.execute('''
-                CREATE TABLE system_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                CREATE TABLE IF NOT EXISTS system_logs (
+                    slot INTEGER PRIMARY KEY,
+                    seq INTEGER NOT NULL,
                     timestamp TEXT NOT NULL,
                     logger_name TEXT,
                     level TEXT NOT NULL,
@@ -86,6 +314,9 @@ class DatabaseLogHandler(logging.Handler):
                     source TEXT
                 )
             ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_system_logs_seq ON system_logs(seq)')
+            # Si se redujo SYSTEM_LOG_CAPACITY, las posiciones sobrantes ya no se reemplazan
+            cursor.execute('DELETE FROM system_logs WHERE slot >= ?', (self.capacity,))
             
             conn.commit()
             conn.close()
@@ -93,37 +324,177 @@ class DatabaseLogHandler(logging.Handler):
             print(f"Error al configurar la base de datos: {e}")
     
     def emit(self, record):
-        """Guarda el registro en la base de datos"""
+        """Encola el registro para guardarlo en la base de datos"""
         try:
-            conn = sqlite3.connect(self.db_path, timeout=20)
-            cursor = conn.cursor()
-            
-            # Mantener solo los últimos 100 registros
-            cursor.execute('''
-                DELETE FROM system_logs 
-                WHERE id NOT IN (
-                    SELECT id FROM system_logs 
-                    ORDER BY timestamp DESC 
-                    LIMIT 100
-                )
-            ''')
-            
-            # Insertar nuevo registro
-            cursor.execute('''
-                INSERT INTO system_logs (timestamp, logger_name, level, message, source)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
+            row = (
                 datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S'),
                 record.name or '',
                 record.levelname,
                 self.format(record),
                 f"{record.filename}:{record.lineno}" if hasattr(record, 'filename') else None
-            ))
-            
+            )
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Nunca bloquear a quien registra: descartar si la cola está llena
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+    
+    def _connect(self):
+        # La conexión pasa por distintos hilos del pool, nunca por dos a la vez
+        return sqlite3.connect(self.db_path, timeout=20, check_same_thread=False)
+    
+    def _disconnect(self, conn):
+        conn.close()
+    
+    def _write(self, conn, rows):
+        try:
+            # El siguiente seq se calcula por fila, así varios procesos
+            # pueden escribir en el mismo buffer sin pisarse
+            conn.executemany('''
+                INSERT OR REPLACE INTO system_logs (slot, seq, timestamp, logger_name, level, message, source)
+                SELECT next_seq % ?, next_seq, ?, ?, ?, ?, ?
+                FROM (SELECT COALESCE(MAX(seq), 0) + 1 AS next_seq FROM system_logs)
+            ''', [(self.capacity,) + row for row in rows])
             conn.commit()
-            conn.close()
         except Exception as e:
-            print(f"Error al guardar log en la base de datos: {e}")
+            conn.rollback()
+            print(f"Error al guardar logs en la base de datos: {e}")
+    
+    def _worker(self):
+        log_queue = self._queue
+        conn = self._connect()
+        running = True
+        while running:
+            rows = []
+            waiters = []
+            try:
+                item = log_queue.get(timeout=self.flush_interval)
+                while True:
+                    if item is None:
+                        running = False
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        rows.append(item)
+                    if len(rows) >= self.batch_size:
+                        break
+                    item = log_queue.get_nowait()
+            except queue.Empty:
+                pass
+            
+            if rows:
+                self._write(conn, rows)
+            for waiter in waiters:
+                waiter.set()
+        self._disconnect(conn)
+    
+    def flush(self, timeout=5.0):
+        """Espera a que se guarden los registros encolados hasta ahora"""
+        if not self._thread.is_alive():
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+            done.wait(timeout)
+        except queue.Full:
+            pass
+    
+    def close(self):
+        """Guarda los registros pendientes y detiene el hilo escritor"""
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=1.0)
+                self._thread.join(timeout=5.0)
+            except queue.Full:
+                pass
+        super().close()
+
+def parse_log_line(line: str) -> Optional[dict]:
+    """Parsea una línea con formato: timestamp - name - level - message"""
+    parts = line.rstrip('\r\n').split(' - ', 3)
+    if len(parts) < 4:
+        return None
+    timestamp, name, level, message = parts
+    return {
+        'timestamp': timestamp,
+        'source': name,
+        'level': level,
+        'message': message
+    }
+
+def _parse_matching(raw, level, source):
+    entry = parse_log_line(raw.decode('utf-8', errors='replace'))
+    if entry is None:
+        return None
+    if level and entry['level'].lower() != level.lower():
+        return None
+    if source and source.lower() not in entry['source'].lower():
+        return None
+    return entry
+
+def read_log_tail(path=LOG_PATH, limit=1000, after=None, level=None, source=None,
+                  max_scan=8 * 1024 * 1024):
+    """Lee las últimas líneas del archivo de log sin cargarlo completo
+
+    Sin after, recorre el archivo hacia atrás por bloques hasta reunir limit
+    líneas que cumplan los filtros. Con after (un cursor devuelto antes),
+    solo lee los bytes escritos desde ese punto. Nunca se leen más de
+    max_scan bytes. Retorna (entradas en orden cronológico, cursor, reset);
+    reset indica que el cursor ya no era válido (archivo vaciado o rotado)
+    y las entradas reemplazan a las anteriores en lugar de agregarse.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return [], 0, after is not None
+    
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        
+        if after is not None and 0 <= after <= size and size - after <= max_scan:
+            f.seek(after)
+            data = f.read(size - after)
+            # La última línea puede estar a medio escribir
+            end = data.rfind(b'\n') + 1
+            entries = []
+            for raw in data[:end].split(b'\n'):
+                entry = _parse_matching(raw, level, source)
+                if entry is not None:
+                    entries.append(entry)
+            return entries[-limit:], after + end, False
+        
+        entries = []
+        cursor = None
+        pos = size
+        tail = b''
+        while pos > 0 and len(entries) < limit and size - pos < max_scan:
+            step = min(LOG_BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + tail).split(b'\n')
+            # La primera línea del bloque puede continuar en el bloque anterior
+            tail = lines.pop(0)
+            if cursor is None:
+                if not lines:
+                    continue
+                cursor = size - len(lines.pop())
+            for raw in reversed(lines):
+                entry = _parse_matching(raw, level, source)
+                if entry is not None:
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        break
+        
+        if cursor is None:
+            cursor = 0
+        elif pos == 0 and len(entries) < limit:
+            entry = _parse_matching(tail, level, source)
+            if entry is not None:
+                entries.append(entry)
+        
+        entries.reverse()
+        return entries, cursor, after is not None
 
 def get_logger(name: Optional[str] = None) -> logging.Logger:
     """Obtiene un logger del LoggerManager"""
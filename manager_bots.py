@@ -8,19 +8,41 @@ import time
 import signal
 import traceback
 import re
+import hashlib
+import json
+import threading
+import urllib.request
+from collections import deque
 from datetime import datetime
 from logger_manager import get_logger
 
 logger = get_logger('manager_bots')
 
+def requirements_hash(requirements_path, venv_path):
+    """Hash de requirements.txt y de la versión de Python del entorno (pyvenv.cfg)"""
+    digest = hashlib.sha256(Path(requirements_path).read_bytes())
+    digest.update((Path(venv_path) / "pyvenv.cfg").read_bytes())
+    return digest.hexdigest()
+
 def setup_virtual_environment():
-    """Configura el entorno virtual si no existe y lo activa"""
-    venv_path = Path(__file__).parent / "venv"
+    """Configura el entorno virtual si no existe y lo activa
+
+    Las dependencias solo se instalan cuando cambia requirements.txt: el
+    hash de la última instalación correcta queda en venv/.requirements.sha256
+    y, si coincide, el arranque no ejecuta pip (ni necesita red).
+    """
+    started = time.monotonic()
+    base_dir = Path(__file__).parent
+    venv_path = base_dir / "venv"
+    requirements_path = base_dir / "requirements.txt"
+    stamp_path = venv_path / ".requirements.sha256"
     
     # Crear entorno virtual si no existe
+    created = False
     if not venv_path.exists():
         logger.info("Creando entorno virtual...")
         venv.create(venv_path, with_pip=True)
+        created = True
     
     # Obtener el path del python del entorno virtual
     if sys.platform == "win32":
@@ -32,20 +54,33 @@ def setup_virtual_environment():
         logger.error("Error: No se pudo crear el entorno virtual")
         sys.exit(1)
 
+    expected = requirements_hash(requirements_path, venv_path)
+    installed = stamp_path.read_text().strip() if stamp_path.exists() else None
+    if installed != expected:
+        logger.info("requirements.txt cambió, instalando dependencias...")
+        if created:
+            subprocess.run([str(python_path), "-m", "pip", "install", "--upgrade", "pip"])
+        result = subprocess.run([str(python_path), "-m", "pip", "install", "-r", str(requirements_path)])
+        if result.returncode != 0:
+            logger.error("Error instalando dependencias")
+            sys.exit(1)
+        stamp_path.write_text(expected)
+        logger.info(f"Dependencias instaladas en {time.monotonic() - started:.1f}s")
+    else:
+        logger.info(f"Dependencias al día, entorno listo en {time.monotonic() - started:.2f}s")
+
     # Si no estamos en el entorno virtual, reejecutar el script en él
-    if sys.executable != str(python_path):
+    if Path(sys.prefix).resolve() != venv_path.resolve():
         logger.info("Activando entorno virtual...")
-        subprocess.run([str(python_path), "-m", "pip", "install", "--upgrade", "pip"])
-        subprocess.run([str(python_path), "-m", "pip", "install", "-r", "requirements.txt"])
-        subprocess.run([str(python_path), "-m", "pip", "install", "python-dotenv"])  # Instalar python-dotenv
         os.execv(str(python_path), [str(python_path)] + sys.argv)
-    else:
-        # Asegurarse de que python-dotenv esté instalado
-        subprocess.run([str(python_path), "-m", "pip", "install", "python-dotenv"])
 
 # Importar ADMIN_IDS después de configurar el entorno virtual
 setup_virtual_environment()
-from config import ADMIN_IDS  # Eliminar REFRESH_INTERVAL de la importación
+from config import (  # Eliminar REFRESH_INTERVAL de la importación
+    ADMIN_IDS, SUPERVISOR_CHECK_INTERVAL, SUPERVISOR_HEALTH_FAILURES, SUPERVISOR_STARTUP_TIMEOUT,
+    SUPERVISOR_MAX_BACKOFF, SUPERVISOR_STATUS_FILE, BOT_HEARTBEAT_TIMEOUT, WEB_HEALTH_PORT
+)
+import psutil
 
 # Inicializar el logger centralizado
 logger.info("Iniciando Manager Bots")
@@ -53,38 +88,233 @@ logger.info("Iniciando Manager Bots")
 def kill_existing_processes():
     """Mata los procesos existentes de Python relacionados con el proyecto"""
     try:
+        started = time.monotonic()
         # Obtener el directorio del proyecto
         project_dir = os.path.dirname(os.path.abspath(__file__))
         logger.info(f"Limpiando procesos en {project_dir}")
         
-        # Usar pkill para matar procesos específicos
-        processes_to_kill = [
-            "python.*client_bot.py",
-            "python.*run.py",
-            "flask"
-        ]
+        patterns = [re.compile(pattern) for pattern in (
+            r"python.*client_bot\.py",
+            r"python.*run\.py",
+            r"flask"
+        )]
+        processes = []
+        for process in psutil.process_iter(['pid', 'cmdline']):
+            if process.info['pid'] == os.getpid():
+                continue
+            cmdline = ' '.join(process.info['cmdline'] or [])
+            if any(pattern.search(cmdline) for pattern in patterns):
+                try:
+                    process.terminate()
+                    processes.append(process)
+                    logger.info(f"Proceso {process.info['pid']} detenido: {cmdline}")
+                except psutil.Error as e:
+                    logger.warning(f"Error al detener {process.info['pid']}: {str(e)}")
         
-        for process in processes_to_kill:
+        # Esperar solo lo necesario a que terminen; forzar a los que no respondan
+        _, alive = psutil.wait_procs(processes, timeout=5)
+        for process in alive:
             try:
-                subprocess.run(['pkill', '-f', process], check=False)
-                logger.info(f"Proceso {process} detenido")
-            except Exception as e:
-                logger.warning(f"Error al detener {process}: {str(e)}")
-        
-        # Esperar un momento para asegurar que los procesos se detengan
-        time.sleep(2)
-        logger.info("Limpieza de procesos completada")
+                process.kill()
+            except psutil.Error:
+                pass
+        psutil.wait_procs(alive, timeout=2)
+        logger.info(f"Limpieza de procesos completada en {time.monotonic() - started:.2f}s")
     except Exception as e:
         logger.error(f"Error en kill_existing_processes: {str(e)}")
 
+# Líneas de salida de cada proceso que se conservan para el panel
+OUTPUT_LINES = 200
+# Tiempo funcionando tras el cual se reinicia la espera entre reinicios
+STABLE_AFTER = 60
+
+class ManagedProcess:
+    """Proceso hijo vigilado por el BotManager
+
+    La salida (stdout y stderr) la lee un hilo y guarda las últimas
+    OUTPUT_LINES líneas, así el proceso nunca se bloquea por un pipe lleno.
+    probe() indica si el proceso responde; el primer éxito lo marca como
+    listo y, después, SUPERVISOR_HEALTH_FAILURES fallos seguidos (o no
+    estar listo en SUPERVISOR_STARTUP_TIMEOUT) piden reiniciarlo.
+    """
+
+    def __init__(self, name, command, cwd, probe, env=None, on_start=None):
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.probe = probe
+        self.env = env or {}
+        self.on_start = on_start
+        self.process = None
+        self.output = deque(maxlen=OUTPUT_LINES)
+        self.started_at = None
+        self.started_wall = None
+        self.ready_after = None
+        self.failures = 0
+        self.restarts = 0
+        self.backoff = 0
+        self.next_start = 0
+        self.last_exit_code = None
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        logger.info(f"Iniciando {self.name}...")
+        if self.on_start:
+            self.on_start()
+        env = os.environ.copy()
+        env.update(self.env)
+        self.process = subprocess.Popen(
+            self.command,
+            cwd=self.cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            text=True,
+            errors='replace'
+        )
+        self.started_at = time.monotonic()
+        self.started_wall = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.ready_after = None
+        self.failures = 0
+        threading.Thread(
+            target=self._drain, args=(self.process.stdout,), name=f'{self.name}-output', daemon=True
+        ).start()
+        logger.info(f"{self.name} iniciado (pid {self.process.pid})")
+
+    def _drain(self, stream):
+        for line in stream:
+            self.output.append(line.rstrip('\n'))
+        stream.close()
+
+    def stop(self, timeout=5):
+        if not self.process:
+            return
+        try:
+            # Los workers de gunicorn colgados siguen ocupando el puerto si
+            # solo muere el proceso principal
+            try:
+                children = psutil.Process(self.process.pid).children(recursive=True)
+            except psutil.Error:
+                children = []
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=timeout)
+                logger.info(f"{self.name} detenido")
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+                logger.info(f"{self.name} detenido forzosamente")
+            _, alive = psutil.wait_procs(children, timeout=1)
+            for child in alive:
+                try:
+                    child.kill()
+                except psutil.Error:
+                    pass
+            psutil.wait_procs(alive, timeout=2)
+        except Exception as e:
+            logger.error(f"Error al detener {self.name}: {e}")
+        self.last_exit_code = self.process.returncode
+
+    def check(self):
+        """Retorna el motivo para reiniciar el proceso, o None si está bien"""
+        exit_code = self.process.poll()
+        if exit_code is not None:
+            self.last_exit_code = exit_code
+            return f"terminó con código {exit_code}"
+        healthy = self._probe()
+        if self.ready_after is None:
+            if healthy:
+                self.ready_after = time.monotonic() - self.started_at
+                logger.info(f"Servicio {self.name} listo en {self.ready_after:.2f}s")
+            elif time.monotonic() - self.started_at > SUPERVISOR_STARTUP_TIMEOUT:
+                return f"no estuvo listo en {SUPERVISOR_STARTUP_TIMEOUT:.0f}s"
+            return None
+        if healthy:
+            self.failures = 0
+            return None
+        self.failures += 1
+        if self.failures >= SUPERVISOR_HEALTH_FAILURES:
+            return f"no responde ({self.failures} verificaciones fallidas)"
+        return None
+
+    def _probe(self):
+        try:
+            return bool(self.probe())
+        except Exception:
+            return False
+
+    def schedule_restart(self, reason, stop_timeout=5):
+        """Detiene el proceso y programa su reinicio con espera exponencial"""
+        self.last_error = reason
+        uptime = time.monotonic() - self.started_at if self.started_at else 0
+        tail = '\n'.join(list(self.output)[-10:])
+        logger.error(f"{self.name} {reason}; últimas líneas:\n{tail}")
+        self.stop(stop_timeout)
+        self.process = None
+        if uptime >= STABLE_AFTER:
+            self.backoff = 1
+        else:
+            self.backoff = min(SUPERVISOR_MAX_BACKOFF, max(1, self.backoff * 2))
+        self.restarts += 1
+        self.next_start = time.monotonic() + self.backoff
+        logger.info(f"Reiniciando {self.name} en {self.backoff}s (reinicio #{self.restarts})")
+
+    def status(self):
+        running = self.running
+        if running:
+            state = 'running' if self.ready_after is not None else 'starting'
+        else:
+            state = 'restarting' if self.next_start else 'stopped'
+        return {
+            'state': state,
+            'pid': self.process.pid if running else None,
+            'started_at': self.started_wall,
+            'uptime': round(time.monotonic() - self.started_at) if running else None,
+            'ready_after': round(self.ready_after, 2) if self.ready_after is not None else None,
+            'restarts': self.restarts,
+            'backoff': self.backoff,
+            'failures': self.failures,
+            'last_exit_code': self.last_exit_code,
+            'last_error': self.last_error,
+            'output': list(self.output)[-50:]
+        }
+
 class BotManager:
-    """Clase para manejar el bot de Telegram"""
+    """Supervisa el bot de Telegram y el servidor web
+
+    Cada SUPERVISOR_CHECK_INTERVAL segundos verifica ambos procesos (el bot
+    por su archivo de heartbeat, la web por la sonda de gunicorn), reinicia los que
+    terminaron o dejaron de responder y guarda su estado en
+    SUPERVISOR_STATUS_FILE para el panel de administración.
+    """
     
     def __init__(self):
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
-        self.bot_process = None
-        self.web_process = None
         self.should_run = True
+        # client_bot.py reescribe este archivo mientras recibe actualizaciones
+        self.bot_heartbeat_file = os.path.join(self.base_dir, 'bot.heartbeat')
+        self.services = [
+            ManagedProcess(
+                'bot',
+                [sys.executable, 'client_bot.py'],
+                self.base_dir,
+                self.bot_alive,
+                env={'BOT_HEARTBEAT_FILE': self.bot_heartbeat_file},
+                on_start=self.clear_heartbeat
+            ),
+            ManagedProcess(
+                'web',
+                [sys.executable, 'run.py'],
+                os.path.join(self.base_dir, 'web'),
+                self.web_alive,
+                # Configurar variables de entorno para producción
+                env={'FLASK_ENV': 'production', 'FLASK_DEBUG': '0'}
+            )
+        ]
         
         # Configurar el manejador de señales
         signal.signal(signal.SIGTERM, self.handle_shutdown)
@@ -94,89 +324,82 @@ class BotManager:
         """Maneja el apagado graceful del bot y el servidor web"""
         logger.info("Deteniendo servicios...")
         self.should_run = False
-        self.stop_bot()
-        self.stop_web()
+        for service in self.services:
+            service.stop()
+            service.process = None
+            service.next_start = 0
+        self.write_status()
         logger.info("Servicios detenidos.")
         sys.exit(0)
 
-    def start_bot(self):
-        """Inicia el bot de Telegram"""
+    def clear_heartbeat(self):
+        if os.path.exists(self.bot_heartbeat_file):
+            os.remove(self.bot_heartbeat_file)
+
+    def bot_alive(self):
+        """El bot está vivo si reescribió su heartbeat hace poco"""
         try:
-            logger.info("Iniciando bot...")
-            self.bot_process = subprocess.Popen(
-                [sys.executable, 'client_bot.py'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            logger.info("Bot iniciado exitosamente")
-        except Exception as e:
-            logger.error(f"Error al iniciar el bot: {e}")
+            age = time.time() - os.path.getmtime(self.bot_heartbeat_file)
+        except OSError:
+            return False
+        return age <= BOT_HEARTBEAT_TIMEOUT
 
-    def stop_bot(self):
-        """Detiene el proceso del bot"""
-        if self.bot_process:
-            logger.info("Deteniendo bot...")
-            try:
-                self.bot_process.terminate()
-                try:
-                    self.bot_process.wait(timeout=5)
-                    logger.info("Bot detenido exitosamente")
-                except subprocess.TimeoutExpired:
-                    logger.info("No se pudo obtener la salida del proceso, procediendo a terminar")
-                    self.bot_process.kill()
-                    logger.info("Bot detenido exitosamente")
-            except Exception as e:
-                logger.error(f"Error al detener el bot: {e}")
-
-    def start_web(self):
-        """Inicia el servidor web Flask"""
+    def web_alive(self):
+        """El servidor web está vivo si el proceso principal de gunicorn lo confirma
+
+        La sonda no usa el puerto de la app: con todos los hilos ocupados
+        por streams esperaría en la cola y el servidor se reiniciaría sin
+        estar caído (ver HealthHandler en web/run.py).
+        """
+        url = f'http://127.0.0.1:{WEB_HEALTH_PORT}/'
         try:
-            logger.info("Iniciando servidor web...")
-            os.chdir(os.path.join(self.base_dir, 'web'))
-            
-            # Configurar variables de entorno para producción
-            env = os.environ.copy()
-            env['FLASK_ENV'] = 'production'
-            env['FLASK_DEBUG'] = '0'
-            
-            self.web_process = subprocess.Popen(
-                [sys.executable, 'run.py'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                env=env
-            )
-            os.chdir(self.base_dir)
-            logger.info("Servidor web iniciado exitosamente")
-        except Exception as e:
-            logger.error(f"Error al iniciar el servidor web: {e}")
-            os.chdir(self.base_dir)
+            with urllib.request.urlopen(url, timeout=2) as response:
+                return response.status == 200
+        except OSError:
+            return False
 
-    def stop_web(self):
-        """Detiene el servidor web"""
-        if self.web_process:
-            try:
-                self.web_process.terminate()
-                try:
-                    self.web_process.wait(timeout=5)
-                    logger.info("Servidor web detenido")
-                except subprocess.TimeoutExpired:
-                    self.web_process.kill()
-                    logger.info("Servidor web detenido forzosamente")
-            except Exception as e:
-                logger.error(f"Error al detener el servidor web: {e}")
+    def supervise(self):
+        """Una pasada: inicia, verifica y reinicia los servicios"""
+        now = time.monotonic()
+        for service in self.services:
+            if service.process is None:
+                if now >= service.next_start:
+                    try:
+                        service.start()
+                    except Exception as e:
+                        service.started_at = None
+                        service.schedule_restart(f"no se pudo iniciar: {e}")
+                continue
+            reason = service.check()
+            if reason:
+                # Un proceso que no responde tampoco termina ordenadamente
+                service.schedule_restart(reason, stop_timeout=1 if service.process.poll() is None else 5)
+
+    def write_status(self):
+        """Guarda el estado de los servicios en SUPERVISOR_STATUS_FILE"""
+        status = {
+            'pid': os.getpid(),
+            'updated_at': time.time(),
+            'check_interval': SUPERVISOR_CHECK_INTERVAL,
+            'services': {service.name: service.status() for service in self.services}
+        }
+        try:
+            tmp_path = f"{SUPERVISOR_STATUS_FILE}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(status, f)
+            os.replace(tmp_path, SUPERVISOR_STATUS_FILE)
+        except OSError as e:
+            logger.error(f"Error guardando el estado del supervisor: {e}")
 
     def run(self):
         """Ejecuta el manager"""
         logger.info("Iniciando BotManager...")
         
-        # Iniciar el bot y el servidor web
-        self.start_bot()
-        self.start_web()
-        
-        # Mantener el proceso principal vivo
         try:
             while self.should_run:
-                time.sleep(1)
+                self.supervise()
+                self.write_status()
+                time.sleep(SUPERVISOR_CHECK_INTERVAL)
         except KeyboardInterrupt:
             logger.info("Deteniendo BotManager...")
             self.handle_shutdown(None, None)
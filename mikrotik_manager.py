@@ -1,239 +1,897 @@
 import logging
 import routeros_api
-from config import MIKROTIK_IP, MIKROTIK_USER, MIKROTIK_PASSWORD
+from routeros_api import exceptions as routeros_exceptions
+from config import (
+    MIKROTIK_IP, MIKROTIK_USER, MIKROTIK_PASSWORD,
+    MIKROTIK_POOL_SIZE, MIKROTIK_POOL_TIMEOUT, MIKROTIK_HEALTH_CHECK_INTERVAL,
+    MIKROTIK_MAX_BACKOFF, MIKROTIK_CACHE_TTL, MIKROTIK_LISTENER_ENABLED
+)
+import os
 import re
+import threading
+import time
 import traceback
+from contextlib import contextmanager
 from logger_manager import get_logger
 from datetime import datetime
+from pathlib import Path
 
 # Usar el nuevo sistema de logging centralizado
 logger = get_logger('mikrotik_manager')
 
-class MikrotikManager:
-    """Clase para manejar las operaciones con MikroTik"""
-    
-    def __init__(self):
-        self.connection = None
-        self.api = None
-    
-    def connect(self):
-        """Establece conexión con MikroTik"""
+
+class MikrotikConnectionError(Exception):
+    """No se pudo obtener una conexión utilizable con MikroTik"""
+
+
+# Errores tras los cuales la sesión no se puede reutilizar: la conexión se
+# cayó o el flujo del protocolo quedó desincronizado
+_BROKEN_SESSION_ERRORS = (
+    routeros_exceptions.RouterOsApiConnectionError,
+    routeros_exceptions.RouterOsApiFatalCommunicationError,
+    routeros_exceptions.FatalRouterOsApiError,
+    routeros_exceptions.RouterOsApiParsingError,
+    OSError
+)
+
+
+class _PooledConnection:
+    """Sesión de RouterOS ya autenticada que vive dentro del pool"""
+
+    def __init__(self, pool, api):
+        self.pool = pool
+        self.api = api
+        self.last_used = time.monotonic()
+
+    @property
+    def connected(self):
+        return self.pool.connected
+
+    def close(self):
         try:
-            self.connection = routeros_api.RouterOsApiPool(
-                MIKROTIK_IP,
-                username=MIKROTIK_USER,
-                password=MIKROTIK_PASSWORD,
+            self.pool.disconnect()
+        except Exception as e:
+            logger.warning(f"Error cerrando conexión con MikroTik: {str(e)}")
+
+
+class MikrotikConnectionPool:
+    """Pool de conexiones persistentes y thread-safe hacia MikroTik"""
+
+    def __init__(self, host, username, password, max_size=2, timeout=10,
+                 health_check_interval=30, max_backoff=60):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._idle = []
+        self._backoff = 0
+        self._retry_at = 0
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'recreated': 0,
+            'health_checks': 0,
+            'failed_health_checks': 0,
+            'connect_errors': 0,
+            'discarded': 0
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _open(self):
+        """Abre una nueva sesión respetando la espera entre reintentos"""
+        with self._lock:
+            wait = self._retry_at - time.monotonic()
+        if wait > 0:
+            raise MikrotikConnectionError(
+                f"Reconexión con MikroTik en espera ({wait:.1f}s restantes)"
+            )
+
+        try:
+            pool = routeros_api.RouterOsApiPool(
+                self.host,
+                username=self.username,
+                password=self.password,
                 plaintext_login=True
             )
-            self.api = self.connection.get_api()
+            api = pool.get_api()
+        except Exception as e:
+            with self._lock:
+                self._stats['connect_errors'] += 1
+                self._backoff = min(self.max_backoff, (self._backoff * 2) or 1)
+                self._retry_at = time.monotonic() + self._backoff
+                backoff = self._backoff
+            logger.error(f"Error conectando a MikroTik: {str(e)} (reintento en {backoff}s)")
+            raise MikrotikConnectionError(str(e)) from e
+
+        with self._lock:
+            self._backoff = 0
+            self._retry_at = 0
+            self._stats['created'] += 1
+        return _PooledConnection(pool, api)
+
+    def _is_healthy(self, conn):
+        """Verifica una conexión que lleva tiempo sin usarse"""
+        if not conn.connected:
+            return False
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+
+        self._count('health_checks')
+        try:
+            conn.api.get_resource('/system/identity').get()
             return True
         except Exception as e:
-            logger.error(f"Error conectando a MikroTik: {str(e)}")
+            self._count('failed_health_checks')
+            logger.warning(f"Conexión con MikroTik no responde: {str(e)}")
             return False
-    
-    def disconnect(self):
-        """Cierra la conexión con MikroTik"""
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise MikrotikConnectionError("No hay conexiones libres con MikroTik")
+
         try:
-            if self.connection:
-                self.connection.disconnect()
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._open()
+                if self._is_healthy(conn):
+                    self._count('reused')
+                    return conn
+                conn.close()
+                self._count('recreated')
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken=False):
+        try:
+            if broken or not conn.connected:
+                conn.close()
+                self._count('discarded')
+            else:
+                conn.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Presta una API autenticada y la devuelve al pool al terminar"""
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn.api
+        except _BROKEN_SESSION_ERRORS:
+            broken = True
+            raise
+        except Exception:
+            # Error del comando (!trap) o del código que usa la API: la
+            # sesión sigue siendo válida
+            raise
+        except BaseException:
+            # Interrumpida a mitad de una respuesta (timeout de gevent)
+            broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def stats(self):
+        """Retorna los contadores de uso del pool"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+            stats['max_size'] = self.max_size
+            stats['backoff'] = self._backoff
+        return stats
+
+    def close_all(self):
+        """Cierra todas las conexiones ociosas"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    """Obtiene el pool de conexiones compartido por el proceso"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Tras un fork (workers de gunicorn) cada proceso abre sus propias sesiones
+        if _pool is None or _pool_pid != os.getpid():
+            _pool_pid = os.getpid()
+            _pool = MikrotikConnectionPool(
+                MIKROTIK_IP,
+                MIKROTIK_USER,
+                MIKROTIK_PASSWORD,
+                max_size=MIKROTIK_POOL_SIZE,
+                timeout=MIKROTIK_POOL_TIMEOUT,
+                health_check_interval=MIKROTIK_HEALTH_CHECK_INTERVAL,
+                max_backoff=MIKROTIK_MAX_BACKOFF
+            )
+        return _pool
+
+
+class HotspotSnapshot:
+    """Copia de las tablas de usuarios y sesiones del hotspot en un instante dado"""
+
+    def __init__(self, users, active, generation):
+        self.users = users
+        self.active = active
+        self.generation = generation
+        self.loaded_at = time.monotonic()
+        self.formatted = None
+
+
+class HotspotSnapshotCache:
+    """Caché en memoria del hotspot con TTL y recarga stale-while-revalidate"""
+
+    def __init__(self, ttl=15, stamp_path=None):
+        self.ttl = ttl
+        # Archivo cuyo mtime comparten los procesos para invalidar la caché
+        self.stamp_path = stamp_path
+        self._cond = threading.Condition()
+        self._snapshot = None
+        self._generation = 0
+        self._stamp = None
+        self._refreshing = False
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'errors': 0
+        }
+
+    def _read_stamp(self):
+        if not self.stamp_path:
+            return None
+        try:
+            return os.stat(self.stamp_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _check_stamp(self):
+        """Invalida la copia local si otro proceso modificó el hotspot"""
+        stamp = self._read_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._generation += 1
+
+    def _is_valid(self, snapshot):
+        return snapshot is not None and snapshot.generation == self._generation
+
+    def get(self, loader):
+        """Retorna la copia vigente, recargándola con loader() si hace falta"""
+        with self._cond:
+            self._check_stamp()
+            snapshot = self._snapshot
+            if self._is_valid(snapshot):
+                if time.monotonic() - snapshot.loaded_at > self.ttl:
+                    # Servir la copia vencida mientras se recarga en segundo plano
+                    self._stats['stale_hits'] += 1
+                    if not self._refreshing:
+                        self._refreshing = True
+                        threading.Thread(
+                            target=self._refresh,
+                            args=(loader, self._generation, False),
+                            daemon=True
+                        ).start()
+                else:
+                    self._stats['hits'] += 1
+                return snapshot
+
+            # Sin copia válida: esperar la recarga en curso o hacerla nosotros
+            self._stats['misses'] += 1
+            while self._refreshing:
+                self._cond.wait()
+                if self._is_valid(self._snapshot):
+                    return self._snapshot
+            self._refreshing = True
+            generation = self._generation
+
+        return self._refresh(loader, generation, True)
+
+    def _refresh(self, loader, generation, raise_errors):
+        snapshot = None
+        try:
+            users, active = loader()
+            snapshot = HotspotSnapshot(users, active, generation)
+            with self._cond:
+                self._stats['refreshes'] += 1
+                self._snapshot = snapshot
+            return snapshot
         except Exception as e:
-            logger.error(f"Error desconectando de MikroTik: {str(e)}")
+            with self._cond:
+                self._stats['errors'] += 1
+            logger.error(f"Error recargando caché del hotspot: {str(e)}")
+            if raise_errors:
+                raise
+            return None
+        finally:
+            with self._cond:
+                self._refreshing = False
+                self._cond.notify_all()
+
+    def invalidate(self, local_only=False):
+        """Descarta la copia actual en este y en los demás procesos"""
+        stamp = None
+        if self.stamp_path and not local_only:
+            try:
+                Path(self.stamp_path).touch()
+                stamp = self._read_stamp()
+            except OSError as e:
+                logger.warning(f"No se pudo marcar la caché del hotspot como inválida: {str(e)}")
+        with self._cond:
+            self._generation += 1
+            if stamp is not None:
+                self._stamp = stamp
+
+    def stats(self):
+        """Retorna los contadores de la caché"""
+        with self._cond:
+            stats = dict(self._stats)
+            snapshot = self._snapshot
+            stats['ttl'] = self.ttl
+            stats['age'] = round(time.monotonic() - snapshot.loaded_at, 1) if snapshot else None
+            stats['users'] = len(snapshot.users) if snapshot else 0
+        return stats
+
+
+_snapshot_cache = None
+
+
+def get_snapshot_cache():
+    """Obtiene la caché del hotspot compartida por el proceso"""
+    global _snapshot_cache
+    with _pool_lock:
+        if _snapshot_cache is None:
+            _snapshot_cache = HotspotSnapshotCache(
+                ttl=MIKROTIK_CACHE_TTL,
+                stamp_path=Path(__file__).parent / 'satelwifi.hotspot.stamp'
+            )
+        return _snapshot_cache
+
+
+def _seconds_to_duration(seconds):
+    """Convierte segundos al formato de duración de RouterOS"""
+    parts = []
+    for unit, size in (('w', 604800), ('d', 86400), ('h', 3600), ('m', 60)):
+        value, seconds = divmod(seconds, size)
+        if value:
+            parts.append(f"{value}{unit}")
+    if seconds or not parts:
+        parts.append(f"{seconds}s")
+    return ''.join(parts)
+
+
+class ActiveSessionListener:
+    """Mantiene en memoria /ip/hotspot/active siguiendo los eventos del router"""
+
+    def __init__(self, host, username, password, enabled=True, max_backoff=60,
+                 on_resync=None):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.enabled = enabled
+        self.max_backoff = max_backoff
+        # Se invoca cuando el índice deja de ser confiable o se reconstruye
+        self.on_resync = on_resync
+
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_user = {}
+        self._ready = False
+        self._thread = None
+        self._stop = threading.Event()
+        self._connection = None
+        self._stats = {'resyncs': 0, 'events': 0, 'disconnects': 0}
+
+    @property
+    def ready(self):
+        """Indica si el índice refleja el estado actual del router"""
+        return self._ready
+
+    def ensure_started(self):
+        """Arranca el hilo del listener si aún no está corriendo"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='mikrotik-active-listener', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Detiene el listener y cierra su conexión"""
+        self._stop.set()
+        self._mark_unready()
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.disconnect()
+            except Exception:
+                pass
+
+    def _current(self, row, now):
+        """Copia de la sesión con el uptime avanzado desde que se recibió"""
+        session = dict(row)
+        received_at = session.pop('_received_at', now)
+        elapsed = int(now - received_at)
+        if elapsed > 0 and 'uptime' in session:
+            session['uptime'] = _seconds_to_duration(MikrotikManager.time_to_seconds(session['uptime']) + elapsed)
+        return session
+
+    def get(self, username):
+        """Retorna la sesión activa de un usuario o None"""
+        with self._lock:
+            row = self._by_user.get(username)
+        return self._current(row, time.monotonic()) if row else None
+
+    def sessions(self):
+        """Retorna una copia del índice de sesiones por usuario"""
+        with self._lock:
+            rows = dict(self._by_user)
+        now = time.monotonic()
+        return {user: self._current(row, now) for user, row in rows.items()}
+
+    def stats(self):
+        """Retorna los contadores del listener"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['ready'] = self._ready
+            stats['sessions'] = len(self._by_user)
+        return stats
+
+    def _mark_unready(self):
+        with self._lock:
+            was_ready = self._ready
+            self._ready = False
+            self._by_id = {}
+            self._by_user = {}
+        if was_ready and self.on_resync:
+            self.on_resync()
+
+    def _reset(self, rows):
+        """Reconstruye el índice completo a partir de la tabla actual"""
+        by_id = {}
+        by_user = {}
+        now = time.monotonic()
+        for row in rows:
+            row = dict(row, _received_at=now)
+            if 'id' in row:
+                by_id[row['id']] = row
+                if row.get('user'):
+                    by_user[row['user']] = row
+        with self._lock:
+            self._by_id = by_id
+            self._by_user = by_user
+            self._ready = True
+            self._stats['resyncs'] += 1
+        if self.on_resync:
+            self.on_resync()
+
+    def _apply(self, row):
+        """Aplica un evento de cambio recibido del router"""
+        row_id = row.get('id')
+        if not row_id:
+            return
+        with self._lock:
+            self._stats['events'] += 1
+            previous = self._by_id.pop(row_id, None)
+            if previous and self._by_user.get(previous.get('user')) is previous:
+                del self._by_user[previous['user']]
+            if row.get('.dead') == 'true' or row.get('dead') == 'true':
+                return
+            now = time.monotonic()
+            current = self._current(previous, now) if previous else {}
+            current.update(row)
+            current['_received_at'] = now
+            self._by_id[row_id] = current
+            if current.get('user'):
+                self._by_user[current['user']] = current
+
+    def _run(self):
+        backoff = 0
+        while not self._stop.is_set():
+            try:
+                connection = routeros_api.RouterOsApiPool(
+                    self.host,
+                    username=self.username,
+                    password=self.password,
+                    plaintext_login=True
+                )
+                self._connection = connection
+                api = connection.get_api()
+                active = api.get_resource('/ip/hotspot/active')
+
+                # Resincronizar desde cero antes de seguir los cambios
+                self._reset(active.get())
+                backoff = 0
+                logger.info("Listener de sesiones activas sincronizado")
+
+                # Conexión, login y lectura inicial usan el timeout normal. La
+                # espera de eventos no tiene límite: el keepalive TCP del
+                # socket detecta cuando el router deja de responder
+                connection.set_timeout(None)
+                for row in active.call_async('listen'):
+                    self._apply(row)
+                    if self._stop.is_set():
+                        break
+            except Exception as e:
+                if not self._stop.is_set():
+                    logger.warning(f"Listener de sesiones activas desconectado: {str(e)}")
+            finally:
+                with self._lock:
+                    self._stats['disconnects'] += 1
+                self._mark_unready()
+                if self._connection is not None:
+                    try:
+                        self._connection.disconnect()
+                    except Exception:
+                        pass
+                    self._connection = None
+
+            backoff = min(self.max_backoff, (backoff * 2) or 1)
+            self._stop.wait(backoff)
+
+
+_listener = None
+_listener_pid = None
+
+
+def get_active_listener():
+    """Obtiene el listener de sesiones activas compartido por el proceso"""
+    global _listener, _listener_pid
+    with _pool_lock:
+        if _listener is None or _listener_pid != os.getpid():
+            _listener_pid = os.getpid()
+            _listener = ActiveSessionListener(
+                MIKROTIK_IP,
+                MIKROTIK_USER,
+                MIKROTIK_PASSWORD,
+                enabled=MIKROTIK_LISTENER_ENABLED,
+                max_backoff=MIKROTIK_MAX_BACKOFF,
+                on_resync=lambda: get_snapshot_cache().invalidate(local_only=True)
+            )
+        return _listener
+
+
+class MikrotikManager:
+    """Clase para manejar las operaciones con MikroTik"""
+    
+    def __init__(self, pool=None, cache=None, listener=None):
+        self._pool = pool
+        self._listener = listener
+        self.cache = cache or get_snapshot_cache()
     
-    def get_users(self):
+    @property
+    def pool(self):
+        """Pool de conexiones usado por este manager"""
+        return self._pool or get_connection_pool()
+    
+    @property
+    def listener(self):
+        """Listener de sesiones activas usado por este manager"""
+        return self._listener or get_active_listener()
+    
+    def pool_stats(self):
+        """Retorna las estadísticas del pool de conexiones"""
+        return self.pool.stats()
+    
+    def cache_stats(self):
+        """Retorna las estadísticas de la caché del hotspot"""
+        return self.cache.stats()
+    
+    def listener_stats(self):
+        """Retorna las estadísticas del listener de sesiones activas"""
+        return self.listener.stats()
+    
+    def invalidate_cache(self):
+        """Fuerza la recarga de la caché del hotspot en la próxima lectura"""
+        self.cache.invalidate()
+    
+    def get_users(self, api):
         """Obtiene lista de usuarios"""
         try:
-            return self.api.get_resource("/ip/hotspot/user").get()
-        except Exception as e:
+            return api.get_resource("/ip/hotspot/user").get()
+        except routeros_exceptions.RouterOsApiCommunicationError as e:
             logger.error(f"Error obteniendo usuarios: {str(e)}")
             return []
     
-    def get_active_connections(self):
+    def get_active_connections(self, api):
         """Obtiene conexiones activas"""
         try:
-            return self.api.get_resource("/ip/hotspot/active").get()
-        except Exception as e:
+            return api.get_resource("/ip/hotspot/active").get()
+        except routeros_exceptions.RouterOsApiCommunicationError as e:
             logger.error(f"Error obteniendo conexiones activas: {str(e)}")
             return []
     
+    def _load_snapshot(self):
+        """Descarga las tablas de usuarios y conexiones activas"""
+        with self.pool.connection() as api:
+            users = self.get_users(api)
+            # Con el listener sincronizado las sesiones ya están en memoria
+            active_connections = None if self.listener.ready else self.get_active_connections(api)
+        return users, active_connections
+    
+    def get_active_sessions(self):
+        """Retorna las sesiones activas indexadas por usuario"""
+        if self.listener.ready:
+            return self.listener.sessions()
+        snapshot = self.cache.get(self._load_snapshot)
+        if snapshot.active is None:
+            # La copia se tomó con el listener activo y este se desconectó
+            self.cache.invalidate(local_only=True)
+            snapshot = self.cache.get(self._load_snapshot)
+        return {conn['user']: conn for conn in snapshot.active or [] if 'user' in conn}
+    
     def get_active_users(self):
         """Obtiene información de usuarios activos"""
         try:
-            if not self.connect():
-                return []
-
-            # Obtener usuarios y conexiones activas
-            users = self.get_users()
-            active_connections = self.get_active_connections()
-
-            # Crear diccionario de conexiones activas
-            active_dict = {conn['user']: conn for conn in active_connections}
-            formatted_users = []
-
-            for user in users:
-                username = user.get('name', '')
-                if not username:
-                    continue
-
-                # Verificar si el usuario está activo
-                is_active = username in active_dict
-                uptime = active_dict[username].get('uptime', '0s') if is_active else '0s'
-
-                # Obtener tiempo del ticket
-                ticket_time = user.get('limit-uptime', '0s')
-                
-                # Calcular tiempo restante
-                try:
-                    total_seconds = self.time_to_seconds(ticket_time)
-                    used_seconds = self.time_to_seconds(user.get('uptime', '0s'))
-                    remaining_seconds = max(0, total_seconds - used_seconds)
-                    time_left = self.seconds_to_readable(remaining_seconds)
-                except Exception as e:
-                    logger.error(f"Error calculando tiempo para usuario {username}: {str(e)}")
-                    time_left = "Error"
-
-                # Intentar obtener el usuario de Telegram
-                telegram_user = "Unknown"
-                created_at = "Unknown"
-                created_by = "Unknown"
-                try:
-                    if username == 'default-trial':
-                        continue
-                    
-                    if user.get('comment'):
-                        telegram_match = re.search(r'user: (@?\w+)', user.get('comment', ''))
-                        if telegram_match:
-                            telegram_user = f"{telegram_match.group(1)}"
-                        create_at_match = re.search(r'created_at: (\d{4}-\d{2}-\d{2})', user.get('comment', ''))
-                        if create_at_match:
-                            created_at = create_at_match.group(1)
-                        created_by_match = re.search(r'created_by: (@?\w+)', user.get('comment', ''))
-                        if created_by_match:
-                            created_by = created_by_match.group(1)
-                except Exception as e:
-                    logger.error(f"Error obteniendo usuario de Telegram para {username}: {str(e)}")
-
-                formatted_users.append({
-                    'user': username,
-                    'telegram': telegram_user,
-                    'uptime': ticket_time if 'limit-uptime' in user else '0s',
-                    'time_left': time_left,
-                    'is_active': is_active,
-                    'address': active_dict[username].get('address', 'N/A') if is_active else 'N/A',
-                    'id': user.get('.id', ''),
-                    'total_time_consumed': uptime if is_active else user.get('uptime', '0s'),
-                    'created_at': created_at,
-                    'created_by': created_by
-                })
-            
-            return formatted_users
-            
+            self.listener.ensure_started()
+            snapshot = self.cache.get(self._load_snapshot)
+            if snapshot.formatted is None:
+                snapshot.formatted = [
+                    described for described in map(self.describe_user, snapshot.users)
+                    if described
+                ]
+            sessions = self.get_active_sessions()
+            return [self.merge_session(user, sessions.get(user['user'])) for user in snapshot.formatted]
         except Exception as e:
             logger.error(f"Error obteniendo usuarios activos: {str(e)}")
             return []
-        finally:
-            self.disconnect()
     
+    def describe_user(self, user):
+        """Extrae los datos de un ticket que no dependen de su sesión activa"""
+        username = user.get('name', '')
+        if not username or username == 'default-trial':
+            return None
+
+        # Obtener tiempo del ticket
+        ticket_time = user.get('limit-uptime', '0s')
+        
+        # Calcular tiempo restante
+        try:
+            total_seconds = self.time_to_seconds(ticket_time)
+            used_seconds = self.time_to_seconds(user.get('uptime', '0s'))
+            remaining_seconds = max(0, total_seconds - used_seconds)
+            time_left = self.seconds_to_readable(remaining_seconds)
+        except Exception as e:
+            logger.error(f"Error calculando tiempo para usuario {username}: {str(e)}")
+            time_left = "Error"
+
+        # Intentar obtener el usuario de Telegram
+        telegram_user = "Unknown"
+        created_at = "Unknown"
+        created_by = "Unknown"
+        try:
+            if user.get('comment'):
+                telegram_match = re.search(r'user: (@?\w+)', user.get('comment', ''))
+                if telegram_match:
+                    telegram_user = f"{telegram_match.group(1)}"
+                create_at_match = re.search(r'created_at: (\d{4}-\d{2}-\d{2})', user.get('comment', ''))
+                if create_at_match:
+                    created_at = create_at_match.group(1)
+                created_by_match = re.search(r'created_by: (@?\w+)', user.get('comment', ''))
+                if created_by_match:
+                    created_by = created_by_match.group(1)
+        except Exception as e:
+            logger.error(f"Error obteniendo usuario de Telegram para {username}: {str(e)}")
+
+        return {
+            'user': username,
+            'telegram': telegram_user,
+            'uptime': ticket_time if 'limit-uptime' in user else '0s',
+            'time_left': time_left,
+            'is_active': False,
+            'address': 'N/A',
+            'id': user.get('.id', ''),
+            'total_time_consumed': user.get('uptime', '0s'),
+            'created_at': created_at,
+            'created_by': created_by
+        }
+    
+    def merge_session(self, described, session):
+        """Completa los datos de un ticket con su sesión activa, si la tiene"""
+        if session is None:
+            return dict(described)
+        merged = dict(described)
+        merged['is_active'] = True
+        merged['address'] = session.get('address', 'N/A')
+        merged['total_time_consumed'] = session.get('uptime', '0s')
+        return merged
+    
+    def format_users(self, users, active_connections):
+        """Combina usuarios y conexiones activas en el formato de la aplicación"""
+        active_dict = {conn['user']: conn for conn in active_connections if 'user' in conn}
+        return [
+            self.merge_session(described, active_dict.get(described['user']))
+            for described in map(self.describe_user, users)
+            if described
+        ]
     
     def remove_user(self, username):
         """Elimina un usuario y asegura su desconexión completa"""
+        return self.remove_users([username]).get(username, False)
+    
+    def remove_users(self, usernames):
+        """Elimina varios usuarios y sus sesiones con una sola conexión
+
+        Descarga una vez las tablas de hosts, conexiones activas y usuarios,
+        y envía todas las eliminaciones en bloque. Retorna un diccionario
+        usuario -> True si quedó eliminado por completo.
+        """
+        wanted = set(usernames)
+        results = {username: True for username in wanted}
+        if not wanted:
+            return results
+        
+        logger.info(f"Iniciando proceso de eliminación para {len(wanted)} usuarios: {', '.join(sorted(wanted))}")
         try:
-            # Conectar a MikroTik
-            if not self.connect():
-                logger.error("No se pudo conectar a MikroTik")
-                return False
-            
-            logger.info(f"Iniciando proceso de eliminación para usuario: {username}")
-            success = True
-            
-            # 1. Primero eliminar de la tabla de hosts activos
-            try:
-                hosts = self.api.get_resource("/ip/hotspot/host")
-                host_list = hosts.get(user=username)
-                if host_list:
-                    for host in host_list:
-                        if 'id' in host:
-                            hosts.remove(id=host['id'])
-                            logger.info(f"Host eliminado para usuario {username}")
-                else:
-                    logger.info(f"No se encontraron hosts para el usuario {username}")
-            except Exception as e:
-                logger.warning(f"Error al eliminar host para usuario {username}: {str(e)}")
-                success = False
-            
-            # 2. Luego desconectar de las conexiones activas
-            try:
-                active = self.api.get_resource("/ip/hotspot/active")
-                active_list = active.get(user=username)
-                if active_list:
-                    for conn in active_list:
-                        if 'id' in conn:
-                            active.remove(id=conn['id'])
-                            logger.info(f"Conexión activa eliminada para usuario {username}")
-                else:
-                    logger.info(f"No hay conexiones activas para el usuario {username}")
-            except Exception as e:
-                logger.warning(f"Error al desconectar usuario {username}: {str(e)}")
-                success = False
-            
-            # 3. Finalmente eliminar el usuario
-            try:
-                users = self.api.get_resource("/ip/hotspot/user")
-                user_list = users.get(name=username)
-                if user_list:
-                    for user in user_list:
-                        if 'id' in user:
-                            users.remove(id=user['id'])
-                            logger.info(f"Usuario {username} eliminado")
-                else:
+            with self.pool.connection() as api:
+                hosts = api.get_resource("/ip/hotspot/host")
+                active = api.get_resource("/ip/hotspot/active")
+                users = api.get_resource("/ip/hotspot/user")
+                
+                # Descargar las tres tablas en paralelo
+                host_rows, active_rows, user_rows = [
+                    promise.get() for promise in (hosts.get_async(), active.get_async(), users.get_async())
+                ]
+                
+                found = {row.get('name') for row in user_rows}
+                for username in wanted - found:
                     logger.warning(f"Usuario {username} no encontrado")
-                    success = False
-            except Exception as e:
-                logger.error(f"Error al eliminar usuario {username}: {str(e)}")
-                success = False
-            
-            return success
+                    results[username] = False
+                
+                # 1. Primero hosts y conexiones activas, 2. luego los usuarios
+                phases = [
+                    [(hosts, row, row.get('user'), 'Host') for row in host_rows if row.get('user') in wanted] +
+                    [(active, row, row.get('user'), 'Conexión activa') for row in active_rows if row.get('user') in wanted],
+                    [(users, row, row.get('name'), 'Usuario') for row in user_rows if row.get('name') in wanted]
+                ]
+                for phase in phases:
+                    promises = [
+                        (username, label, resource.remove_async(id=row['id']))
+                        for resource, row, username, label in phase
+                        if 'id' in row
+                    ]
+                    for username, label, promise in promises:
+                        try:
+                            promise.get()
+                            logger.info(f"{label} eliminado para usuario {username}")
+                        except routeros_exceptions.RouterOsApiCommunicationError as e:
+                            logger.warning(f"Error al eliminar {label.lower()} del usuario {username}: {str(e)}")
+                            results[username] = False
+                
+                return results
             
         except Exception as e:
-            logger.error(f"Error eliminando usuario {username}: {str(e)}")
-            return False
+            logger.error(f"Error eliminando usuarios: {str(e)}")
+            return {username: False for username in wanted}
         finally:
-            self.disconnect()
-            logger.info(f"Proceso de eliminación finalizado para usuario {username}")
+            self.invalidate_cache()
+            logger.info(f"Proceso de eliminación finalizado para {len(wanted)} usuarios")
+    
+    def get_expired_users(self, min_age_days=0):
+        """Retorna los tickets sin tiempo restante creados hace al menos min_age_days"""
+        snapshot = self.cache.get(self._load_snapshot)
+        sessions = self.get_active_sessions()
+        today = datetime.now().date()
+        expired = []
+        for user in snapshot.users:
+            username = user.get('name', '')
+            if not username or username == 'default-trial' or username in sessions:
+                continue
+            limit = self.time_to_seconds(user.get('limit-uptime', ''))
+            if not limit or self.time_to_seconds(user.get('uptime', '0s')) < limit:
+                continue
+            created_at = re.search(r'created_at: (\d{4}-\d{2}-\d{2})', user.get('comment') or '')
+            if created_at:
+                age = (today - datetime.strptime(created_at.group(1), '%Y-%m-%d').date()).days
+                if age < min_age_days:
+                    continue
+            elif min_age_days:
+                # Sin fecha de creación no se puede verificar la antigüedad
+                continue
+            expired.append(username)
+        return expired
+    
+    def _build_comment(self, userTelegram, createdBy):
+        """Construye el comentario con el que se registra un ticket"""
+        if userTelegram != 'Web': 
+            userTelegram = f"@{userTelegram}"
+        
+        if createdBy != 'Web': 
+            createdBy = f"@{createdBy}"
+
+        return f"user: {userTelegram} created_at: {datetime.now().strftime('%Y-%m-%d')} created_by: {createdBy}"
     
     def create_user(self, username, password, limit_uptime, userTelegram, createdBy):
         """Crea un nuevo usuario"""
         try:
-            if not self.connect():
-                logger.error("No se pudo conectar a MikroTik")
-                return False
-
             logger.info(f"Creando usuario {username} con límite de tiempo {limit_uptime}")
-            if userTelegram != 'Web': 
-                userTelegram = f"@{userTelegram}"
-            
-            if createdBy != 'Web': 
-                createdBy = f"@{createdBy}"
-
-            comment=f"user: {userTelegram} created_at: {datetime.now().strftime('%Y-%m-%d')} created_by: {createdBy}"
-            self.api.get_resource("/ip/hotspot/user").add(
-                name=username,
-                password=password,
-                limit_uptime=limit_uptime,
-                profile="5M",  # Asignar perfil 5M a todos los usuarios
-                comment=comment
-            )
+            comment = self._build_comment(userTelegram, createdBy)
+            with self.pool.connection() as api:
+                api.get_resource("/ip/hotspot/user").add(
+                    name=username,
+                    password=password,
+                    limit_uptime=limit_uptime,
+                    profile="5M",  # Asignar perfil 5M a todos los usuarios
+                    comment=comment
+                )
+            self.invalidate_cache()
             logger.info(f"Usuario {username} creado con perfil 5M y comentario {comment}")
             return True
         except Exception as e:
             logger.error(f"Error creando usuario: {str(e)}\n{traceback.format_exc()}")
             return False
+    
+    def create_users(self, usernames, limit_uptime, userTelegram, createdBy):
+        """Crea varios usuarios con una sola conexión
+
+        Retorna un diccionario usuario -> None si se creó o el mensaje de error.
+        """
+        usernames = list(usernames)
+        results = {}
+        comment = self._build_comment(userTelegram, createdBy)
+        logger.info(f"Creando {len(usernames)} usuarios con límite de tiempo {limit_uptime}")
+        try:
+            with self.pool.connection() as api:
+                resource = api.get_resource("/ip/hotspot/user")
+                # Enviar todos los comandos antes de esperar las respuestas
+                promises = [
+                    (username, resource.add_async(
+                        name=username,
+                        password=username,
+                        limit_uptime=limit_uptime,
+                        profile="5M",
+                        comment=comment
+                    ))
+                    for username in usernames
+                ]
+                for username, promise in promises:
+                    try:
+                        promise.get()
+                        results[username] = None
+                    except routeros_exceptions.RouterOsApiCommunicationError as e:
+                        logger.error(f"Error creando usuario {username}: {str(e)}")
+                        message = e.original_message
+                        results[username] = message.decode() if isinstance(message, bytes) else str(e)
+        except Exception as e:
+            logger.error(f"Error creando usuarios en lote: {str(e)}\n{traceback.format_exc()}")
+            for username in usernames:
+                results.setdefault(username, str(e))
         finally:
-            self.disconnect()
+            self.invalidate_cache()
+
+        created = sum(1 for error in results.values() if error is None)
+        logger.info(f"Lote creado: {created} de {len(usernames)} usuarios con perfil 5M y comentario {comment}")
+        return results
 
-    def time_to_seconds(self, time_str):
-        """Convierte una cadena de tiempo en segundos"""
-        time_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
-        return sum(int(num) * time_units[unit] for num, unit in re.findall(r'(\d+)([smhd])', time_str))
+    @staticmethod
+    def time_to_seconds(time_str):
+        """Convierte una duración de RouterOS (1w2d3h4m5s) en segundos"""
+        time_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+        return sum(int(num) * time_units[unit] for num, unit in re.findall(r'(\d+)([smhdw])', time_str or ''))
 
     def seconds_to_readable(self, seconds):
         """Convierte segundos a un formato legible"""
@@ -0,0 +1,236 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from telebot.apihelper import ApiTelegramException
+from config import (
+    NOTIFICATION_WORKERS, NOTIFICATION_RATE, NOTIFICATION_MAX_ATTEMPTS, NOTIFICATION_POLL_INTERVAL
+)
+from logger_manager import get_logger
+
+logger = get_logger('notification_queue')
+
+# Largo máximo de un mensaje de texto de Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+class NotificationQueue:
+    """Cola persistente (tabla notifications) de mensajes salientes de Telegram
+
+    Quien encola solo escribe en SQLite y sigue; los envíos los hace un pool
+    de hilos que reserva lotes de la tabla, respeta un máximo de mensajes
+    por segundo y reintenta con espera exponencial. Los mensajes de un mismo
+    chat se envían en orden (los textos consecutivos, unidos en uno solo),
+    los de chats distintos en paralelo.
+    """
+
+    def __init__(self, db, bot, workers=NOTIFICATION_WORKERS, rate=NOTIFICATION_RATE,
+                 max_attempts=NOTIFICATION_MAX_ATTEMPTS, poll_interval=NOTIFICATION_POLL_INTERVAL):
+        self.db = db
+        self.bot = bot
+        self.workers = workers
+        self.min_interval = 1.0 / rate if rate else 0
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._rate_lock = threading.Lock()
+        self._next_send = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_poll = time.monotonic()
+        # Evita subir el mismo comprobante en paralelo para varios administradores
+        self._proof_locks = [threading.Lock() for _ in range(16)]
+
+    @staticmethod
+    def message(chat_id, text, reply_markup=None, parse_mode=None):
+        """Arma una notificación de texto para enqueue()"""
+        if reply_markup is not None and not isinstance(reply_markup, str):
+            reply_markup = reply_markup.to_json()
+        return (chat_id, 'message', {
+            'text': text,
+            'reply_markup': reply_markup,
+            'parse_mode': parse_mode
+        })
+
+    @staticmethod
+    def photo(chat_id, path, caption=None, request_id=None):
+        """Arma una notificación con la imagen guardada en path para enqueue()
+
+        Con request_id la imagen es el comprobante de esa solicitud y se
+        sube una sola vez (ver send_payment_proof).
+        """
+        return (chat_id, 'photo', {
+            'path': str(path) if path else None,
+            'caption': caption,
+            'request_id': request_id
+        })
+
+    def enqueue(self, notifications):
+        """Guarda las notificaciones para enviarlas en segundo plano"""
+        return self.db.enqueue_notifications(list(notifications))
+
+    def stats(self):
+        return self.db.get_notification_stats()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='notification-queue', daemon=True)
+            self._thread.start()
+            logger.info(f"Cola de notificaciones iniciada con {self.workers} hilos")
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def polling_age(self):
+        """Segundos desde la última vez que el hilo leyó la tabla"""
+        return time.monotonic() - self._last_poll
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='notification') as pool:
+            while not self._stop.is_set():
+                batch = self.db.claim_notifications(limit=self.workers * 10)
+                self._last_poll = time.monotonic()
+                if not batch:
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                by_chat = {}
+                for notification in batch:
+                    by_chat.setdefault(notification['chat_id'], []).append(notification)
+                # Esperar el lote completo antes de reservar el siguiente
+                list(pool.map(self._deliver_chat, by_chat.values()))
+
+    def _throttle(self):
+        if not self.min_interval:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_send - now
+            self._next_send = max(now, self._next_send) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    @staticmethod
+    def _coalesce(notifications):
+        """Agrupa los mensajes de texto consecutivos sin botones de un chat
+
+        Cada grupo se envía como un solo mensaje (separados por una línea en
+        blanco) mientras no supere el largo máximo de Telegram.
+        """
+        groups = []
+        for notification in notifications:
+            payload = notification['payload']
+            if groups and notification['kind'] == 'message' and not payload.get('reply_markup'):
+                last = groups[-1]
+                last_payload = last[-1]['payload']
+                length = sum(len(n['payload']['text']) + 2 for n in last) + len(payload['text'])
+                if (last[-1]['kind'] == 'message' and not last_payload.get('reply_markup')
+                        and last_payload.get('parse_mode') == payload.get('parse_mode')
+                        and length <= MAX_MESSAGE_LENGTH):
+                    last.append(notification)
+                    continue
+            groups.append([notification])
+        return groups
+
+    def _deliver_chat(self, notifications):
+        groups = self._coalesce(notifications)
+        for position, group in enumerate(groups):
+            delay = self._deliver(group)
+            if delay:
+                # Mantener el orden del chat: lo que sigue espera al reintento
+                rest = [n['id'] for later in groups[position + 1:] for n in later]
+                if rest:
+                    self.db.postpone_notifications(rest, delay)
+                return
+
+    def _deliver(self, group):
+        """Envía un grupo de notificaciones; retorna los segundos hasta su reintento, o None"""
+        notification = group[0]
+        if len(group) > 1:
+            notification = dict(notification, payload=dict(
+                notification['payload'],
+                text='\n\n'.join(n['payload']['text'] for n in group)
+            ))
+        try:
+            self._throttle()
+            self._send(notification)
+            for sent in group:
+                self.db.complete_notification(sent['id'])
+        except ApiTelegramException as e:
+            if e.error_code in (400, 403):
+                # Chat inexistente, bot bloqueado o mensaje inválido: no se reintenta
+                logger.error(f"Notificación {notification['id']} descartada: {e.description}")
+                for failed in group:
+                    self.db.fail_notification(failed['id'], e.description)
+            elif e.error_code == 429:
+                # El TelegramSender ya agotó sus reintentos: respetar retry_after
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after')
+                return self._retry(group, e.description, retry_after)
+            else:
+                return self._retry(group, e.description)
+        except Exception as e:
+            return self._retry(group, str(e))
+        return None
+
+    def _retry(self, group, error, delay=None):
+        attempts = group[0]['attempts'] + 1
+        ids = ', '.join(str(n['id']) for n in group)
+        if attempts >= self.max_attempts:
+            logger.error(f"Notificación {ids} a {group[0]['chat_id']} falló "
+                         f"tras {attempts} intentos: {error}")
+            for failed in group:
+                self.db.fail_notification(failed['id'], error)
+            return None
+        if delay is None:
+            delay = min(300, 5 * 2 ** (attempts - 1))
+        logger.warning(f"Error enviando notificación {ids}, reintento en {delay}s: {error}")
+        for failed in group:
+            self.db.fail_notification(failed['id'], error, retry_in=delay)
+        return delay
+
+    def _send(self, notification):
+        chat_id = notification['chat_id']
+        payload = notification['payload']
+        if notification['kind'] == 'message':
+            self.bot.send_message(
+                chat_id,
+                payload['text'],
+                reply_markup=payload.get('reply_markup'),
+                parse_mode=payload.get('parse_mode')
+            )
+        elif notification['kind'] == 'photo':
+            try:
+                if payload.get('request_id'):
+                    self.send_payment_proof(chat_id, payload['request_id'], payload['path'],
+                                            caption=payload.get('caption'))
+                else:
+                    with open(payload['path'], 'rb') as photo:
+                        self.bot.send_photo(chat_id, photo, caption=payload.get('caption'))
+            except FileNotFoundError as e:
+                # El comprobante ya no existe (p. ej. la solicitud se procesó antes).
+                # Los errores de red también son OSError: esos siguen al reintento
+                logger.error(f"Error abriendo comprobante {payload['path']}: {str(e)}")
+                self.bot.send_message(chat_id, "❌ Error al enviar el comprobante de pago")
+        else:
+            raise ValueError(f"Tipo de notificación desconocido: {notification['kind']}")
+
+    def send_payment_proof(self, chat_id, request_id, path, caption=None):
+        """Envía el comprobante de una solicitud subiéndolo a Telegram una sola vez
+
+        La primera subida guarda el file_id en la solicitud; los envíos
+        siguientes (a cualquier administrador) lo reutilizan sin leer el
+        archivo. Lanza FileNotFoundError si hay que subirlo y el archivo no existe.
+        """
+        file_id = self.db.get_payment_proof_file_id(request_id)
+        if not file_id:
+            with self._proof_locks[hash(request_id) % len(self._proof_locks)]:
+                file_id = self.db.get_payment_proof_file_id(request_id)
+                if not file_id:
+                    if not path:
+                        raise FileNotFoundError(f"La solicitud {request_id} no tiene comprobante")
+                    with open(path, 'rb') as photo:
+                        sent = self.bot.send_photo(chat_id, photo, caption=caption)
+                    if sent and sent.photo:
+                        # La última variante es la de mayor resolución
+                        self.db.set_payment_proof_file_id(request_id, sent.photo[-1].file_id)
+                    return sent
+        return self.bot.send_photo(chat_id, file_id, caption=caption)
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import threading
+from telebot import types
+import config
+from pricing import get_pricing
+
+def _keyboard_json(markup):
+    # telebot envía tal cual los reply_markup que ya son texto JSON
+    return markup.to_json()
+
+def _build_reply_markup(is_admin):
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    if is_admin:
+        markup.row("👥 Usuarios Activos", "👥 Usuarios Inactivos", "👥 Usuarios Sin Tiempo")
+        markup.row("📝 Solicitudes Pendientes", "🎫 Generar Ticket", "🎫 Generar Lote")
+    else:
+        markup.row("🎫 Solicitar Ticket")
+    return _keyboard_json(markup)
+
+class Catalog:
+    """Planes, precios y teclados para una combinación de tasa y precio por hora"""
+
+    def __init__(self, time_plans, exchange_rate, fixed_price_usd, batch_sizes):
+        self.prices = config.calculate_prices(exchange_rate, fixed_price_usd)
+        self.plans = []
+        for hours in time_plans:
+            minutes = hours * 60
+            plan_key = f"{hours}h" if hours >= 1 else f"{int(minutes)}m"
+            prices = self.prices[plan_key]
+            self.plans.append({
+                'id': plan_key,
+                'name': f"Plan {hours} {'hora' if hours == 1 else 'horas'}",
+                'duration': minutes,
+                'price_usd': prices['usd'],
+                'price_bs': prices['bs']
+            })
+
+        self.plans_json = json.dumps(self.plans).encode('utf-8')
+        self.prices_json = json.dumps(self.prices).encode('utf-8')
+        self.plans_etag = hashlib.sha1(self.plans_json).hexdigest()
+        self.prices_etag = hashlib.sha1(self.prices_json).hexdigest()
+
+        markup = types.InlineKeyboardMarkup()
+        for hours in time_plans:
+            prices = self.prices[f"{hours}h"]
+            btn_text = f"{hours}h - ${prices['usd']} USD (Bs. {prices['bs']})"
+            markup.add(types.InlineKeyboardButton(btn_text, callback_data=f"plan_{hours}"))
+        self.plans_markup = _keyboard_json(markup)
+
+        markup = types.InlineKeyboardMarkup()
+        for hours in time_plans:
+            markup.add(types.InlineKeyboardButton(f"{hours}h", callback_data=f"admin_gen_{hours}"))
+        self.admin_ticket_markup = _keyboard_json(markup)
+
+        markup = types.InlineKeyboardMarkup()
+        for hours in time_plans:
+            markup.add(types.InlineKeyboardButton(f"{hours}h", callback_data=f"admin_batch_{hours}"))
+        self.admin_batch_markup = _keyboard_json(markup)
+
+        sizes = [size for size in batch_sizes if size <= config.BATCH_TICKET_MAX]
+        self.batch_size_markups = {}
+        for hours in time_plans:
+            markup = types.InlineKeyboardMarkup(row_width=len(sizes) or 1)
+            markup.add(*[
+                types.InlineKeyboardButton(str(size), callback_data=f"admin_batchn_{hours}_{size}")
+                for size in sizes
+            ])
+            self.batch_size_markups[str(hours)] = _keyboard_json(markup)
+
+class PlanCatalog:
+    """Arma una sola vez los planes, sus JSON y los teclados del bot
+
+    current() reconstruye el catálogo solo cuando cambia la tasa de cambio
+    o el precio por hora; mientras tanto los handlers y /api/plans
+    reutilizan el mismo objeto, y el ETag de cada JSON permite responder
+    304 a los clientes que ya lo tienen.
+    """
+
+    USER_MARKUP = _build_reply_markup(False)
+    ADMIN_MARKUP = _build_reply_markup(True)
+
+    def __init__(self, rates=None):
+        # rates() retorna (tasa de cambio, precio por hora en USD)
+        self.rates = rates or (lambda: get_pricing().current().rates)
+        self._lock = threading.Lock()
+        self._current = (None, None)
+
+    def current(self):
+        key = (tuple(config.time_plans), *self.rates())
+        built_for, catalog = self._current
+        if key == built_for:
+            return catalog
+        with self._lock:
+            built_for, catalog = self._current
+            if key != built_for:
+                catalog = Catalog(config.time_plans, key[1], key[2], config.batch_ticket_sizes)
+                self._current = (key, catalog)
+            return catalog
+
+    def reply_markup(self, is_admin):
+        return self.ADMIN_MARKUP if is_admin else self.USER_MARKUP
+
+plan_catalog = PlanCatalog()
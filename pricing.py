@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+import config
+from config import PRICING_REFRESH_INTERVAL
+from database_manager import DatabaseManager
+from logger_manager import get_logger
+
+logger = get_logger('pricing')
+
+class PriceTable:
+    """Tabla de precios inmutable; version 0 son los valores del .env"""
+
+    def __init__(self, version, exchange_rate, fixed_price_usd, updated_by=None, updated_at=None):
+        self.version = version
+        self.exchange_rate = exchange_rate
+        self.fixed_price_usd = fixed_price_usd
+        self.updated_by = updated_by
+        self.updated_at = updated_at
+        self.prices = config.calculate_prices(exchange_rate, fixed_price_usd)
+
+    @property
+    def rates(self):
+        return (self.exchange_rate, self.fixed_price_usd)
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'exchange_rate': self.exchange_rate,
+            'fixed_price_usd': self.fixed_price_usd,
+            'updated_by': self.updated_by,
+            'updated_at': self.updated_at
+        }
+
+class PricingService:
+    """Tasa de cambio y precio por hora leídos de la tabla pricing
+
+    current() retorna la tabla vigente sin tocar la base de datos salvo
+    una vez cada refresh_interval segundos, cuando compara la versión de
+    la fila. Si cambió, arma la tabla nueva y reemplaza la referencia de
+    una sola vez: quien ya tenía la anterior la sigue usando completa.
+    Así un cambio hecho desde cualquier proceso llega a todos en menos de
+    un segundo, sin reiniciar nada.
+    """
+
+    def __init__(self, db, refresh_interval=PRICING_REFRESH_INTERVAL):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self._refresh_lock = threading.Lock()
+        self._table = PriceTable(0, config.exchange_rate, config.fixed_price_usd)
+        self._checked_at = 0.0
+        self.refresh()
+
+    def current(self):
+        if time.monotonic() - self._checked_at >= self.refresh_interval:
+            # Un solo hilo consulta; los demás siguen con la tabla actual
+            if self._refresh_lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                finally:
+                    self._refresh_lock.release()
+        return self._table
+
+    def refresh(self):
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        self._checked_at = time.monotonic()
+        row = self.db.get_pricing()
+        if row and row['version'] != self._table.version:
+            self._table = PriceTable(**row)
+            logger.info(f"Precios v{row['version']}: tasa {row['exchange_rate']}, "
+                        f"${row['fixed_price_usd']} por hora")
+        return self._table
+
+    def update(self, exchange_rate, fixed_price_usd, updated_by=None):
+        """Guarda los valores nuevos y los aplica en este proceso de inmediato"""
+        exchange_rate = float(exchange_rate)
+        fixed_price_usd = float(fixed_price_usd)
+        if exchange_rate <= 0 or fixed_price_usd <= 0:
+            raise ValueError("La tasa de cambio y el precio deben ser mayores que cero")
+        if self.db.set_pricing(exchange_rate, fixed_price_usd, updated_by) is None:
+            raise RuntimeError("No se pudieron guardar los precios")
+        return self.refresh()
+
+_pricing = None
+_pricing_pid = None
+
+def get_pricing():
+    """Obtiene el PricingService de este proceso"""
+    global _pricing, _pricing_pid
+    if _pricing is None or _pricing_pid != os.getpid():
+        _pricing = PricingService(DatabaseManager())
+        _pricing_pid = os.getpid()
+    return _pricing
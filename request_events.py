@@ -0,0 +1,99 @@
+import os
+import queue
+import threading
+from config import REQUEST_EVENTS_POLL_INTERVAL
+from logger_manager import get_logger
+
+logger = get_logger('request_events')
+
+# Clave para suscribirse a los eventos de todas las solicitudes
+ALL_REQUESTS = '*'
+
+class RequestStatusBroker:
+    """Entrega los cambios de estado de las solicitudes a quien espera por ellas
+
+    Cualquier proceso que cambia el estado de una solicitud deja una fila en
+    request_events (la escribe un trigger). Un único hilo por proceso lee las
+    filas nuevas y las reparte entre las colas suscritas a cada solicitud.
+    Mientras no hay suscriptores el hilo no consulta la base de datos, y los
+    cambios hechos en este mismo proceso lo despiertan de inmediato.
+    """
+
+    def __init__(self, db, poll_interval=REQUEST_EVENTS_POLL_INTERVAL):
+        self.db = db
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._wakeup = threading.Event()
+        self._last_id = 0
+        self._thread = None
+        self._pid = None
+        db.add_status_listener(self.notify)
+
+    def subscribe(self, request_id):
+        """Retorna una cola que recibirá los eventos de la solicitud
+
+        Con request_id ALL_REQUESTS la cola recibe los eventos de todas.
+        """
+        events = queue.Queue()
+        with self._lock:
+            self._ensure_started()
+            if not self._subscribers:
+                # El hilo estaba inactivo: empezar desde el último evento
+                self._last_id = self.db.get_last_request_event_id()
+            self._subscribers.setdefault(request_id, set()).add(events)
+        self._wakeup.set()
+        return events
+
+    def unsubscribe(self, request_id, events):
+        with self._lock:
+            subscribers = self._subscribers.get(request_id)
+            if subscribers:
+                subscribers.discard(events)
+                if not subscribers:
+                    del self._subscribers[request_id]
+
+    def notify(self, *args):
+        """Despierta al hilo para que lea los eventos nuevos sin esperar"""
+        self._wakeup.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': len(self._subscribers),
+                'subscribers': sum(len(s) for s in self._subscribers.values()),
+                'last_event_id': self._last_id
+            }
+
+    def _ensure_started(self):
+        # Los hilos no sobreviven a un fork (workers de gunicorn)
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._subscribers = {}
+            self._thread = threading.Thread(target=self._run, name='request-events', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._subscribers
+            self._wakeup.wait(None if idle else self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self._dispatch()
+            except Exception as e:
+                logger.error(f"Error repartiendo eventos de solicitudes: {str(e)}")
+
+    def _dispatch(self):
+        with self._lock:
+            if not self._subscribers:
+                return
+            after_id = self._last_id
+
+        for event in self.db.get_request_events(after_id):
+            with self._lock:
+                self._last_id = max(self._last_id, event['id'])
+                subscribers = list(self._subscribers.get(event['request_id'], ()))
+                subscribers.extend(self._subscribers.get(ALL_REQUESTS, ()))
+            for events in subscribers:
+                events.put(event)
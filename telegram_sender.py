@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from telebot import apihelper
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_GROUP_RATE,
+    TELEGRAM_MAX_RETRIES, TELEGRAM_API_URL
+)
+from logger_manager import get_logger
+
+logger = get_logger('telegram_sender')
+
+# Métodos de la API que cuentan para los límites de envío de Telegram
+RATE_LIMITED_PREFIXES = ('send', 'edit', 'forward', 'copy')
+
+class TokenBucket:
+    """Token bucket con reservas: reserve() retorna cuánto esperar por el token"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Los tokens pueden quedar negativos: cada llamador espera su turno
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        """Detiene el bucket (retry_after de Telegram)"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self):
+        with self._lock:
+            now = time.monotonic()
+            return (self.tokens + (now - self.updated) * self.rate >= self.capacity
+                    and now >= self.blocked_until)
+
+class TelegramSender:
+    """Punto único por el que salen las llamadas a la API de Telegram
+
+    Se instala como apihelper.CUSTOM_REQUEST_SENDER, de modo que todos los
+    envíos (send_message, send_photo, reply_to, edit_message_text...) pasan
+    por aquí sin cambiar los handlers. Los métodos de envío esperan un token
+    del bucket global y del bucket del chat (los grupos tienen un límite
+    menor); una respuesta 429 detiene el bucket durante retry_after y la
+    llamada se reintenta. Las demás llamadas (getUpdates, etc.) pasan tal cual.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 chat_burst=TELEGRAM_CHAT_BURST, group_rate=TELEGRAM_GROUP_RATE,
+                 max_retries=TELEGRAM_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chats = {}
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._sent = 0
+        self._rate_limited = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_latency = 0.0
+        self._last_prune = time.monotonic()
+
+    def install(self):
+        """Hace que telebot envíe todas sus peticiones a través de este objeto"""
+        apihelper.CUSTOM_REQUEST_SENDER = self
+        if TELEGRAM_API_URL:
+            apihelper.API_URL = TELEGRAM_API_URL + '/bot{0}/{1}'
+            apihelper.FILE_URL = TELEGRAM_API_URL + '/file/bot{0}/{1}'
+        return self
+
+    def _chat_bucket(self, chat_id):
+        key = str(chat_id)
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_prune > 60:
+                self._last_prune = now
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle()}
+            bucket = self._chats.get(key)
+            if bucket is None:
+                # Los ids de grupos y canales son negativos
+                if key.startswith('-'):
+                    bucket = TokenBucket(self.group_rate, 1)
+                else:
+                    bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self._chats[key] = bucket
+            return bucket
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        method_name = url.rsplit('/', 1)[-1]
+        if not method_name.startswith(RATE_LIMITED_PREFIXES):
+            return self._request(method, url, params, files, timeout, proxies)
+
+        chat_id = params.get('chat_id') if params else None
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        for attempt in range(self.max_retries + 1):
+            wait = self.global_bucket.reserve()
+            if chat_bucket:
+                wait = max(wait, chat_bucket.reserve())
+            if wait > 0:
+                with self._lock:
+                    self._waiting += 1
+                try:
+                    time.sleep(wait)
+                finally:
+                    with self._lock:
+                        self._waiting -= 1
+
+            started = time.monotonic()
+            result = self._request(method, url, params, files, timeout, proxies)
+            latency = time.monotonic() - started
+            with self._lock:
+                self._sent += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+                self._total_latency += latency
+
+            if result.status_code != 429 or attempt == self.max_retries:
+                return result
+
+            retry_after = self._retry_after(result)
+            with self._lock:
+                self._rate_limited += 1
+            logger.warning(f"Telegram limitó {method_name} para el chat {chat_id}: reintento en {retry_after}s")
+            (chat_bucket or self.global_bucket).block(retry_after)
+            if files:
+                # Rebobinar los archivos ya leídos por el intento anterior
+                for value in files.values():
+                    fileobj = value[1] if isinstance(value, tuple) else value
+                    if hasattr(fileobj, 'seek'):
+                        fileobj.seek(0)
+        return result
+
+    @staticmethod
+    def _retry_after(result):
+        try:
+            return int(result.json()['parameters']['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            return 1
+
+    @staticmethod
+    def _request(method, url, params, files, timeout, proxies):
+        return apihelper._get_req_session().request(
+            method, url, params=params, files=files, timeout=timeout, proxies=proxies
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                'waiting': self._waiting,
+                'sent': self._sent,
+                'rate_limited': self._rate_limited,
+                'chats': len(self._chats),
+                'avg_wait_ms': round(self._total_wait / self._sent * 1000, 1) if self._sent else 0,
+                'max_wait_ms': round(self._max_wait * 1000, 1),
+                'avg_latency_ms': round(self._total_latency / self._sent * 1000, 1) if self._sent else 0
+            }
+
+_sender = None
+_sender_pid = None
+
+def get_telegram_sender():
+    """Obtiene el TelegramSender de este proceso, instalándolo en telebot"""
+    global _sender, _sender_pid
+    if _sender is None or _sender_pid != os.getpid():
+        _sender = TelegramSender().install()
+        _sender_pid = os.getpid()
+    return _sender
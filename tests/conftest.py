@@ -0,0 +1,43 @@
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'web')]
+
+# Antes de importar config: sin .env las pruebas no dependen del entorno local
+os.environ.setdefault('CLIENT_BOT_TOKEN', '1:test')
+os.environ.setdefault('ADMIN_IDS', '111,222')
+os.environ.setdefault('MIKROTIK_LISTENER_ENABLED', 'false')
+# Lo que use la base de datos por defecto (la app web, pricing) no toca satelwifi.db
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='satelwifi-tests-'), 'satelwifi.db')
+
+from logger_manager import LoggerManager
+from database_manager import DatabaseManager
+
+# Los registros de las pruebas no van a satelwifi.log ni al servidor de
+# logs: el LoggerManager queda creado sin sus handlers
+_manager = object.__new__(LoggerManager)
+_manager._initialized = True
+_manager.logger = logging.getLogger()
+LoggerManager._instance = _manager
+
+@pytest.fixture
+def db(tmp_path):
+    """DatabaseManager sobre un archivo SQLite temporal"""
+    manager = DatabaseManager(tmp_path / 'test.db')
+    yield manager
+    manager.close_connection()
+
+@pytest.fixture(scope='session')
+def web(tmp_path_factory):
+    """Módulo backend.app con una carpeta de comprobantes temporal"""
+    from backend import app as web_app
+    uploads = tmp_path_factory.mktemp('payment_proofs')
+    web_app.UPLOAD_FOLDER = uploads
+    web_app.PaymentProofRequest.upload_folder = uploads
+    return web_app
@@ -0,0 +1,48 @@
+import sqlite3
+
+import database_manager
+from database_manager import DatabaseManager, MIGRATIONS
+
+def tables(path):
+    with sqlite3.connect(path) as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+def columns(path, table):
+    with sqlite3.connect(path) as conn:
+        return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+def test_empty_database_reaches_the_last_version(db):
+    assert db.get_schema_version() == MIGRATIONS[-1][0]
+    assert {'requests', 'logs', 'mikrotik_users', 'request_events', 'notifications',
+            'pricing', 'telegram_updates'} <= tables(db.db_path)
+    assert {'payment_proof_file_id', 'payment_proof_sha256'} <= columns(db.db_path, 'requests')
+
+def test_versions_are_consecutive():
+    assert [version for version, _, _ in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+def test_older_schema_is_migrated_in_order(tmp_path, monkeypatch):
+    path = tmp_path / 'old.db'
+    monkeypatch.setattr(database_manager, 'MIGRATIONS', MIGRATIONS[:4])
+    old = DatabaseManager(path)
+    assert old.get_schema_version() == 4
+    assert 'pricing' not in tables(path)
+    old.close_connection()
+
+    monkeypatch.setattr(database_manager, 'MIGRATIONS', MIGRATIONS)
+    current = DatabaseManager(path)
+    assert current.get_schema_version() == MIGRATIONS[-1][0]
+    assert {'pricing', 'telegram_updates'} <= tables(path)
+    current.close_connection()
+
+def test_reopening_an_up_to_date_database_is_a_no_op(db):
+    reopened = DatabaseManager(db.db_path)
+    assert reopened.get_schema_version() == MIGRATIONS[-1][0]
+
+def test_request_status_changes_are_recorded_as_events(db):
+    assert db.add_request('REQ1', {'name': '1 hora'}, payment_ref='1234')
+    db.update_request_status('REQ1', 'approved', ticket='T123')
+    with sqlite3.connect(db.db_path) as conn:
+        events = conn.execute(
+            'SELECT request_id, status, ticket FROM request_events ORDER BY id'
+        ).fetchall()
+    assert events == [('REQ1', 'pending', None), ('REQ1', 'approved', 'T123')]
@@ -0,0 +1,124 @@
+import time
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from notification_queue import NotificationQueue
+
+def telegram_error(code, description, retry_after=None):
+    result_json = {'ok': False, 'error_code': code, 'description': description}
+    if retry_after is not None:
+        result_json['parameters'] = {'retry_after': retry_after}
+    return ApiTelegramException('sendMessage', None, result_json)
+
+class FakeBot:
+    """Registra los envíos; cada error de errors se lanza en un envío"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    def send_message(self, chat_id, text, reply_markup=None, parse_mode=None):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text))
+
+def rows(db):
+    conn = db.get_connection()
+    return conn.execute(
+        'SELECT id, status, attempts, next_attempt_at, last_error FROM notifications ORDER BY id'
+    ).fetchall()
+
+def deliver(queue, db):
+    """Un ciclo de _run: reserva lo que está listo y lo envía por chat"""
+    by_chat = {}
+    for notification in db.claim_notifications():
+        by_chat.setdefault(notification['chat_id'], []).append(notification)
+    for notifications in by_chat.values():
+        queue._deliver_chat(notifications)
+
+def make_due(db):
+    db.get_connection().execute('UPDATE notifications SET next_attempt_at = 0')
+    db.get_connection().commit()
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+@pytest.fixture
+def queue(db, bot):
+    return NotificationQueue(db, bot, rate=0, max_attempts=3)
+
+def test_message_is_sent_and_marked(db, bot, queue):
+    queue.enqueue([queue.message(1, 'hola')])
+    deliver(queue, db)
+    assert bot.sent == [('1', 'hola')]
+    assert rows(db)[0][1:3] == ('sent', 0)
+
+def test_failed_send_is_retried_with_exponential_backoff(db, bot, queue):
+    bot.errors = [ConnectionError('sin red'), telegram_error(502, 'Bad Gateway')]
+    queue.enqueue([queue.message(1, 'hola')])
+
+    started = time.time()
+    deliver(queue, db)
+    _, status, attempts, next_attempt_at, error = rows(db)[0]
+    assert (status, attempts, error) == ('pending', 1, 'sin red')
+    assert next_attempt_at == pytest.approx(started + 5, abs=1)
+    # Antes de la espera no se vuelve a reservar
+    assert db.claim_notifications() == []
+
+    make_due(db)
+    started = time.time()
+    deliver(queue, db)
+    _, status, attempts, next_attempt_at, error = rows(db)[0]
+    assert (status, attempts, error) == ('pending', 2, 'Bad Gateway')
+    assert next_attempt_at == pytest.approx(started + 10, abs=1)
+
+    make_due(db)
+    deliver(queue, db)
+    assert bot.sent == [('1', 'hola')]
+    assert rows(db)[0][1] == 'sent'
+
+def test_gives_up_after_max_attempts(db, bot, queue):
+    bot.errors = [ConnectionError('sin red')] * 3
+    queue.enqueue([queue.message(1, 'hola')])
+    for _ in range(3):
+        deliver(queue, db)
+        make_due(db)
+    assert rows(db)[0][1:3] == ('failed', 3)
+    assert db.claim_notifications() == []
+
+def test_rate_limit_waits_retry_after(db, bot, queue):
+    bot.errors = [telegram_error(429, 'Too Many Requests', retry_after=42)]
+    queue.enqueue([queue.message(1, 'hola')])
+    started = time.time()
+    deliver(queue, db)
+    _, status, attempts, next_attempt_at, _ = rows(db)[0]
+    assert (status, attempts) == ('pending', 1)
+    assert next_attempt_at == pytest.approx(started + 42, abs=1)
+
+def test_blocked_chat_is_not_retried(db, bot, queue):
+    bot.errors = [telegram_error(403, 'Forbidden: bot was blocked by the user')]
+    queue.enqueue([queue.message(1, 'hola')])
+    deliver(queue, db)
+    assert rows(db)[0][1:3] == ('failed', 1)
+
+def test_later_messages_of_the_chat_wait_for_the_retry(db, bot, queue):
+    bot.errors = [ConnectionError('sin red')]
+    # Con botones no se unen en un solo mensaje
+    queue.enqueue([
+        queue.message(1, 'primero', reply_markup='{}'),
+        queue.message(1, 'segundo', reply_markup='{}'),
+        queue.message(2, 'otro chat')
+    ])
+    deliver(queue, db)
+    assert bot.sent == [('2', 'otro chat')]
+    first, second, _ = rows(db)
+    assert first[1:3] == ('pending', 1)
+    # Pospuesto sin contar un intento, para salir después del primero
+    assert second[1:3] == ('pending', 0)
+    assert second[3] == pytest.approx(first[3], abs=1)
+
+    make_due(db)
+    deliver(queue, db)
+    assert bot.sent[1:] == [('1', 'primero'), ('1', 'segundo')]
@@ -0,0 +1,94 @@
+import io
+
+import pytest
+
+from telegram_sender import TelegramSender, TokenBucket
+
+API = 'https://api.telegram.org/bot1:test/'
+
+class Response:
+    def __init__(self, status_code, json_data=None):
+        self.status_code = status_code
+        self._json = json_data or {}
+
+    def json(self):
+        return self._json
+
+class FakeApi:
+    """Responde a _request con las respuestas dadas, en orden"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def __call__(self, method, url, params, files, timeout, proxies):
+        self.calls.append((url.rsplit('/', 1)[-1], params, files and files['photo'].read()))
+        return self.responses.pop(0)
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waits = []
+    monkeypatch.setattr('telegram_sender.time.sleep', waits.append)
+    return waits
+
+def sender_with(monkeypatch, api, **kwargs):
+    sender = TelegramSender(**kwargs)
+    monkeypatch.setattr(sender, '_request', api)
+    return sender
+
+def test_token_bucket_spaces_calls_after_the_burst():
+    bucket = TokenBucket(rate=10, capacity=2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1, abs=0.01)
+    assert waits[3] == pytest.approx(0.2, abs=0.01)
+
+def test_blocked_bucket_waits_until_unblocked():
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.block(3)
+    assert bucket.reserve() == pytest.approx(3, abs=0.01)
+    assert not bucket.idle()
+
+def test_groups_get_the_lower_rate(monkeypatch):
+    sender = sender_with(monkeypatch, FakeApi(), chat_rate=1, chat_burst=3, group_rate=0.5)
+    assert sender._chat_bucket(5).rate == 1
+    assert sender._chat_bucket(-100).rate == 0.5
+    assert sender._chat_bucket(-100).capacity == 1
+
+def test_429_blocks_the_chat_and_retries(monkeypatch, sleeps):
+    api = FakeApi(
+        Response(429, {'parameters': {'retry_after': 7}}),
+        Response(200, {'ok': True})
+    )
+    sender = sender_with(monkeypatch, api, max_retries=3)
+    photo = io.BytesIO(b'imagen')
+    result = sender('post', API + 'sendPhoto', params={'chat_id': 5}, files={'photo': photo})
+
+    assert result.status_code == 200
+    # El segundo intento vuelve a leer el archivo desde el principio
+    assert [call[2] for call in api.calls] == [b'imagen', b'imagen']
+    assert sleeps[-1] == pytest.approx(7, abs=0.1)
+    assert sender.stats()['rate_limited'] == 1
+
+def test_gives_up_after_max_retries(monkeypatch, sleeps):
+    api = FakeApi(*[Response(429, {'parameters': {'retry_after': 1}})] * 3)
+    sender = sender_with(monkeypatch, api, max_retries=2)
+    assert sender('post', API + 'sendMessage', params={'chat_id': 5}).status_code == 429
+    assert len(api.calls) == 3
+
+def test_other_methods_are_not_rate_limited(monkeypatch, sleeps):
+    api = FakeApi(*[Response(200)] * 5)
+    sender = sender_with(monkeypatch, api, global_rate=1)
+    for _ in range(5):
+        sender('get', API + 'getUpdates', params={'offset': 1})
+    assert sleeps == []
+    assert sender.stats()['sent'] == 0
+
+def test_refund_request_is_queued_for_every_admin(web):
+    response = web.app.test_client().post('/api/admin/refund', json={
+        'username': 'ticket1', 'reason': 'sin conexión', 'amount': 1
+    })
+    assert response.status_code == 200
+    queued = web.db.claim_notifications()
+    assert sorted(n['chat_id'] for n in queued) == sorted(web.config.ADMIN_IDS)
+    assert all('ticket1' in n['payload']['text'] for n in queued)
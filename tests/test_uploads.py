@@ -0,0 +1,89 @@
+import base64
+import hashlib
+import io
+import json
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+from backend.uploads import ProofWriter
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 4
+
+def leftovers(folder):
+    return sorted(path.name for path in folder.iterdir())
+
+def test_png_is_saved_with_its_hash(tmp_path):
+    proof = ProofWriter(tmp_path, max_size=len(PNG))
+    # La firma llega partida entre dos bloques
+    proof.write(PNG[:3])
+    proof.write(PNG[3:])
+    path = proof.commit()
+    proof.close()
+
+    assert path.suffix == '.png'
+    assert path.read_bytes() == PNG
+    assert proof.sha256 == hashlib.sha256(PNG).hexdigest()
+    assert leftovers(tmp_path) == [path.name]
+
+def test_non_image_is_rejected_with_415(tmp_path):
+    proof = ProofWriter(tmp_path, max_size=1024)
+    with pytest.raises(UnsupportedMediaType) as error:
+        proof.write(b'<html>no es una imagen</html>')
+    assert error.value.code == 415
+    assert leftovers(tmp_path) == []
+
+def test_proof_over_the_limit_is_rejected_with_413(tmp_path):
+    proof = ProofWriter(tmp_path, max_size=len(PNG) - 1)
+    proof.write(PNG[:512])
+    with pytest.raises(RequestEntityTooLarge) as error:
+        proof.write(PNG[512:])
+    assert error.value.code == 413
+    assert leftovers(tmp_path) == []
+
+def test_close_without_commit_removes_the_part_file(tmp_path):
+    proof = ProofWriter(tmp_path, max_size=len(PNG))
+    proof.write(PNG)
+    proof.close()
+    assert leftovers(tmp_path) == []
+
+def test_base64_fallback_goes_through_the_same_checks(web):
+    encoded = base64.b64encode(PNG).decode()
+    proof = web.save_payment_proof('data:image/png;base64,' + encoded)
+    assert proof.path.parent == web.UPLOAD_FOLDER
+    assert proof.path.read_bytes() == PNG
+    assert proof.sha256 == hashlib.sha256(PNG).hexdigest()
+    proof.path.unlink()
+
+    with pytest.raises(UnsupportedMediaType):
+        web.save_payment_proof(base64.b64encode(b'GIF00a' + bytes(200)).decode())
+    # base64 inválido
+    assert web.save_payment_proof('abc') is None
+    assert leftovers(web.UPLOAD_FOLDER) == []
+
+def submit_multipart(client, data):
+    return client.post('/api/submit-request', content_type='multipart/form-data', data={
+        'plan': json.dumps({'name': '1 hora', 'price_usd': 0.19, 'price_bs': 10}),
+        'paymentRef': '1234',
+        'paymentProof': (io.BytesIO(data), 'proof.png')
+    })
+
+def test_submit_request_answers_415_for_a_non_image(web):
+    response = submit_multipart(web.app.test_client(), b'%PDF-1.4' + bytes(200))
+    assert response.status_code == 415
+    assert leftovers(web.UPLOAD_FOLDER) == []
+
+def test_submit_request_answers_413_over_the_limit(web, monkeypatch):
+    monkeypatch.setattr(web.PaymentProofRequest, 'max_proof_size', len(PNG) - 1)
+    response = submit_multipart(web.app.test_client(), PNG)
+    assert response.status_code == 413
+    assert leftovers(web.UPLOAD_FOLDER) == []
+
+def test_submit_request_answers_415_for_a_base64_non_image(web):
+    response = web.app.test_client().post('/api/submit-request', json={
+        'plan': {'name': '1 hora', 'price_usd': 0.19, 'price_bs': 10},
+        'paymentRef': '1234',
+        'paymentProof': base64.b64encode(b'no es una imagen' * 10).decode()
+    })
+    assert response.status_code == 415
+    assert leftovers(web.UPLOAD_FOLDER) == []
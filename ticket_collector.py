@@ -0,0 +1,53 @@
+import threading
+from config import TICKET_GC_INTERVAL, TICKET_GC_MIN_AGE_DAYS
+from logger_manager import get_logger
+
+logger = get_logger('ticket_collector')
+
+class ExpiredTicketCollector:
+    """Elimina periódicamente los tickets cuyo tiempo se agotó por completo"""
+    
+    def __init__(self, mikrotik, db, interval=TICKET_GC_INTERVAL, min_age_days=TICKET_GC_MIN_AGE_DAYS):
+        self.mikrotik = mikrotik
+        self.db = db
+        self.interval = interval
+        self.min_age_days = min_age_days
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def collect(self):
+        """Ejecuta una pasada del recolector y retorna los tickets eliminados"""
+        try:
+            expired = self.mikrotik.get_expired_users(self.min_age_days)
+            if not expired:
+                logger.info("Recolector de tickets: no hay tickets agotados para eliminar")
+                return []
+            
+            results = self.mikrotik.remove_users(expired)
+            removed = [username for username, ok in results.items() if ok]
+            if removed:
+                self.db.remove_users(removed)
+            
+            failed = len(expired) - len(removed)
+            logger.info(f"Recolector de tickets: {len(removed)} tickets agotados eliminados, {failed} con error")
+            return removed
+        except Exception as e:
+            logger.error(f"Error en el recolector de tickets: {str(e)}")
+            return []
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.collect()
+    
+    def start(self):
+        """Inicia el recolector en segundo plano"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ticket-collector', daemon=True)
+        self._thread.start()
+        logger.info(f"Recolector de tickets iniciado (cada {self.interval}s, antigüedad mínima {self.min_age_days} días)")
+    
+    def stop(self):
+        """Detiene el recolector"""
+        self._stop.set()
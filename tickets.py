@@ -0,0 +1,36 @@
+import random
+import string
+from config import BATCH_TICKET_MAX
+from logger_manager import get_logger
+
+logger = get_logger('tickets')
+
+def generate_ticket(length=8):
+    """Genera un ticket aleatorio"""
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+def create_ticket_batch(mikrotik, db, count, hours, userTelegram, createdBy):
+    """Crea varios tickets en MikroTik con una sola conexión y los registra
+
+    Retorna una tupla (creados, fallidos) donde fallidos es un diccionario
+    ticket -> error.
+    """
+    if count < 1 or count > BATCH_TICKET_MAX:
+        raise ValueError(f"La cantidad debe estar entre 1 y {BATCH_TICKET_MAX}")
+    
+    tickets = []
+    while len(tickets) < count:
+        ticket = generate_ticket()
+        if ticket not in tickets:
+            tickets.append(ticket)
+    
+    duration = f"{hours}h"
+    results = mikrotik.create_users(tickets, duration, userTelegram, createdBy)
+    created = [ticket for ticket in tickets if results.get(ticket) is None]
+    failed = {ticket: results[ticket] for ticket in tickets if results.get(ticket) is not None}
+    
+    if created:
+        db.add_mikrotik_users([(ticket, ticket, duration, None) for ticket in created])
+    
+    logger.info(f"Lote de tickets de {duration}: {len(created)} creados, {len(failed)} fallidos")
+    return created, failed
@@ -1,8 +1,11 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, Response
 from flask_cors import CORS
 import os
 import sys
 import json
+import queue
+import threading
+import time
 from datetime import datetime
 import telebot
 from dotenv import load_dotenv
@@ -16,9 +19,11 @@ import logging
 import re
 from telebot import types
 from pathlib import Path
-from logger_manager import get_logger
+from logger_manager import get_logger, read_log_tail, LOG_PATH
 from flask import send_from_directory
+from werkzeug.exceptions import HTTPException
 import uuid
+import hmac
 
 # Inicializar el logger
 logger = get_logger('web_backend')
@@ -29,12 +34,21 @@ sys.path.append(root_dir)
 
 # Importar el bot y sus configuraciones
 import config
-from client_bot import SatelWifiBot
-from database_manager import DatabaseManager
-
-# Inicializar el bot y la base de datos
-bot = SatelWifiBot()
-db = DatabaseManager()
+import tickets
+from request_events import RequestStatusBroker
+from admin_events import AdminEventHub
+from telegram_sender import get_telegram_sender
+from plan_catalog import plan_catalog
+from backend.services import services
+from backend.uploads import ProofUploadRequest, ProofWriter
+from pricing import get_pricing
+
+# Los servicios (MikroTik, Telegram, bot) se crean al primer uso en cada
+# worker; la base de datos se abre ya porque la usan los streams de eventos
+db = services.db
+status_broker = RequestStatusBroker(db)
+# Cada stream SSE ocupa un hilo (o greenlet) del worker durante minutos
+stream_slots = threading.BoundedSemaphore(config.SSE_MAX_STREAMS)
 
 app = Flask(__name__)
 CORS(app)
@@ -63,50 +77,70 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 # Crear la carpeta de uploads si no existe
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 
+class PaymentProofRequest(ProofUploadRequest):
+    upload_folder = UPLOAD_FOLDER
+    max_proof_size = config.PAYMENT_PROOF_MAX_SIZE
+
+# Los comprobantes multipart se escriben en disco mientras llegan
+app.request_class = PaymentProofRequest
+# Límite del cuerpo completo: el comprobante en base64 (4/3 de su tamaño) y algo de margen
+app.config['MAX_CONTENT_LENGTH'] = config.PAYMENT_PROOF_MAX_SIZE * 4 // 3 + 64 * 1024
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def save_payment_proof(base64_string):
-    """Guarda una imagen de comprobante de pago y retorna la ruta"""
+    """Guarda un comprobante recibido en base64 (vía JSON) y retorna su ProofWriter
+
+    Retorna None si el base64 no es válido y lanza HTTPException si la
+    imagen no lo es. La subida multipart no pasa por aquí.
+    """
+    # Validar que el string base64 no esté vacío
+    if not base64_string:
+        logger.error('Base64 string está vacío')
+        return None
+
+    if ',' in base64_string:
+        base64_string = base64_string.split(',')[1]
+
+    # Validar que el string base64 sea válido
     try:
-        # Validar que el string base64 no esté vacío
-        if not base64_string:
-            logger.error('Base64 string está vacío')
-            return None
-            
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        # Validar que el string base64 sea válido
-        try:
-            image_data = base64.b64decode(base64_string)
-        except Exception as e:
-            logger.error(f'Error decodificando base64: {str(e)}')
-            return None
-            
-        # Validar que los datos decodificados sean una imagen válida
-        if len(image_data) < 100:  # Tamaño mínimo para una imagen válida
-            logger.error(f'Datos de imagen muy pequeños: {len(image_data)} bytes')
-            return None
-        
-        # Generar nombre único para el archivo
-        filename = f"{uuid.uuid4()}.jpg"
-        file_path = UPLOAD_FOLDER / filename
-        
-        # Guardar archivo
-        try:
-            with open(file_path, 'wb') as f:
-                f.write(image_data)
-            logger.info(f'Comprobante guardado exitosamente: {file_path}')
-        except Exception as e:
-            logger.error(f'Error escribiendo archivo: {str(e)}')
-            return None
-        
-        return str(file_path.relative_to(Path(__file__).parent))
+        image_data = base64.b64decode(base64_string)
     except Exception as e:
-        logger.error(f'Error guardando imagen: {str(e)}')
+        logger.error(f'Error decodificando base64: {str(e)}')
         return None
 
+    # Las mismas verificaciones que una subida multipart
+    proof = ProofWriter(UPLOAD_FOLDER, config.PAYMENT_PROOF_MAX_SIZE)
+    try:
+        proof.write(image_data)
+        proof.commit()
+    finally:
+        proof.close()
+    return proof
+
+def event_stream(stream, on_close):
+    """Respuesta SSE que ocupa un cupo de stream_slots mientras está abierta
+
+    Sin cupos libres responde 503: EventSource no reintenta y la página
+    pasa a consultar el estado por polling. on_close (la baja de la
+    suscripción) se llama en ambos casos, aunque el stream no haya empezado.
+    """
+    if not stream_slots.acquire(blocking=False):
+        on_close()
+        return jsonify({'error': 'Demasiadas conexiones abiertas'}), 503
+
+    def close():
+        stream_slots.release()
+        on_close()
+
+    response = Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(close)
+    return response
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -129,7 +163,7 @@ def process_base64_image(base64_string):
 def generate_ticket():
     """Genera un nuevo ticket"""
     try:
-        return bot.generate_ticket()
+        return tickets.generate_ticket()
     except Exception as e:
         logger.error(f'Error generando ticket: {str(e)}')
         return None
@@ -208,32 +242,21 @@ def index():
     """Renderiza la página principal"""
     return render_template('index.html', config=config)
 
+def catalog_response(body, etag):
+    """Responde un JSON ya serializado del catálogo, o 304 si el cliente lo tiene"""
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # El cliente puede guardarlo, pero debe revalidarlo (los precios cambian)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/api/plans')
 def get_plans():
     """Obtiene los planes disponibles"""
     try:
-        plans = []
-        print("Time plans:", config.time_plans)  # Debug
-        print("Prices:", config.PRICES)  # Debug
-        for hours in config.time_plans:
-            minutes = hours * 60
-            plan_key = f"{hours}h" if hours >= 1 else f"{int(minutes)}m"
-            prices = config.PRICES[plan_key]
-            
-            plan = {
-                'id': plan_key,
-                'name': f"Plan {hours} {'hora' if hours == 1 else 'horas'}",
-                'duration': minutes,
-                'price_usd': prices['usd'],
-                'price_bs': prices['bs']
-            }
-            print("Adding plan:", plan)  # Debug
-            plans.append(plan)
-        
-        print("Final plans:", plans)  # Debug
-        return jsonify(plans)
+        catalog = plan_catalog.current()
+        return catalog_response(catalog.plans_json, catalog.plans_etag)
     except Exception as e:
-        print("Error in get_plans:", str(e))  # Debug
         logger.error(f'Error obteniendo planes: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
@@ -241,9 +264,8 @@ def get_plans():
 def get_prices():
     """Obtiene los precios de los planes"""
     try:
-        prices = config.PRICES
-        
-        return jsonify(prices)
+        catalog = plan_catalog.current()
+        return catalog_response(catalog.prices_json, catalog.prices_etag)
     except Exception as e:
         logger.error(f'Error obteniendo precios: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -252,21 +274,40 @@ def get_prices():
 def submit_request():
     """Envía una nueva solicitud de ticket"""
     try:
-        data = request.get_json()
-        
-        # Validar datos requeridos
-        if not all(k in data for k in ['plan', 'paymentRef', 'paymentProof']):
-            return jsonify({'error': 'Faltan datos requeridos'}), 400
+        proof = None
+        if request.mimetype == 'multipart/form-data':
+            # Al leer request.files el comprobante ya está escrito en disco
+            try:
+                data = {
+                    'plan': json.loads(request.form['plan']),
+                    'paymentRef': request.form['paymentRef']
+                }
+            except (KeyError, ValueError):
+                return jsonify({'error': 'Faltan datos requeridos'}), 400
+            upload = request.files.get('paymentProof')
+            if upload and upload.stream.size:
+                proof = upload.stream
+                proof.commit()
+        else:
+            data = request.get_json()
+            
+            # Validar datos requeridos
+            if not all(k in data for k in ['plan', 'paymentRef', 'paymentProof']):
+                return jsonify({'error': 'Faltan datos requeridos'}), 400
+            
+            # Procesar y guardar imagen del comprobante
+            if data['paymentProof']:
+                proof = save_payment_proof(data['paymentProof'])
+                if not proof:
+                    return jsonify({'error': 'Error al guardar el comprobante'}), 500
         
         # Generar ID único para la solicitud
         request_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
         
-        # Procesar y guardar imagen del comprobante
         payment_proof_path = None
-        if data['paymentProof']:
-            payment_proof_path = save_payment_proof(data['paymentProof'])
-            if not payment_proof_path:
-                return jsonify({'error': 'Error al guardar el comprobante'}), 500
+        if proof:
+            payment_proof_path = str(proof.path.relative_to(Path(__file__).parent))
+            logger.info(f'Comprobante de {request_id} guardado ({proof.size} bytes, sha256 {proof.sha256})')
         
         # Guardar la solicitud en la base de datos
         success = db.add_request(
@@ -274,7 +315,8 @@ def submit_request():
             plan_data=data['plan'],
             payment_ref=data['paymentRef'],
             payment_proof=payment_proof_path,
-            source='web'
+            source='web',
+            payment_proof_sha256=proof.sha256 if proof else None
         )
         
         if not success:
@@ -292,6 +334,10 @@ def submit_request():
 📦 Plan: {data['plan']['name']}
 💵 Monto: ${data['plan']['price_usd']} / {data['plan']['price_bs']} Bs
 🧾 Ref. Pago: {data['paymentRef']}"""
+        if proof:
+            repeated = db.find_requests_by_proof(proof.sha256, exclude_id=request_id)
+            if repeated:
+                message += f"\n⚠️ Comprobante repetido, ya enviado en: {', '.join(repeated)}"
         
         # Crear botones inline
         markup = types.InlineKeyboardMarkup(row_width=2)
@@ -301,28 +347,24 @@ def submit_request():
         ]
         markup.add(*buttons)
         
+        # Las notificaciones se envían en segundo plano desde el proceso del bot
+        notifications = []
         for admin_id in config.ADMIN_IDS:
-            try:
-                # Enviar mensaje con la información y botones
-                bot.bot.send_message(
-                    admin_id, 
-                    message,
-                    reply_markup=markup,
-                    parse_mode='HTML'
-                )
-                
-                # Enviar comprobante si existe
-                if payment_proof_path:
-                    try:
-                        with open(Path(__file__).parent / payment_proof_path, 'rb') as photo:
-                            bot.bot.send_photo(admin_id, photo)
-                    except Exception as e:
-                        logger.error(f'Error enviando comprobante a admin {admin_id}: {str(e)}')
-                        bot.bot.send_message(admin_id, "❌ Error al enviar el comprobante de pago")
-            except Exception as e:
-                logger.error(f'Error enviando notificación a admin {admin_id}: {str(e)}')
+            notifications.append(services.notifications.message(
+                admin_id, message, reply_markup=markup, parse_mode='HTML'
+            ))
+            if payment_proof_path:
+                notifications.append(services.notifications.photo(
+                    admin_id, Path(__file__).parent / payment_proof_path, request_id=request_id
+                ))
+        if not services.notifications.enqueue(notifications):
+            logger.error(f'Error encolando notificaciones de la solicitud {request_id}')
         
         return jsonify({'requestId': request_id})
+    except HTTPException as e:
+        # Comprobante demasiado grande o que no es una imagen
+        logger.warning(f'Comprobante rechazado: {e.description}')
+        return jsonify({'error': e.description}), e.code
     except Exception as e:
         logger.error(f'Error procesando solicitud: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -343,36 +385,115 @@ def check_status(request_id):
         logger.error(f'Error verificando estado: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/request-events/<request_id>')
+def request_events(request_id):
+    """Envía por Server-Sent Events los cambios de estado de una solicitud
+
+    El stream termina al aprobarse o rechazarse la solicitud, o al cumplirse
+    REQUEST_EVENTS_STREAM_TIMEOUT; en ese caso EventSource se reconecta solo.
+    """
+    # Suscribirse antes de leer el estado para no perder cambios intermedios
+    events = status_broker.subscribe(request_id)
+    request_data = db.get_request(request_id)
+    if not request_data:
+        status_broker.unsubscribe(request_id, events)
+        return jsonify({'error': 'Solicitud no encontrada'}), 404
+
+    def stream():
+        yield 'retry: 3000\n\n'
+        deadline = time.monotonic() + config.REQUEST_EVENTS_STREAM_TIMEOUT
+        data = {'status': request_data['status'], 'ticket': request_data.get('ticket') or ''}
+        while True:
+            if data:
+                yield f'event: status\ndata: {json.dumps(data)}\n\n'
+                if data['status'] in ('approved', 'rejected'):
+                    return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = events.get(timeout=min(15, remaining))
+                data = {'status': event['status'], 'ticket': event['ticket'] or ''}
+            except queue.Empty:
+                # Mantener viva la conexión a través de proxies
+                data = None
+                yield ': keepalive\n\n'
+
+    return event_stream(stream(), lambda: status_broker.unsubscribe(request_id, events))
+
 @app.route('/api/admin/requests', methods=['GET'])
 @login_required
 def get_admin_requests():
     """Obtiene todas las solicitudes pendientes"""
     try:
-        requests = db.get_pending_requests()
-        requests_dict = {}
-        for request in requests:
-            # Asegurarse de que todos los campos existan y convertir bytes a base64 si es necesario
-            payment_proof = request.get('payment_proof', '')
-            if isinstance(payment_proof, bytes):
-                payment_proof = base64.b64encode(payment_proof).decode('utf-8')
-
-            request_data = {
-                'id': request.get('id', ''),
-                'username': request.get('username', ''),
-                'plan_data': request.get('plan_data', {}),
-                'payment_ref': request.get('payment_ref', ''),
-                'payment_proof': payment_proof,
-                'status': request.get('status', 'pending'),
-                'created_at': request.get('created_at', ''),
-                'source': request.get('source', 'web'),
-                'chat_id': request.get('chat_id')
-            }
-            requests_dict[request_data['id']] = request_data
-        return jsonify(requests_dict)
+        return jsonify(load_admin_requests())
     except Exception as e:
         logger.error(f'Error al obtener solicitudes: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+def format_admin_request(request):
+    """Da a una solicitud el formato que espera el panel de administración"""
+    # Asegurarse de que todos los campos existan y convertir bytes a base64 si es necesario
+    payment_proof = request.get('payment_proof', '')
+    if isinstance(payment_proof, bytes):
+        payment_proof = base64.b64encode(payment_proof).decode('utf-8')
+
+    return {
+        'id': request.get('id', ''),
+        'username': request.get('username', ''),
+        'plan_data': request.get('plan_data', {}),
+        'payment_ref': request.get('payment_ref', ''),
+        'payment_proof': payment_proof,
+        'status': request.get('status', 'pending'),
+        'created_at': request.get('created_at', ''),
+        'source': request.get('source', 'web'),
+        'chat_id': request.get('chat_id')
+    }
+
+def load_admin_requests():
+    """Obtiene las solicitudes pendientes con el formato del panel, por id"""
+    requests_dict = {}
+    for request in db.get_pending_requests():
+        request_data = format_admin_request(request)
+        requests_dict[request_data['id']] = request_data
+    return requests_dict
+
+def load_admin_request(request_id):
+    """Obtiene una solicitud pendiente con el formato del panel, o None"""
+    request_data = db.get_request(request_id)
+    if not request_data or request_data['status'] != 'pending':
+        return None
+    return format_admin_request(request_data)
+
+# load_admin_users se define más abajo, junto al endpoint de usuarios
+admin_events = AdminEventHub(status_broker, load_admin_request, load_admin_requests,
+                             lambda: load_admin_users())
+
+@app.route('/api/admin/events')
+@login_required
+def admin_event_stream():
+    """Envía por Server-Sent Events los cambios para el panel de administración
+
+    El primer evento (snapshot) trae las solicitudes pendientes y los
+    usuarios; después solo llegan las diferencias.
+    """
+    events = admin_events.subscribe()
+
+    def stream():
+        yield 'retry: 3000\n\n'
+        deadline = time.monotonic() + config.REQUEST_EVENTS_STREAM_TIMEOUT
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                name, data = events.get(timeout=min(15, remaining))
+                yield f'event: {name}\ndata: {json.dumps(data)}\n\n'
+            except queue.Empty:
+                yield ': keepalive\n\n'
+
+    return event_stream(stream(), lambda: admin_events.unsubscribe(events))
+
 @app.route('/api/admin/requests/<request_id>/approve', methods=['POST'])
 @login_required
 def approve_request(request_id):
@@ -395,7 +516,7 @@ def approve_request(request_id):
         duration_minutes = request_data['plan_data']['duration']
         duration_hours = duration_minutes / 60
         duration = f"{duration_hours}h"
-        if not bot.mikrotik.create_user(ticket, ticket, duration, 'Web', 'Web'):
+        if not services.mikrotik.create_user(ticket, ticket, duration, 'Web', 'Web'):
             return jsonify({'error': 'Error creando usuario en MikroTik'}), 500
         
         # Actualizar estado en la base de datos
@@ -414,12 +535,12 @@ def approve_request(request_id):
         # Notificar al usuario si la solicitud vino del bot
         if request_data.get('chat_id'):
             try:
-                bot.send_message_safe(
+                services.notifications.enqueue([services.notifications.message(
                     request_data['chat_id'],
                     f" Tu solicitud ha sido aprobada.\n"
                     f" Tu ticket es: <code>{ticket}</code>",
                     parse_mode='HTML'
-                )
+                )])
             except Exception as e:
                 logger.error(f'Error notificando al usuario: {str(e)}')
         
@@ -461,11 +582,12 @@ def reject_request(request_id):
         # Notificar al usuario si la solicitud vino del bot
         if request_data.get('chat_id'):
             try:
-                bot.send_message_safe(
+                services.notifications.enqueue([services.notifications.message(
                     request_data['chat_id'],
                     " Lo sentimos, tu solicitud ha sido rechazada.\n"
-                    " Por favor, contacta al administrador para más información."
-                )
+                    " Por favor, contacta al administrador para más información.",
+                    parse_mode='HTML'
+                )])
             except Exception as e:
                 logger.error(f'Error notificando al usuario: {str(e)}')
         
@@ -485,21 +607,56 @@ def system_status():
         
         return jsonify({
             'status': 'ok',
-            'logs': logs
+            'logs': logs,
+            'mikrotik_pool': services.mikrotik.pool_stats(),
+            'hotspot_cache': services.mikrotik.cache_stats(),
+            'active_listener': services.mikrotik.listener_stats(),
+            'request_events': status_broker.stats(),
+            'admin_events': admin_events.stats(),
+            'notifications': services.notifications.stats(),
+            'telegram_sender': get_telegram_sender().stats(),
+            'webhook_pending': db.count_telegram_updates() if config.BOT_MODE == 'webhook' else None,
+            'services': services.stats()
         })
     except Exception as e:
         logger.error(f'Error al obtener estado del sistema: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/healthz')
+def healthz():
+    """Sonda de vida para manager_bots: responde si el worker y la base de datos responden"""
+    try:
+        db.get_schema_version()
+        return jsonify({'status': 'ok'})
+    except Exception as e:
+        logger.error(f'Healthcheck fallido: {str(e)}')
+        return jsonify({'status': 'error', 'error': str(e)}), 503
+
+@app.route('/api/admin/services')
+@login_required
+def services_status():
+    """Estado de los procesos supervisados por manager_bots"""
+    try:
+        with open(config.SUPERVISOR_STATUS_FILE) as f:
+            status = json.load(f)
+    except FileNotFoundError:
+        return jsonify({'error': 'El supervisor no está en ejecución'}), 404
+    except Exception as e:
+        logger.error(f'Error leyendo el estado del supervisor: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+    # Si el archivo no se actualiza, el supervisor dejó de funcionar
+    status['age'] = round(time.time() - status['updated_at'], 1)
+    status['stale'] = status['age'] > status['check_interval'] * 5
+    return jsonify(status)
+
 @app.route('/api/admin/clear-logs', methods=['POST'])
 @login_required
 def clear_logs():
     """Limpia los logs del sistema"""
     try:
         # Limpiar archivo de log
-        log_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'satelwifi.log')
-        if os.path.exists(log_path):
-            with open(log_path, 'w') as f:
+        if os.path.exists(LOG_PATH):
+            with open(LOG_PATH, 'w') as f:
                 f.write('')  # Vaciar el archivo
             logger.info("Logs limpiados correctamente")
             return jsonify({'message': 'Logs limpiados correctamente'})
@@ -520,69 +677,124 @@ def admin_panel():
 def get_active_users():
     """Obtiene la lista de usuarios activos"""
     try:
-        # Obtener usuarios del router MikroTik
-        users = bot.mikrotik.get_active_users()
-        if users is None:
-            users = []
-        
-        # Formatear la información de los usuarios
-        formatted_users = []
-        for user in users:
-            if user.get('username', '') == 'default-trial':
-                continue
-            # Obtener tiempos del usuario
-            ticket_time = user.get('uptime', '0s')  # Tiempo total del ticket
-            consumed_time = user.get('total_time_consumed', '0s')  # Tiempo consumido
-            remaining_time = user.get('time_left', '0s')  # Tiempo restante
-            
-            # Formatear tiempo total del ticket
-            if not ticket_time or ticket_time == '0s':
-                formatted_total = 'Sin límite'
-            else:
-                try:
-                    formatted_total = ticket_time  # Ya viene formateado del MikrotikManager
-                except:
-                    formatted_total = 'Error en formato'
-            
-            # Formatear tiempo consumido
-            if not consumed_time or consumed_time == '0s':
-                formatted_uptime = 'Sin actividad'
-            else:
-                try:
-                    formatted_uptime = consumed_time  # Ya viene formateado del MikrotikManager
-                except:
-                    formatted_uptime = 'Error en formato'
-            
-            
-            formatted_user = {
-                'username': user.get('user', 'Sin nombre'),
-                'telegramUser': user.get('telegram', 'Unknown'),
-                'isActive': user.get('is_active', False),
-                'uptime': formatted_uptime,
-                'totalTime': formatted_total,
-                'timeLeft': remaining_time,
-                'ipAddress': user.get('address', 'Sin IP'),
-                'status': 'active' if user.get('is_active', False) else 'inactive',
-                'createdBy': user.get('created_by', 'Unknown'),
-                'createdAt': user.get('created_at', 'Unknown')
-            }
-            formatted_users.append(formatted_user)
-        
-        # Ordenar usuarios: primero los activos, luego por nombre
-        formatted_users.sort(key=lambda x: (-x['isActive'], x['username']))
-        
-        return jsonify(formatted_users)
+        return jsonify(load_admin_users())
     except Exception as e:
         logger.error(f'Error obteniendo usuarios activos: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+def load_admin_users():
+    """Obtiene los usuarios de MikroTik con el formato del panel de administración"""
+    # Obtener usuarios del router MikroTik
+    users = services.mikrotik.get_active_users()
+    if users is None:
+        users = []
+    
+    # Formatear la información de los usuarios
+    formatted_users = []
+    for user in users:
+        if user.get('username', '') == 'default-trial':
+            continue
+        # Obtener tiempos del usuario
+        ticket_time = user.get('uptime', '0s')  # Tiempo total del ticket
+        consumed_time = user.get('total_time_consumed', '0s')  # Tiempo consumido
+        remaining_time = user.get('time_left', '0s')  # Tiempo restante
+        
+        # Formatear tiempo total del ticket
+        if not ticket_time or ticket_time == '0s':
+            formatted_total = 'Sin límite'
+        else:
+            try:
+                formatted_total = ticket_time  # Ya viene formateado del MikrotikManager
+            except:
+                formatted_total = 'Error en formato'
+        
+        # Formatear tiempo consumido
+        if not consumed_time or consumed_time == '0s':
+            formatted_uptime = 'Sin actividad'
+        else:
+            try:
+                formatted_uptime = consumed_time  # Ya viene formateado del MikrotikManager
+            except:
+                formatted_uptime = 'Error en formato'
+        
+        
+        formatted_user = {
+            'username': user.get('user', 'Sin nombre'),
+            'telegramUser': user.get('telegram', 'Unknown'),
+            'isActive': user.get('is_active', False),
+            'uptime': formatted_uptime,
+            'totalTime': formatted_total,
+            'timeLeft': remaining_time,
+            'ipAddress': user.get('address', 'Sin IP'),
+            'status': 'active' if user.get('is_active', False) else 'inactive',
+            'createdBy': user.get('created_by', 'Unknown'),
+            'createdAt': user.get('created_at', 'Unknown')
+        }
+        formatted_users.append(formatted_user)
+    
+    # Ordenar usuarios: primero los activos, luego por nombre
+    formatted_users.sort(key=lambda x: (-x['isActive'], x['username']))
+    
+    return formatted_users
+
+@app.route('/api/admin/tickets/batch', methods=['POST'])
+@login_required
+def create_ticket_batch():
+    """Genera un lote de tickets con una sola conexión a MikroTik"""
+    try:
+        data = request.get_json() or {}
+        try:
+            count = int(data.get('count', 0))
+            hours = int(data.get('hours', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Cantidad u horas inválidas'}), 400
+        
+        if hours not in config.time_plans:
+            return jsonify({'error': 'Plan no disponible'}), 400
+        if count < 1 or count > config.BATCH_TICKET_MAX:
+            return jsonify({'error': f'La cantidad debe estar entre 1 y {config.BATCH_TICKET_MAX}'}), 400
+        
+        created, failed = tickets.create_ticket_batch(services.mikrotik, db, count, hours, 'Web', 'Web')
+        result = {
+            'success': bool(created),
+            'duration': f"{hours}h",
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'tickets': created,
+            'failed': [{'ticket': ticket, 'error': error} for ticket, error in failed.items()]
+        }
+        logger.info(f'Lote de tickets generado desde la web: {len(created)} creados, {len(failed)} fallidos')
+        return jsonify(result), 200 if created else 500
+    except Exception as e:
+        logger.error(f'Error generando lote de tickets: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/pricing', methods=['GET', 'POST'])
+@login_required
+def admin_pricing():
+    """Consulta o cambia la tasa de cambio y el precio por hora sin reiniciar"""
+    pricing = get_pricing()
+    if request.method == 'GET':
+        return jsonify(pricing.current().to_dict())
+    try:
+        data = request.get_json() or {}
+        try:
+            table = pricing.update(data.get('exchange_rate'), data.get('fixed_price_usd'), 'Web')
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e) or 'Valores inválidos'}), 400
+        logger.info(f'Precios actualizados desde la web: v{table.version}, tasa {table.exchange_rate}, '
+                    f'${table.fixed_price_usd} por hora')
+        return jsonify(table.to_dict())
+    except Exception as e:
+        logger.error(f'Error actualizando precios: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/users/<username>', methods=['DELETE'])
 @login_required
 def delete_user(username):
     """Elimina un usuario del sistema"""
     try:
         # Intentar eliminar el usuario del router
-        if bot.mikrotik.remove_user(username):
+        if services.mikrotik.remove_user(username):
             # Si se eliminó correctamente, eliminar de la base de datos
             db.remove_user(username)
             logger.info(f'Usuario {username} eliminado correctamente')
@@ -594,6 +806,28 @@ def delete_user(username):
         logger.error(f'Error al eliminar usuario {username}: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/users/bulk-delete', methods=['POST'])
+@login_required
+def bulk_delete_users():
+    """Elimina varios usuarios del sistema con una sola conexión"""
+    try:
+        data = request.get_json() or {}
+        usernames = [username for username in data.get('usernames', []) if username]
+        if not usernames:
+            return jsonify({'error': 'No se indicaron usuarios'}), 400
+        
+        results = services.mikrotik.remove_users(usernames)
+        removed = [username for username, ok in results.items() if ok]
+        failed = [username for username, ok in results.items() if not ok]
+        if removed:
+            db.remove_users(removed)
+        
+        logger.info(f'Eliminación en lote: {len(removed)} usuarios eliminados, {len(failed)} con error')
+        return jsonify({'removed': removed, 'failed': failed}), 200 if removed else 500
+    except Exception as e:
+        logger.error(f'Error al eliminar usuarios en lote: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/refund', methods=['POST'])
 def submit_refund():
     """Envía los datos de devolución a los administradores por Telegram"""
@@ -625,12 +859,11 @@ def submit_refund():
         # Unir todas las partes del mensaje
         message = "\n".join(message_parts)
         
-        # Enviar mensaje a todos los administradores
-        for admin_id in config.ADMIN_IDS:
-            try:
-                bot.bot.send_message(admin_id, message)
-            except Exception as e:
-                logger.error(f'Error enviando mensaje a admin {admin_id}: {str(e)}')
+        # Se envía en segundo plano desde el proceso del bot, con reintentos
+        if not services.notifications.enqueue(
+                services.notifications.message(admin_id, message) for admin_id in config.ADMIN_IDS):
+            logger.error('Error encolando la solicitud de devolución')
+            return jsonify({'error': 'No se pudo registrar la solicitud de devolución'}), 500
         
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -640,32 +873,25 @@ def submit_refund():
 @app.route('/api/admin/system-logs')
 @login_required
 def system_logs():
-    """Obtiene los logs del sistema del archivo centralizado"""
+    """Obtiene los logs del sistema del archivo centralizado
+
+    Parámetros opcionales: limit, after (cursor de una respuesta anterior
+    para obtener solo las líneas nuevas), level y source.
+    """
     try:
-        log_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'satelwifi.log')
-        logs = []
-        
-        if os.path.exists(log_path):
-            with open(log_path, 'r') as f:
-                for line in f.readlines()[-1000:]:  # Obtener las últimas 1000 líneas
-                    try:
-                        # Parsear la línea de log
-                        # Formato: timestamp - name - level - message
-                        parts = line.strip().split(' - ', 3)
-                        if len(parts) >= 4:
-                            timestamp, name, level, message = parts
-                            logs.append({
-                                'timestamp': timestamp,
-                                'source': name,
-                                'level': level,
-                                'message': message
-                            })
-                    except Exception as e:
-                        logger.error(f"Error parsing log line: {str(e)}")
-                        continue
+        limit = min(request.args.get('limit', 1000, type=int), 5000)
+        after = request.args.get('after', type=int)
+        logs, cursor, reset = read_log_tail(
+            limit=limit,
+            after=after,
+            level=request.args.get('level') or None,
+            source=request.args.get('source') or None
+        )
         
         return jsonify({
-            'logs': logs
+            'logs': logs,
+            'cursor': cursor,
+            'reset': reset
         })
     except Exception as e:
         logger.error(f"Error reading system logs: {str(e)}")
@@ -681,5 +907,28 @@ def serve_image(filename):
         logger.error(f'Error sirviendo imagen {filename}: {str(e)}')
         return 'Imagen no encontrada', 404
 
+@app.route('/telegram/webhook', methods=['POST'])
+def telegram_webhook():
+    """Recibe las actualizaciones del bot cuando BOT_MODE=webhook"""
+    if config.BOT_MODE != 'webhook' or not config.WEBHOOK_SECRET:
+        return 'Not Found', 404
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(token, config.WEBHOOK_SECRET):
+        logger.warning(f"Webhook rechazado desde {request.remote_addr}: token inválido")
+        return 'Forbidden', 403
+    payload = request.get_data(as_text=True)
+    try:
+        update_id = int(json.loads(payload)['update_id'])
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"Actualización de Telegram inválida: {str(e)}")
+        return 'Bad Request', 400
+    # La procesa el proceso del bot (ver UpdateDispatcher): las de un mismo
+    # chat pueden llegar a distintos workers y la conversación vive allá
+    if not db.store_telegram_update(update_id, payload, config.WEBHOOK_MAX_PENDING):
+        # Telegram reintenta la entrega más tarde
+        logger.warning(f"Cola del webhook llena, actualización {update_id} rechazada")
+        return 'Service Unavailable', 503
+    return ''
+
 if __name__ == '__main__':
     app.run(debug=False, port=5000)
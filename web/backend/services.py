@@ -0,0 +1,56 @@
+import threading
+import telebot
+from config import CLIENT_BOT_TOKEN
+from database_manager import DatabaseManager
+from mikrotik_manager import MikrotikManager
+from notification_queue import NotificationQueue
+from telegram_sender import get_telegram_sender
+
+class WebServices:
+    """Servicios de la app web, cada uno creado al primer uso
+
+    A diferencia de SatelWifiBot no registra handlers: telegram es un
+    cliente que solo envía mensajes. Las actualizaciones que llegan por
+    webhook las procesa el proceso del bot.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._instances = {}
+
+    def _get(self, name, factory):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._instances[name] = factory()
+        return instance
+
+    def _telegram(self):
+        # Todas las llamadas a la API pasan por los límites de envío
+        get_telegram_sender()
+        return telebot.TeleBot(CLIENT_BOT_TOKEN, threaded=False)
+
+    @property
+    def db(self):
+        return self._get('db', DatabaseManager)
+
+    @property
+    def mikrotik(self):
+        return self._get('mikrotik', MikrotikManager)
+
+    @property
+    def telegram(self):
+        return self._get('telegram', self._telegram)
+
+    @property
+    def notifications(self):
+        return self._get('notifications', lambda: NotificationQueue(self.db, self.telegram))
+
+    def stats(self):
+        """Servicios ya creados en este proceso"""
+        with self._lock:
+            return sorted(self._instances)
+
+services = WebServices()
@@ -5,6 +5,7 @@ const app = Vue.createApp({
             currentStep: 1,
             requestId: null,
             checkStatusInterval: null,
+            statusSource: null,
             refundInfo: '',
             plans: [],
             plansLoaded: false,
@@ -54,27 +55,20 @@ const app = Vue.createApp({
             this.currentStep--;
         },
         handleFileUpload(event) {
-            const file = event.target.files[0];
-            if (file) {
-                const reader = new FileReader();
-                reader.onload = (e) => {
-                    this.paymentProof = e.target.result;
-                };
-                reader.readAsDataURL(file);
-            }
+            // El archivo se envía tal cual (multipart), sin convertirlo a base64
+            this.paymentProof = event.target.files[0] || null;
         },
         async submitPayment() {
             try {
+                const form = new FormData();
+                form.append('plan', JSON.stringify(this.selectedPlan));
+                form.append('paymentRef', this.paymentRef);
+                if (this.paymentProof) {
+                    form.append('paymentProof', this.paymentProof);
+                }
                 const response = await fetch('/api/submit-request', {
                     method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
-                        plan: this.selectedPlan,
-                        paymentRef: this.paymentRef,
-                        paymentProof: this.paymentProof
-                    })
+                    body: form
                 });
                 const data = await response.json();
                 if (response.ok) {
@@ -109,9 +103,36 @@ const app = Vue.createApp({
             }
         },
         startStatusCheck() {
-            this.checkStatusInterval = setInterval(this.checkStatus, 5000);
+            if (!window.EventSource) {
+                this.checkStatusInterval = setInterval(this.checkStatus, 5000);
+                return;
+            }
+            this.statusSource = new EventSource(`/api/request-events/${this.requestId}`);
+            this.statusSource.addEventListener('status', (event) => {
+                const data = JSON.parse(event.data);
+                if (data.status === 'approved') {
+                    this.requestStatus = 'approved';
+                    this.ticket = data.ticket;
+                    this.currentStep = 4;
+                    this.stopStatusCheck();
+                } else if (data.status === 'rejected') {
+                    this.requestStatus = 'rejected';
+                    this.currentStep = 4;
+                    this.stopStatusCheck();
+                }
+            });
+            this.statusSource.onerror = () => {
+                if (this.statusSource.readyState === EventSource.CLOSED) {
+                    this.statusSource = null;
+                    this.checkStatusInterval = setInterval(this.checkStatus, 5000);
+                }
+            };
         },
         stopStatusCheck() {
+            if (this.statusSource) {
+                this.statusSource.close();
+                this.statusSource = null;
+            }
             if (this.checkStatusInterval) {
                 clearInterval(this.checkStatusInterval);
             }
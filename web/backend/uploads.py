@@ -0,0 +1,112 @@
+import hashlib
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+# Firmas (magic bytes) de las imágenes aceptadas y la extensión con que se guardan
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+SIGNATURE_LENGTH = max(len(signature) for signature, _ in IMAGE_SIGNATURES)
+
+# Tamaño mínimo para una imagen válida
+MIN_PROOF_SIZE = 100
+
+class ProofWriter:
+    """Archivo en el que se escribe un comprobante a medida que llega
+
+    Cada bloque va directo a un archivo .part en la carpeta de destino: se
+    verifican los primeros bytes contra IMAGE_SIGNATURES, se calcula el
+    sha256 y se corta la subida al superar max_size. commit() lo renombra
+    con su nombre definitivo; close() sin commit() lo borra.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = Path(folder)
+        self.max_size = max_size
+        self.size = 0
+        self.extension = None
+        self.sha256 = None
+        self.path = None
+        self._head = b''
+        self._hash = hashlib.sha256()
+        fd, self._path = tempfile.mkstemp(dir=self.folder, suffix='.part')
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.close()
+            raise RequestEntityTooLarge(f'El comprobante supera {self.max_size // 1024} KB')
+        if self.extension is None and len(self._head) < SIGNATURE_LENGTH:
+            self._head += data[:SIGNATURE_LENGTH - len(self._head)]
+            self._check_signature(final=False)
+        self._hash.update(data)
+        self._file.write(data)
+        return len(data)
+
+    def _check_signature(self, final):
+        for signature, extension in IMAGE_SIGNATURES:
+            if self._head.startswith(signature):
+                self.extension = extension
+                return
+        # Con pocos bytes todavía puede coincidir el comienzo de una firma
+        if final or len(self._head) >= SIGNATURE_LENGTH or not any(
+                signature.startswith(self._head) for signature, _ in IMAGE_SIGNATURES):
+            self.close()
+            raise UnsupportedMediaType('El comprobante debe ser una imagen PNG, JPG o GIF')
+
+    def seek(self, offset, whence=0):
+        # werkzeug rebobina el archivo al terminar la parte; aquí no se lee
+        return 0
+
+    def commit(self):
+        """Cierra el archivo y lo guarda como <uuid>.<extensión>; retorna su ruta"""
+        if self.extension is None:
+            self._check_signature(final=True)
+        if self.size < MIN_PROOF_SIZE:
+            self.close()
+            raise UnsupportedMediaType(f'Datos de imagen muy pequeños: {self.size} bytes')
+        self._file.close()
+        self.path = self.folder / f"{uuid.uuid4()}.{self.extension}"
+        os.replace(self._path, self.path)
+        self._path = None
+        self.sha256 = self._hash.hexdigest()
+        return self.path
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if self._path:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+class ProofUploadRequest(Request):
+    """Request cuyas subidas multipart se escriben en disco con ProofWriter
+
+    Sin upload_folder se usa el comportamiento normal de werkzeug.
+    """
+    upload_folder = None
+    max_proof_size = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_folder is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        writer = ProofWriter(self.upload_folder, self.max_proof_size)
+        self.__dict__.setdefault('_proof_writers', []).append(writer)
+        return writer
+
+    def close(self):
+        # Una subida interrumpida nunca llega a request.files: borrar sus .part
+        for writer in self.__dict__.get('_proof_writers', ()):
+            writer.close()
+        super().close()
@@ -0,0 +1,126 @@
+"""Prueba de carga del servidor web
+
+Abre --streams conexiones SSE a /api/request-events/<id> (como las páginas
+que esperan la aprobación de una solicitud) y, con ellas abiertas, lanza
+--requests peticiones GET de consulta de estado con --concurrency clientes.
+Sirve para comparar WEB_WORKER_CLASS=gthread con gevent:
+
+    python web/loadtest.py --request-id <id de una solicitud pendiente>
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+async def http_get(host, port, path, timeout):
+    """GET HTTP/1.1 mínimo; retorna (código, segundos)"""
+    started = time.monotonic()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status_line.split()[1]), time.monotonic() - started
+    finally:
+        writer.close()
+
+async def open_stream(host, port, path, timeout, opened, results, release):
+    """Mantiene abierto un stream SSE hasta release; registra cuándo llegó el primer evento"""
+    started = time.monotonic()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except Exception:
+        results.append(None)
+        opened.release()
+        return
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+        await writer.drain()
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
+                raise ConnectionError('Conexión cerrada')
+            if line.startswith(b'event: status'):
+                break
+        results.append(time.monotonic() - started)
+    except Exception:
+        results.append(None)
+    finally:
+        opened.release()
+    try:
+        await release.wait()
+    finally:
+        writer.close()
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def report(title, latencies, failures, elapsed=None):
+    line = f"{title}: {len(latencies)} ok, {failures} errores"
+    if elapsed:
+        line += f", {len(latencies) / elapsed:.0f} req/s"
+    if latencies:
+        line += (f", p50 {percentile(latencies, 0.5) * 1000:.0f} ms"
+                 f", p95 {percentile(latencies, 0.95) * 1000:.0f} ms"
+                 f", p99 {percentile(latencies, 0.99) * 1000:.0f} ms"
+                 f", media {statistics.mean(latencies) * 1000:.0f} ms")
+    print(line)
+
+async def main(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    paths = args.path or [f'/api/check-status/{args.request_id}', '/api/plans']
+
+    # Fase 1: streams SSE abiertos durante toda la prueba
+    opened = asyncio.Semaphore(0)
+    release = asyncio.Event()
+    stream_results = []
+    streams = [
+        asyncio.create_task(open_stream(host, port, f'/api/request-events/{args.request_id}',
+                                        args.timeout, opened, stream_results, release))
+        for _ in range(args.streams)
+    ]
+    for _ in range(args.streams):
+        await opened.acquire()
+    connected = [value for value in stream_results if value is not None]
+    report(f"Streams SSE ({args.streams})", connected, len(stream_results) - len(connected))
+
+    # Fase 2: consultas de estado con los streams abiertos
+    latencies = []
+    failures = 0
+    pending = iter(range(args.requests))
+
+    async def client():
+        nonlocal failures
+        for index in pending:
+            try:
+                status, elapsed = await http_get(host, port, paths[index % len(paths)], args.timeout)
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    failures += 1
+            except Exception:
+                failures += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    report(f"Consultas ({args.concurrency} clientes)", latencies, failures, time.monotonic() - started)
+
+    release.set()
+    await asyncio.gather(*streams, return_exceptions=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prueba de carga del servidor web')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--request-id', required=True, help='Solicitud pendiente a la que se suscriben los streams')
+    parser.add_argument('--streams', type=int, default=200, help='Streams SSE abiertos durante la prueba')
+    parser.add_argument('--requests', type=int, default=2000, help='Consultas a realizar')
+    parser.add_argument('--concurrency', type=int, default=100, help='Clientes simultáneos')
+    parser.add_argument('--path', action='append', help='Ruta a consultar (se puede repetir)')
+    parser.add_argument('--timeout', type=float, default=30, help='Espera máxima por respuesta (s)')
+    asyncio.run(main(parser.parse_args()))
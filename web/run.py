@@ -1,12 +1,36 @@
+import json
+import logging
 import os
 import sys
+import time
+import _thread
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
 
 # Añadir el directorio raíz al path para importar los módulos existentes
 root_dir = Path(__file__).parent.parent
 sys.path.append(str(root_dir))
 
+from config import (
+    WEB_WORKER_CLASS, WEB_WORKERS, WEB_THREADS, WEB_WORKER_CONNECTIONS, WEB_TIMEOUT, WEB_HEALTH_PORT
+)
+
+gevent_missing = False
+if WEB_WORKER_CLASS == 'gevent' and os.getenv('FLASK_ENV') != 'development':
+    # Parchear antes de importar la app: sockets, locks, colas y sleep pasan a
+    # ceder el control, así los streams SSE y las llamadas a MikroTik y
+    # Telegram esperan en un greenlet en lugar de ocupar un hilo
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+    except ImportError:
+        WEB_WORKER_CLASS = 'gthread'
+        gevent_missing = True
+
 from backend.app import app
+from logger_manager import get_logger, SharedLogHandler
+
+logger = get_logger('web_server')
 
 if __name__ == '__main__':
     # Change to the script's directory
@@ -23,6 +47,76 @@ if __name__ == '__main__':
     else:
         # Modo producción - usar Gunicorn
         import gunicorn.app.base
+        from gunicorn import glogging
+
+        class GunicornLogger(glogging.Logger):
+            """Envía los logs de gunicorn al archivo compartido
+
+            Los errores pasan por el logger raíz; los accesos van solo al
+            archivo, para que las consultas de estado no llenen system_logs
+            ni la consola.
+            """
+            def setup(self, cfg):
+                super().setup(cfg)
+                for log in (self.error_log, self.access_log):
+                    for handler in log.handlers[:]:
+                        log.removeHandler(handler)
+                self.error_log.propagate = True
+                self.access_log.propagate = False
+                for handler in logging.getLogger().handlers:
+                    if isinstance(handler, SharedLogHandler):
+                        self.access_log.addHandler(handler)
+
+            def access(self, resp, req, environ, request_time):
+                # Las sondas de monitoreo externas llegan cada pocos segundos
+                if environ.get('PATH_INFO') == '/healthz':
+                    return
+                super().access(resp, req, environ, request_time)
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            """Responde la sonda del supervisor desde el proceso principal
+
+            No pasa por los workers: que tengan todos sus hilos ocupados
+            (streams SSE) no es una falla. Está sano mientras algún worker
+            siga enviando su heartbeat al arbiter, que ya reemplaza a los
+            que dejan de hacerlo.
+            """
+            arbiter = None
+            timeout = 5
+
+            def do_GET(self):
+                now = time.time()
+                alive = 0
+                for worker in list(self.arbiter.WORKERS.values()):
+                    try:
+                        if now - worker.tmp.last_update() <= self.arbiter.timeout:
+                            alive += 1
+                    except (OSError, ValueError):
+                        pass
+                body = json.dumps({'workers': alive}).encode()
+                self.send_response(200 if alive else 503)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        health_server = None
+
+        def start_health_server(arbiter):
+            global health_server
+            HealthHandler.arbiter = arbiter
+            health_server = HTTPServer(('127.0.0.1', WEB_HEALTH_PORT), HealthHandler)
+            # Sin threading.Thread: con gevent su evento de inicio puede quedar
+            # pendiente al hacer fork y el worker lo reinicia a medio notificar
+            _thread.start_new_thread(health_server.serve_forever, ())
+
+        def close_health_server(arbiter, worker):
+            # Los workers heredan el socket pero no el hilo que lo atiende
+            if health_server:
+                health_server.socket.close()
 
         class StandaloneApplication(gunicorn.app.base.BaseApplication):
             def __init__(self, app, options=None):
@@ -37,15 +131,29 @@ if __name__ == '__main__':
             def load(self):
                 return self.application
 
+        if gevent_missing:
+            logger.warning("WEB_WORKER_CLASS=gevent pero gevent no está instalado: se usan workers gthread")
+
         options = {
             'bind': '0.0.0.0:5000',
-            'workers': 3,  # (2 x num_cores) + 1
-            'worker_class': 'sync',
-            'timeout': 120,
-            'accesslog': str(root_dir / 'satelwifi.log'),
-            'errorlog': str(root_dir / 'satelwifi.log'),
-            'capture_output': True,
-            'loglevel': 'info'
+            'workers': WEB_WORKERS,  # (2 x num_cores) + 1
+            'worker_class': WEB_WORKER_CLASS,
+            'timeout': WEB_TIMEOUT,
+            # Los logs llegan a satelwifi.log a través de GunicornLogger, así
+            # solo un proceso escribe (y rota) el archivo
+            'accesslog': '-',
+            'errorlog': '-',
+            'logger_class': GunicornLogger,
+            'loglevel': 'info',
+            'when_ready': start_health_server,
+            'post_fork': close_health_server
         }
 
+        if WEB_WORKER_CLASS == 'gevent':
+            options['worker_connections'] = WEB_WORKER_CONNECTIONS
+        else:
+            # Hilos por worker: los streams SSE de estado quedan abiertos
+            options['threads'] = WEB_THREADS
+
+        logger.info(f"Iniciando gunicorn con {WEB_WORKERS} workers {WEB_WORKER_CLASS}")
         StandaloneApplication(app, options).run()
@@ -0,0 +1,77 @@
+import threading
+import time
+from telebot import types
+from config import WEBHOOK_POLL_INTERVAL
+from logger_manager import get_logger
+
+logger = get_logger('webhook_dispatcher')
+
+class UpdateDispatcher:
+    """Entrega al bot las actualizaciones que la app web recibe por webhook
+
+    /telegram/webhook puede llegar a cualquier worker de gunicorn: solo
+    guarda la actualización en telegram_updates y responde. Este hilo, en
+    el proceso del bot, las lee en el orden de Telegram y las pasa a
+    DispatchingTeleBot, así el orden por chat y el estado de las
+    conversaciones (user_states) viven en un único proceso.
+    """
+
+    def __init__(self, bot, db, poll_interval=WEBHOOK_POLL_INTERVAL, batch_size=100):
+        self.bot = bot
+        self.db = db
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_poll = time.monotonic()
+        self._processed = 0
+        self._errors = 0
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='webhook-updates', daemon=True)
+            self._thread.start()
+            logger.info("Lectura de actualizaciones del webhook iniciada")
+
+    def stop(self):
+        self._stop.set()
+
+    def polling_age(self):
+        """Segundos desde la última lectura completa de la tabla"""
+        return time.monotonic() - self._last_poll
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processed': self._processed,
+                'errors': self._errors,
+                'pending': self.db.count_telegram_updates()
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            rows = self.db.get_telegram_updates(self.batch_size)
+            updates = []
+            for update_id, payload in rows:
+                try:
+                    updates.append(types.Update.de_json(payload))
+                except Exception as e:
+                    logger.error(f"Actualización {update_id} inválida: {str(e)}")
+            failed = False
+            if updates:
+                try:
+                    # Solo encola los handlers: no espera a que terminen
+                    self.bot.process_new_updates(updates)
+                except Exception as e:
+                    failed = True
+                    logger.error(f"Error procesando actualizaciones del webhook: {str(e)}")
+            if rows:
+                self.db.delete_telegram_updates([update_id for update_id, _ in rows])
+            with self._lock:
+                self._processed += len(updates)
+                self._errors += failed
+            self._last_poll = time.monotonic()
+            if len(rows) < self.batch_size:
+                self._stop.wait(self.poll_interval)